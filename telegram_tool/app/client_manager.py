@@ -4,8 +4,10 @@
 """
 
 import asyncio
+import functools
 import json
 import logging
+import time
 from typing import Optional
 
 from telethon import TelegramClient, events
@@ -13,12 +15,60 @@ from sqlalchemy.orm import Session
 
 try:
     from .database import SessionLocal
-    from .models import Account, ForwardConfig
-    from .config import SESSION_DIR
+    from .models import Account, Project
+    from .config import (
+        SESSION_DIR, FORWARD_QUEUE_SIZE, FORWARD_WORKERS, FLOOD_SLEEP_THRESHOLD, FLOOD_RETRY_LIMIT,
+        ACCOUNT_SEND_RATE, ACCOUNT_SEND_BURST, CHAT_SEND_RATE, CHAT_SEND_BURST,
+        FORWARD_COALESCE_MS, FORWARD_BATCH_MAX, FORWARD_COALESCE_BUFFER, FORWARD_DEDUP_WINDOW, FORWARD_DEDUP_MAX,
+        RECONNECT_CONCURRENCY, RECONNECT_STAGGER_MS,
+        SUPERVISOR_PING_INTERVAL, SUPERVISOR_BACKOFF_BASE, SUPERVISOR_BACKOFF_MAX,
+        SUPERVISOR_CIRCUIT_THRESHOLD, SUPERVISOR_CIRCUIT_COOLDOWN,
+        OUTBOX_ENABLED, OUTBOX_FLUSH_MS, OUTBOX_BATCH_SIZE, OUTBOX_REPLAY_MAX_AGE,
+        FORWARD_LATENCY_WINDOW, SHARD_COUNT, SHARD_INDEX, SHARD_RPC_TIMEOUT, SESSION_BACKEND,
+        CLIENT_IDLE_TIMEOUT, CLIENT_POOL_MAX, MEDIA_CACHE_SIZE,
+    )
+    from .connection_supervisor import ConnectionSupervisor
+    from .dedup import DedupCache
+    from .outbox import ForwardOutbox
+    from .entity_cache import EntityCache, INVALID_PEER_ERRORS, chat_key
+    from .forward_queue import ForwardQueue, ForwardJob, ForwardCoalescer
+    from .rate_limiter import RateLimiter
+    from .forward_rules import ForwardDispatcher
+    from .event_filters import forward_event, ForwardNewMessage
+    from .shard import ShardCoordinator, shard_of
+    from .latency import ForwardLatencyTracker, latency_report
+    from .metrics import registry, gauge, counter_family, forward_filtered, telethon_reconnects
+    from .session_store import session_store, remove_session
+    from .client_pool import OnDemandPool, ROLE_SCHEDULE
+    from .media_copy import MessageCopier
 except ImportError:
     from database import SessionLocal
-    from models import Account, ForwardConfig
-    from config import SESSION_DIR
+    from models import Account, Project
+    from config import (
+        SESSION_DIR, FORWARD_QUEUE_SIZE, FORWARD_WORKERS, FLOOD_SLEEP_THRESHOLD, FLOOD_RETRY_LIMIT,
+        ACCOUNT_SEND_RATE, ACCOUNT_SEND_BURST, CHAT_SEND_RATE, CHAT_SEND_BURST,
+        FORWARD_COALESCE_MS, FORWARD_BATCH_MAX, FORWARD_COALESCE_BUFFER, FORWARD_DEDUP_WINDOW, FORWARD_DEDUP_MAX,
+        RECONNECT_CONCURRENCY, RECONNECT_STAGGER_MS,
+        SUPERVISOR_PING_INTERVAL, SUPERVISOR_BACKOFF_BASE, SUPERVISOR_BACKOFF_MAX,
+        SUPERVISOR_CIRCUIT_THRESHOLD, SUPERVISOR_CIRCUIT_COOLDOWN,
+        OUTBOX_ENABLED, OUTBOX_FLUSH_MS, OUTBOX_BATCH_SIZE, OUTBOX_REPLAY_MAX_AGE,
+        FORWARD_LATENCY_WINDOW, SHARD_COUNT, SHARD_INDEX, SHARD_RPC_TIMEOUT, SESSION_BACKEND,
+        CLIENT_IDLE_TIMEOUT, CLIENT_POOL_MAX, MEDIA_CACHE_SIZE,
+    )
+    from connection_supervisor import ConnectionSupervisor
+    from dedup import DedupCache
+    from outbox import ForwardOutbox
+    from entity_cache import EntityCache, INVALID_PEER_ERRORS, chat_key
+    from forward_queue import ForwardQueue, ForwardJob, ForwardCoalescer
+    from rate_limiter import RateLimiter
+    from forward_rules import ForwardDispatcher
+    from event_filters import forward_event, ForwardNewMessage
+    from shard import ShardCoordinator, shard_of
+    from latency import ForwardLatencyTracker, latency_report
+    from metrics import registry, gauge, counter_family, forward_filtered, telethon_reconnects
+    from session_store import session_store, remove_session
+    from client_pool import OnDemandPool, ROLE_SCHEDULE
+    from media_copy import MessageCopier
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +76,58 @@ logger = logging.getLogger(__name__)
 class ClientManager:
     """Telegram 客户端管理器（单例）"""
 
-    def __init__(self):
+    def __init__(self, shard: Optional[tuple[int, int]] = None):
+        # 分片模式下为 (分片序号, 分片总数)，只负责 account_id % 总数 == 序号 的账号
+        self.shard = shard
         self.clients: dict[int, TelegramClient] = {}       # account_id -> client
-        self._bg_tasks: dict[int, asyncio.Task] = {}       # account_id -> background task
         self._pending_logins: dict[int, TelegramClient] = {}  # account_id -> client (登录中)
         self._qr_logins: dict[int, dict] = {}              # account_id -> qr login state
+        self._start_locks: dict[int, asyncio.Lock] = {}    # account_id -> 启动锁，避免同一账号并发启动
+        self.reconnect_progress: dict[int, dict] = {}      # account_id -> 启动重连进度
+        # 发件人白名单匹配统计（sender_fetches 即走 get_sender 的次数）
+        self.sender_stats: dict[str, int] = {
+            "id_matched": 0, "username_matched": 0, "sender_fetches": 0, "rejected": 0,
+        }
+        # 持久化发件箱：入队前登记，完成后标记，重启后重放未完成的转发
+        self.outbox = ForwardOutbox(OUTBOX_ENABLED, OUTBOX_FLUSH_MS / 1000, OUTBOX_BATCH_SIZE)
+        # 端到端转发延迟（按账号、按目标的滚动直方图）
+        self.latency = ForwardLatencyTracker(FORWARD_LATENCY_WINDOW)
+        # 转发队列：处理器只入队，由 worker 异步执行转发
+        self.forward_queue = ForwardQueue(
+            self._do_forward, maxsize=FORWARD_QUEUE_SIZE, workers=FORWARD_WORKERS,
+            outbox=self.outbox, latency=self.latency,
+        )
+        # 短窗口合并同一来源的消息，一次 forward_messages 转发多条（保持相册完整）
+        self.forward_coalescer = ForwardCoalescer(
+            self.forward_queue, FORWARD_COALESCE_MS / 1000, max_batch=FORWARD_BATCH_MAX,
+            max_buffered=FORWARD_COALESCE_BUFFER,
+        )
+        # 所有客户端共用的转发规则分发器（不可变快照，热更新时整体替换）
+        self.dispatcher = ForwardDispatcher()
+        # 复制模式目标：按 file reference 发送副本
+        self.copier = MessageCopier(MEDIA_CACHE_SIZE)
+        # 跨账号去重：同一广播被多个小号收到时只转发一份
+        self.dedup = DedupCache(FORWARD_DEDUP_WINDOW, FORWARD_DEDUP_MAX)
+        # 统一的连接监管（断线重连、熔断、存活检测）
+        self.supervisor = ConnectionSupervisor(
+            self._supervised_reconnect,
+            ping_interval=SUPERVISOR_PING_INTERVAL,
+            backoff_base=SUPERVISOR_BACKOFF_BASE,
+            backoff_max=SUPERVISOR_BACKOFF_MAX,
+            circuit_threshold=SUPERVISOR_CIRCUIT_THRESHOLD,
+            circuit_cooldown=SUPERVISOR_CIRCUIT_COOLDOWN,
+        )
+        # 定时发送目标的实体解析缓存（持久化）
+        self.entity_cache = EntityCache()
+        # 所有出站发送（转发 + 定时消息）共用的限速器
+        self.rate_limiter = RateLimiter(
+            ACCOUNT_SEND_RATE, ACCOUNT_SEND_BURST, CHAT_SEND_RATE, CHAT_SEND_BURST,
+            max_retries=FLOOD_RETRY_LIMIT,
+        )
+        # 只用于定时任务的账号：按需连接，空闲断开，同时连接数受上限约束
+        self.pool = OnDemandPool(self.stop_client, CLIENT_IDLE_TIMEOUT, CLIENT_POOL_MAX)
+        self._on_demand: set[int] = set()                  # 角色为 schedule 的账号
+        registry.register_collector(self.collect_metrics)
 
     # ==================== 事件处理器辅助 ====================
 
@@ -48,12 +145,43 @@ class ClientManager:
 
     async def start_client(self, account: Account) -> bool:
         """启动并连接一个账号的 Telegram 客户端"""
-        session_path = str(SESSION_DIR / account.session_name)
+        lock = self._start_locks.setdefault(account.id, asyncio.Lock())
+        async with lock:
+            # 等锁期间可能已被其他协程连上（如启动重连与定时任务同时触发）
+            if self.is_connected(account.id):
+                self.pool.touch(account.id)
+                return True
+            if account.role != ROLE_SCHEDULE:
+                self._on_demand.discard(account.id)
+                return await self._start_client(account)
+
+            # 按需连接：先清理已断开的旧客户端，再占用连接池名额
+            self._on_demand.add(account.id)
+            stale = self.clients.pop(account.id, None)
+            if stale:
+                try:
+                    await stale.disconnect()
+                except Exception:
+                    pass
+            await self.pool.reserve(account.id)
+            ok = await self._start_client(account)
+            if not ok:
+                self.pool.discard(account.id)
+            return ok
+
+    async def _start_client(self, account: Account) -> bool:
+        if SESSION_BACKEND == "database":
+            session = await session_store.open(account.session_name)
+        else:
+            session = str(SESSION_DIR / account.session_name)
 
         client = TelegramClient(
-            session_path,
+            session,
             int(account.api_id),
             account.api_hash,
+            flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD,
+            # 按需连接的账号不处理更新流
+            receive_updates=account.role != ROLE_SCHEDULE,
         )
 
         try:
@@ -71,18 +199,8 @@ class ClientManager:
             me = await client.get_me()
             self._update_account_info(account.id, me)
 
-            # 清除旧处理器，设置新消息转发处理器
-            self._remove_all_handlers(client)
-            self._setup_handlers(account.id, client)
-
-            self.clients[account.id] = client
+            await self._activate(account.id, client)
             logger.info(f"Client started: {account.name} (@{me.username or me.first_name})")
-
-            # 后台保持连接
-            self._bg_tasks[account.id] = asyncio.create_task(
-                self._keep_alive(account.id, client)
-            )
-
             return True
 
         except Exception as e:
@@ -94,16 +212,21 @@ class ClientManager:
             # 连接失败不修改登录状态，下次还能重试
             return False
 
+    async def _activate(self, account_id: int, client: TelegramClient):
+        """已授权的客户端投入使用：常驻账号注册转发处理器并交由监管者保活，按需账号登记到连接池"""
+        self.clients[account_id] = client
+        if account_id in self._on_demand:
+            await self.pool.reserve(account_id)
+            return
+        # 清除旧处理器，设置新消息转发处理器
+        self._remove_all_handlers(client)
+        self._setup_handlers(account_id, client)
+        self.supervisor.watch(account_id, client)
+
     async def stop_client(self, account_id: int):
         """停止一个账号的客户端"""
-        # 取消后台任务
-        task = self._bg_tasks.pop(account_id, None)
-        if task:
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
+        self.supervisor.unwatch(account_id)
+        self.pool.discard(account_id)
 
         client = self.clients.pop(account_id, None) or self._pending_logins.pop(account_id, None)
         if client:
@@ -112,10 +235,16 @@ class ClientManager:
 
     async def stop_all(self):
         """停止所有客户端"""
+        await self.supervisor.stop()
+        await self.forward_coalescer.stop()
+        await self.forward_queue.stop()
+        await self.outbox.stop()
+        await self.pool.stop()
         for aid in list(self.clients.keys()):
             await self.stop_client(aid)
         for aid in list(self._pending_logins.keys()):
             await self.stop_client(aid)
+        await session_store.stop()
         logger.info("All clients stopped")
 
     # ==================== 登录流程 ====================
@@ -167,19 +296,7 @@ class ClientManager:
             self._update_account_info(account_id, me)
             # 登录成功：从 pending 移到正式 clients
             self._pending_logins.pop(account_id, None)
-            self.clients[account_id] = client
-
-            # 重新设置处理器
-            self._remove_all_handlers(client)
-            self._setup_handlers(account_id, client)
-
-            # 启动后台保活
-            old_task = self._bg_tasks.pop(account_id, None)
-            if old_task:
-                old_task.cancel()
-            self._bg_tasks[account_id] = asyncio.create_task(
-                self._keep_alive(account_id, client)
-            )
+            await self._activate(account_id, client)
 
             return {
                 "success": True,
@@ -202,15 +319,13 @@ class ClientManager:
                 pass
         await self.stop_client(account_id)
         self._update_account_logged_in(account_id, False)
-        # 删除 session 文件
-        import os
+        await self.entity_cache.forget_account(account_id)
+        # 删除会话数据
         db = SessionLocal()
         try:
             account = db.query(Account).get(account_id)
             if account:
-                session_file = str(SESSION_DIR / f"{account.session_name}.session")
-                if os.path.exists(session_file):
-                    os.remove(session_file)
+                await remove_session(account.session_name)
                 account.is_logged_in = False
                 account.user_id = ""
                 account.username = ""
@@ -289,16 +404,8 @@ class ClientManager:
                 if client:
                     me = await client.get_me()
                     self._update_account_info(account_id, me)
-                    self._remove_all_handlers(client)
-                    self._setup_handlers(account_id, client)
                     self._pending_logins.pop(account_id, None)
-                    self.clients[account_id] = client
-                    old_task = self._bg_tasks.pop(account_id, None)
-                    if old_task:
-                        old_task.cancel()
-                    self._bg_tasks[account_id] = asyncio.create_task(
-                        self._keep_alive(account_id, client)
-                    )
+                    await self._activate(account_id, client)
         except asyncio.TimeoutError:
             qr_data["status"] = "timeout"
         except asyncio.CancelledError:
@@ -308,14 +415,14 @@ class ClientManager:
             qr_data["error"] = str(e)
             logger.error(f"QR login wait error for account #{account_id}: {e}")
 
-    def check_qr_login(self, account_id: int) -> dict:
+    async def check_qr_login(self, account_id: int) -> dict:
         """查询 QR 登录状态"""
         if account_id not in self._qr_logins:
             return {"status": "not_started"}
         qr_data = self._qr_logins[account_id]
         return {"status": qr_data["status"], "error": qr_data.get("error", "")}
 
-    def cancel_qr_login(self, account_id: int):
+    async def cancel_qr_login(self, account_id: int):
         """取消 QR 登录"""
         qr_data = self._qr_logins.pop(account_id, None)
         if qr_data:
@@ -326,47 +433,94 @@ class ClientManager:
     # ==================== 消息转发 ====================
 
     def _setup_handlers(self, account_id: int, client: TelegramClient):
-        """为客户端设置消息转发事件处理器"""
-        # 读取转发配置
-        db = SessionLocal()
-        try:
-            fwd = db.query(ForwardConfig).first()
-            if not fwd or not fwd.is_enabled or not fwd.target_chat_id:
+        """为客户端注册消息转发事件处理器（每个客户端只注册一次，规则变更不重新注册）"""
+        stats = self.sender_stats
+        dispatcher = self.dispatcher
+
+        # 会话类型、发件人等过滤在 Telethon 构建事件时完成，这里只处理已通过预过滤的消息
+        @client.on(forward_event(account_id, dispatcher))
+        async def forward_handler(event: events.NewMessage.Event):
+            table = dispatcher.snapshot.table
+            chat_type = event.forward_chat_type
+            targets = event.forward_targets
+            if targets:
+                stats["id_matched"] += 1
+
+            # 仅当用户名规则可能命中新目标时才获取发件人实体（可能触发 RPC）
+            if table.needs_username(account_id, targets):
+                stats["sender_fetches"] += 1
+                sender = await event.get_sender()
+                suname = getattr(sender, "username", None)
+                if suname:
+                    named = table.match_username(account_id, suname, chat_type)
+                    if not named <= targets:
+                        stats["username_matched"] += 1
+                        targets |= named
+
+            if not targets:
+                stats["rejected"] += 1
+                forward_filtered.inc(account_id, "username")
                 return
+            for target in targets:
+                if self.dedup.seen(event.message, target):
+                    forward_filtered.inc(account_id, "dedup")
+                    continue
+                await self._enqueue_forward(account_id, event, target)
+
+    async def _enqueue_forward(self, account_id: int, event: events.NewMessage.Event, target: int):
+        """将消息交给合并器，按窗口批量放入转发队列"""
+        await self.forward_coalescer.add(account_id, event.chat_id, target, event.message)
+
+    async def _do_forward(self, job: ForwardJob):
+        """执行消息转发（由队列 worker 调用，失败时抛出异常由 worker 记录）"""
+        client = self.clients.get(job.account_id)
+        if not client or not client.is_connected():
+            raise RuntimeError(f"Account #{job.account_id} is not connected")
+        # 转发目标本身就是带标记的会话 ID，与 send_message 的 chat_key 同一形式，两条路径共用令牌桶
+        if job.target in self.dispatcher.snapshot.table.copy_targets:
+            await self.copier.copy(client, job, functools.partial(self.rate_limiter.call, job.account_id, job.target))
+            logger.info(f"Copied {len(job.messages)} message(s) from {job.chat_id} -> {job.target}")
+            return
+        # 从发件箱重放的任务只有消息 ID，需要指明来源会话
+        from_peer = job.chat_id if isinstance(job.messages[0], int) else None
+        await self.rate_limiter.call(
+            job.account_id, job.target, client.forward_messages, job.target, job.messages,
+            from_peer=from_peer,
+        )
+        logger.info(f"Forwarded {len(job.messages)} message(s) from {job.chat_id} -> {job.target}")
 
-            target_chat_id = int(fwd.target_chat_id)
-            allowed_senders = self._parse_senders(fwd.allowed_senders)
-
-            @client.on(events.NewMessage(incoming=True))
-            async def forward_handler(event: events.NewMessage.Event):
-                if not event.is_private:
-                    return
-                if not allowed_senders:
-                    await self._do_forward(event, target_chat_id)
-                    return
-
-                sender = await event.get_sender()
-                sid = str(sender.id)
-                suname = sender.username or ""
-                for allowed in allowed_senders:
-                    if allowed.lower() == sid or (
-                        suname and allowed.lower().lstrip("@") == suname.lower().lstrip("@")
-                    ):
-                        await self._do_forward(event, target_chat_id)
-                        return
+    async def replay_outbox(self):
+        """重放发件箱中未完成的转发（启动重连完成后调用）"""
+        rows = await self.outbox.load_pending(OUTBOX_REPLAY_MAX_AGE)
+        if not rows:
+            return
+        logger.info(f"Replaying {len(rows)} pending forward(s) from outbox")
+        skipped = 0
+        for r in rows:
+            if not self.owns(r["account_id"]):
+                continue
+            if not self.is_connected(r["account_id"]):
+                # 账号暂未连接（停用或重连失败）：保持 pending，下次启动时重放或按 max_age 过期
+                skipped += 1
+                continue
+            job = ForwardJob(
+                r["account_id"], int(r["source_chat_id"]), int(r["target_chat_id"]),
+                json.loads(r["message_ids"]), outbox_key=r["job_key"],
+            )
+            await self.forward_queue.put(job)
+            self.outbox.counters["replayed"] += 1
+        if skipped:
+            logger.info(f"{skipped} pending forward(s) kept in outbox, account not connected")
 
-        finally:
-            db.close()
+    # ==================== 工具方法 ====================
 
-    async def _do_forward(self, event: events.NewMessage.Event, target: int):
-        """执行消息转发"""
-        try:
-            await event.client.forward_messages(target, event.message)
-            logger.info(f"Forwarded message from {event.sender_id} -> {target}")
-        except Exception as e:
-            logger.error(f"Forward failed: {e}")
+    def owns(self, account_id: int) -> bool:
+        """该账号是否由本进程负责（非分片模式下负责所有账号）"""
+        return self.shard is None or shard_of(account_id, self.shard[1]) == self.shard[0]
 
-    # ==================== 工具方法 ====================
+    def client_ids(self) -> list[int]:
+        """已创建客户端的账号（包括登录中）"""
+        return list(self.clients) + [aid for aid in self._pending_logins if aid not in self.clients]
 
     def get_client(self, account_id: int) -> Optional[TelegramClient]:
         return self.clients.get(account_id)
@@ -385,17 +539,74 @@ class ClientManager:
         if not client or not client.is_connected():
             raise RuntimeError(f"Account #{account_id} is not connected")
 
-        # Telethon 要求纯数字ID（如群组 -4688142035）以 int 格式传入，
-        # 否则会当作 username 去搜索，导致 "Cannot find any entity" 错误
+        # 使用缓存的 InputPeer，避免每次发送都解析 @username
+        peer = await self.entity_cache.resolve(account_id, client, target)
+        async with self.pool.use(account_id):
+            try:
+                return await self.rate_limiter.call(account_id, chat_key(peer, target), client.send_message, peer, message)
+            except INVALID_PEER_ERRORS as e:
+                # 缓存的实体可能已失效：重新解析后重试一次
+                logger.warning(f"Cached peer for {target} invalid on account #{account_id}: {e}, re-resolving")
+                await self.entity_cache.invalidate(account_id, target)
+                peer = await self.entity_cache.resolve(account_id, client, target)
+                return await self.rate_limiter.call(account_id, chat_key(peer, target), client.send_message, peer, message)
+
+    async def warm_entity_cache(self):
+        """预先解析所有启用项目用到的 (账号, 目标)，之后的定时发送无需解析"""
+        db = SessionLocal()
         try:
-            entity = int(target)
-        except ValueError:
-            entity = target  # 保留原始字符串（如 @username）
+            pending: dict[int, set[str]] = {}
+            for p in db.query(Project).filter(Project.is_enabled == True).all():
+                targets = [st.target_bot for st in p.subtasks] or [p.target_bot]
+                for acc in p.accounts:
+                    pending.setdefault(acc.id, set()).update(targets)
+        finally:
+            db.close()
+
+        sem = asyncio.Semaphore(max(1, RECONNECT_CONCURRENCY))
 
-        return await client.send_message(entity, message)
+        async def warm(account_id: int, targets: set[str]):
+            async with sem:
+                await self._resolve_targets(account_id, targets)
 
-    async def reconnect_all(self):
-        """重连所有已激活且已登录的账号（启动时调用）"""
+        await asyncio.gather(*(warm(aid, ts) for aid, ts in pending.items()))
+        logger.info(f"Entity cache warmed: {self.entity_cache.stats()}")
+
+    async def _resolve_targets(self, account_id: int, targets):
+        """解析尚未缓存的发送目标（同一账号内顺序解析，避免触发 ResolveUsername 限流）"""
+        client = self.clients.get(account_id)
+        if not client or not client.is_connected():
+            return
+        for t in targets:
+            if self.entity_cache.get(account_id, t) is not None:
+                continue
+            try:
+                await self.entity_cache.resolve(account_id, client, t)
+            except Exception as e:
+                logger.warning(f"Warm entity cache failed: account #{account_id} -> {t}: {e}")
+
+    async def prewarm(self, account_id: int, targets: list[str]) -> bool:
+        """定时任务触发前预先连接账号并解析目标，返回账号是否已就绪"""
+        if not self.is_connected(account_id):
+            db = SessionLocal()
+            try:
+                acc = db.query(Account).get(account_id)
+            finally:
+                db.close()
+            if not acc or not acc.is_active or not acc.is_logged_in:
+                return False
+            if not await self.start_client(acc):
+                return False
+        await self._resolve_targets(account_id, targets)
+        return True
+
+    async def reconnect_all(self, upcoming: Optional[dict[int, float]] = None):
+        """并发重连所有已激活且已登录的常驻账号（启动时调用，按需连接的账号跳过）
+
+        upcoming 为 账号ID -> 距最近一次定时任务的秒数；参与转发的账号最先连接，
+        其次按定时任务的先后顺序。并发数受 RECONNECT_CONCURRENCY 限制，
+        各账号的启动时间按 RECONNECT_STAGGER_MS 错开。
+        """
         db = SessionLocal()
         try:
             accounts = (
@@ -406,66 +617,186 @@ class ClientManager:
         finally:
             db.close()
 
+        self._on_demand.update(a.id for a in accounts if a.role == ROLE_SCHEDULE)
+        accounts = [a for a in accounts if a.role != ROLE_SCHEDULE]
         if not accounts:
             logger.info("No logged-in accounts to reconnect")
             return
 
-        logger.info(f"Reconnecting {len(accounts)} account(s)...")
-        for acc in accounts:
-            if acc.id in self.clients:
-                continue
-            # 每个账号重试 3 次，间隔递增
-            for attempt in range(1, 4):
+        upcoming = upcoming or {}
+        table = self.dispatcher.snapshot.table
+
+        def priority(acc: Account) -> float:
+            if table.uses_account(acc.id):
+                return -1.0
+            return upcoming.get(acc.id, float("inf"))
+
+        accounts = sorted(
+            (a for a in accounts if a.id not in self.clients and self.owns(a.id)), key=priority,
+        )
+        self.reconnect_progress = {
+            a.id: {"name": a.name, "status": "pending", "attempts": 0, "started_at": None, "finished_at": None}
+            for a in accounts
+        }
+        logger.info(f"Reconnecting {len(accounts)} account(s) (concurrency {RECONNECT_CONCURRENCY})...")
+
+        sem = asyncio.Semaphore(max(1, RECONNECT_CONCURRENCY))
+        stagger = RECONNECT_STAGGER_MS / 1000
+        await asyncio.gather(*(
+            self._reconnect_one(acc, i * stagger, sem) for i, acc in enumerate(accounts)
+        ))
+        online = sum(1 for a in accounts if self.is_connected(a.id))
+        logger.info(f"Reconnect finished: {online}/{len(accounts)} online")
+        await self.replay_outbox()
+        await self.warm_entity_cache()
+
+    async def _reconnect_one(self, acc: Account, delay: float, sem: asyncio.Semaphore):
+        """重连单个账号：每个账号重试 3 次，间隔递增；重试等待期间不占用并发名额"""
+        progress = self.reconnect_progress[acc.id]
+        await asyncio.sleep(delay)
+        progress["started_at"] = time.time()
+        for attempt in range(1, 4):
+            async with sem:
+                progress["status"] = "connecting"
+                progress["attempts"] = attempt
                 ok = await self.start_client(acc)
-                if ok:
-                    logger.info(f"Account {acc.name} reconnected")
-                    break
+            if ok:
+                progress["status"] = "online"
+                progress["finished_at"] = time.time()
+                logger.info(f"Account {acc.name} reconnected")
+                return
+            if acc.id in self._pending_logins:
+                # session 未授权，重试无意义
+                progress["status"] = "unauthorized"
+                progress["finished_at"] = time.time()
+                return
+            if attempt < 3:
                 logger.warning(f"Account {acc.name} reconnect attempt {attempt}/3 failed, retrying...")
                 await asyncio.sleep(attempt * 3)
-            else:
-                logger.error(f"Account {acc.name} failed to reconnect after 3 attempts")
-        logger.info(f"Reconnect finished: {sum(1 for a in accounts if a.id in self.clients and self.clients[a.id].is_connected())}/{len(accounts)} online")
+        progress["status"] = "failed"
+        progress["finished_at"] = time.time()
+        logger.error(f"Account {acc.name} failed to reconnect after 3 attempts")
+
+    async def reconnect_summary(self) -> dict:
+        """启动重连进度"""
+        counts: dict[str, int] = {}
+        for p in self.reconnect_progress.values():
+            counts[p["status"]] = counts.get(p["status"], 0) + 1
+        return {
+            "total": len(self.reconnect_progress),
+            "counts": counts,
+            "accounts": self.reconnect_progress,
+        }
+
+    async def prepare(self):
+        """启动时加载实体缓存、会话存储和转发规则"""
+        self.entity_cache.load()
+        if SESSION_BACKEND == "database":
+            session_store.load()
+        await self.refresh_forward_handlers()
 
     async def refresh_forward_handlers(self):
-        """刷新所有客户端的转发处理器（配置变更后调用）"""
-        for aid, client in self.clients.items():
-            self._remove_all_handlers(client)
-            self._setup_handlers(aid, client)
-
-    async def _keep_alive(self, account_id: int, client: TelegramClient):
-        """后台保持客户端连接，断线自动重连"""
-        while True:
-            try:
-                await client.run_until_disconnected()
-            except asyncio.CancelledError:
-                raise
-            except Exception as e:
-                logger.error(f"Client {account_id} disconnected: {e}")
+        """重新加载转发规则（启动及配置变更后调用），所有客户端共享新快照"""
+        self.dispatcher.reload()
 
-            # 尝试重连（最多重试 10 次，间隔递增）
-            db = SessionLocal()
-            try:
-                acc = db.query(Account).get(account_id)
-            finally:
-                db.close()
-
-            if not acc or not acc.is_active:
-                logger.info(f"Account {account_id} inactive, stop reconnect")
-                return
+    async def _supervised_reconnect(self, account_id: int) -> Optional[bool]:
+        """连接监管者的重连回调：True 成功，False 失败，None 需要重新登录
 
-            for attempt in range(1, 11):
-                logger.info(f"Reconnect attempt {attempt}/10 for {acc.name}")
-                try:
-                    success = await self.start_client(acc)
-                    if success:
-                        logger.info(f"Reconnected {acc.name} successfully")
-                        return  # start_client 会创建新的 _keep_alive，这个退出
-                except Exception as ex:
-                    logger.error(f"Reconnect attempt {attempt} failed: {ex}")
-                await asyncio.sleep(min(attempt * 10, 60))  # 递增间隔: 10s, 20s, 30s... 最多 60s
+        账号已停用或已删除时停止客户端并取消监管，而不是报告为需要重新登录。
+        """
+        db = SessionLocal()
+        try:
+            acc = db.query(Account).get(account_id)
+        finally:
+            db.close()
+        if not acc or not acc.is_active:
+            logger.info(f"Account {account_id} inactive, stop reconnect")
+            # unwatch 后监管者丢弃本次结果，账号不会被标记为 unauthorized
+            await self.stop_client(account_id)
+            return False
 
-            logger.error(f"Account {acc.name} reconnect failed after 10 attempts, giving up")
-            return  # 彻底退出 keep_alive，避免无限重试刷日志
+        # 先断开失效的旧客户端，再创建新连接
+        old = self.clients.pop(account_id, None)
+        if old:
+            try:
+                await old.disconnect()
+            except Exception:
+                pass
+        ok = await self.start_client(acc)
+        if not ok and account_id in self._pending_logins:
+            telethon_reconnects.inc(account_id, "unauthorized")
+            return None
+        telethon_reconnects.inc(account_id, "success" if ok else "failure")
+        return ok
+
+    # ==================== 统计 ====================
+
+    async def forget_account(self, account_id: int):
+        """删除账号时清理其实体缓存"""
+        await self.entity_cache.forget_account(account_id)
+
+    async def connection_stats(self) -> dict:
+        return {**self.supervisor.stats(), **self.pool.stats()}
+
+    async def entity_cache_stats(self) -> dict:
+        return self.entity_cache.stats()
+
+    def collect_metrics(self) -> list:
+        """抓取 /metrics 时读取各子系统的状态量"""
+        queue = self.forward_queue
+        states: dict[str, int] = {}
+        for conn in self.supervisor.connections.values():
+            states[conn.state] = states.get(conn.state, 0) + 1
+        return [
+            gauge("tgf_forward_queue_depth", "Forward jobs waiting per account",
+                  (({"account": aid}, q.qsize()) for aid, q in queue._queues.items())),
+            gauge("tgf_forward_coalescer_pending_batches", "Batches waiting in the coalescing window",
+                  [({}, len(self.forward_coalescer._batches))]),
+            gauge("tgf_outbox_buffered", "Outbox rows waiting for group commit",
+                  [({"kind": "insert"}, len(self.outbox._inserts)), ({"kind": "update"}, len(self.outbox._updates))]),
+            gauge("tgf_accounts_connected", "Connected Telegram clients",
+                  [({}, sum(1 for c in self.clients.values() if c.is_connected()))]),
+            gauge("tgf_on_demand_clients", "Connected on-demand (schedule-only) clients",
+                  [({}, len(self.pool._last_used))]),
+            counter_family("tgf_client_pool_events", "On-demand client pool events",
+                           (({"event": k}, v) for k, v in self.pool.counters.items())),
+            gauge("tgf_connection_state_accounts", "Accounts per connection supervisor state",
+                  (({"state": s}, n) for s, n in states.items())),
+            counter_family("tgf_supervisor_events", "Connection supervisor events",
+                           (({"event": k}, v) for k, v in self.supervisor.counters.items())),
+            counter_family("tgf_forward_prefilter_dropped", "Updates dropped while building events",
+                           (({"stage": k}, v) for k, v in ForwardNewMessage.dropped.items())),
+            counter_family("tgf_rate_limiter_events", "Rate limiter events",
+                           (({"event": k}, v) for k, v in self.rate_limiter.counters.items())),
+            counter_family("tgf_forward_copied_messages", "Messages sent as copies, by method",
+                           (({"method": k}, self.copier.counters[k]) for k in ("text", "media", "forwarded"))),
+            counter_family("tgf_media_cache_events", "Copy-mode media reference cache events",
+                           (({"event": k}, v) for k, v in self.copier.cache.counters.items())),
+            counter_family("tgf_dedup_events", "Cross-account dedup cache events",
+                           (({"event": k}, v) for k, v in self.dedup.counters.items())),
+        ]
+
+    async def latency_export(self) -> dict:
+        return self.latency.export()
+
+    async def latency_stats(self) -> dict:
+        return latency_report(self.latency.export())
+
+    async def metric_families(self) -> list:
+        return registry.collect()
+
+    async def forward_stats(self) -> dict:
+        return {
+            "rules": self.dispatcher.stats(),
+            "prefilter": ForwardNewMessage.stats(),
+            "senders": dict(self.sender_stats),
+            "dedup": self.dedup.stats(),
+            "coalescer": self.forward_coalescer.stats(),
+            "queue": self.forward_queue.stats(),
+            "outbox": self.outbox.stats(),
+            "rate_limiter": self.rate_limiter.stats(),
+            "copy": self.copier.stats(),
+        }
 
     # ==================== 数据库辅助 ====================
 
@@ -496,13 +827,11 @@ class ClientManager:
         finally:
             db.close()
 
-    @staticmethod
-    def _parse_senders(raw: str) -> list[str]:
-        try:
-            return json.loads(raw) if raw else []
-        except json.JSONDecodeError:
-            return []
-
 
-# 全局单例
-client_manager = ClientManager()
+# 全局单例：SHARD_COUNT > 1 时 API 进程使用分片协调器，分片子进程内各自持有一个 ClientManager
+if SHARD_COUNT > 1 and SHARD_INDEX is None:
+    client_manager = ShardCoordinator(SHARD_COUNT, SHARD_RPC_TIMEOUT)
+elif SHARD_INDEX is not None:
+    client_manager = ClientManager(shard=(int(SHARD_INDEX), SHARD_COUNT))
+else:
+    client_manager = ClientManager()
@@ -0,0 +1,160 @@
+"""按需连接池
+
+账号分两种角色：
+- forward：常驻连接，接收更新流用于消息转发，由连接监管者保活；
+- schedule：只用于定时任务，任务开始前连接，空闲超过 CLIENT_IDLE_TIMEOUT 秒后断开，
+  不注册转发处理器、不接收更新，也不参与启动重连和连接监管。
+
+OnDemandPool 记录按需客户端的最近使用时间和进行中的调用数，
+同时连接数达到 CLIENT_POOL_MAX 时淘汰最久未用且空闲的客户端，全部在用时等待释放。
+刚占位的客户端（仍在连接或等待首次发送）被钉住，直到第一次 use() 结束前都不会被淘汰；
+钉住超过空闲超时仍未使用的，由空闲回收照常断开。
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ROLE_FORWARD = "forward"
+ROLE_SCHEDULE = "schedule"
+ACCOUNT_ROLES = (ROLE_FORWARD, ROLE_SCHEDULE)
+
+
+class OnDemandPool:
+    """按需客户端的空闲淘汰与数量上限"""
+
+    def __init__(self, evict: Callable[[int], Awaitable[None]], idle_timeout: float = 300, max_size: int = 0):
+        # evict(account_id)：断开并移除客户端（即 ClientManager.stop_client）
+        self._evict = evict
+        self.idle_timeout = idle_timeout
+        self.max_size = max_size
+        self._last_used: dict[int, float] = {}    # account_id -> 最近使用时刻（monotonic），插入顺序即 LRU 顺序
+        self._in_use: dict[int, int] = {}         # account_id -> 进行中的调用数
+        self._pinned: dict[int, float] = {}       # account_id -> 占位时刻，首次 use() 结束前不参与 LRU 淘汰
+        self._cond = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self.counters: dict[str, int] = {"connects": 0, "idle_evictions": 0, "pool_evictions": 0, "waits": 0}
+
+    def __contains__(self, account_id: int) -> bool:
+        return account_id in self._last_used
+
+    def touch(self, account_id: int):
+        if account_id in self._last_used:
+            # 移到末尾，保持 LRU 顺序
+            del self._last_used[account_id]
+            self._last_used[account_id] = time.monotonic()
+
+    # ==================== 占位与释放 ====================
+
+    async def reserve(self, account_id: int):
+        """连接前占一个名额；已满时淘汰最久未用的空闲客户端，没有可淘汰的则等待"""
+        if account_id in self._last_used:
+            self.touch(account_id)
+            return
+        victim = None
+        async with self._cond:
+            while self.max_size and len(self._last_used) >= self.max_size:
+                victim = self._victim()
+                if victim is not None:
+                    del self._last_used[victim]
+                    break
+                self.counters["waits"] += 1
+                await self._cond.wait()
+            self._last_used[account_id] = time.monotonic()
+            self._pinned[account_id] = time.monotonic()
+        self.counters["connects"] += 1
+        self._ensure_task()
+        if victim is not None:
+            self.counters["pool_evictions"] += 1
+            logger.info(f"Client pool full, evicting account #{victim}")
+            await self._evict(victim)
+
+    def _victim(self) -> Optional[int]:
+        for aid in self._last_used:
+            if not self._in_use.get(aid) and aid not in self._pinned:
+                return aid
+        return None
+
+    def discard(self, account_id: int):
+        """客户端已停止或连接失败：释放名额"""
+        self._pinned.pop(account_id, None)
+        if self._last_used.pop(account_id, None) is not None:
+            self._notify()
+
+    def _notify(self):
+        async def notify():
+            async with self._cond:
+                self._cond.notify_all()
+        try:
+            asyncio.get_running_loop().create_task(notify())
+        except RuntimeError:
+            pass
+
+    @asynccontextmanager
+    async def use(self, account_id: int):
+        """标记一次调用进行中，期间不会被淘汰"""
+        if account_id not in self._last_used:
+            yield
+            return
+        self._in_use[account_id] = self._in_use.get(account_id, 0) + 1
+        self.touch(account_id)
+        try:
+            yield
+        finally:
+            n = self._in_use.pop(account_id, 1) - 1
+            if n > 0:
+                self._in_use[account_id] = n
+            self._pinned.pop(account_id, None)
+            self.touch(account_id)
+            self._notify()
+
+    # ==================== 空闲淘汰 ====================
+
+    def _ensure_task(self):
+        if self.idle_timeout > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        interval = max(1.0, min(30.0, self.idle_timeout / 4))
+        while self._last_used:
+            await asyncio.sleep(interval)
+            deadline = time.monotonic() - self.idle_timeout
+            idle = [
+                aid for aid, used in self._last_used.items()
+                if used < deadline and not self._in_use.get(aid) and self._pinned.get(aid, 0) < deadline
+            ]
+            for aid in idle:
+                self._last_used.pop(aid, None)
+                self._pinned.pop(aid, None)
+                self.counters["idle_evictions"] += 1
+                logger.info(f"On-demand client idle for {self.idle_timeout:.0f}s, disconnecting account #{aid}")
+                try:
+                    await self._evict(aid)
+                except Exception as e:
+                    logger.warning(f"Failed to disconnect idle account #{aid}: {e}")
+            if idle:
+                self._notify()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._last_used.clear()
+        self._in_use.clear()
+        self._pinned.clear()
+
+    def stats(self) -> dict:
+        return {
+            "on_demand_connected": len(self._last_used),
+            "on_demand_in_use": sum(1 for n in self._in_use.values() if n),
+            "on_demand_pinned": len(self._pinned),
+            **{f"on_demand_{k}": v for k, v in self.counters.items()},
+        }
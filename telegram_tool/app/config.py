@@ -19,3 +19,75 @@ DATABASE_URL = f"sqlite:///{DB_PATH}"
 # 服务配置
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "44000"))
+
+# 转发队列配置
+FORWARD_QUEUE_SIZE = int(os.getenv("FORWARD_QUEUE_SIZE", "1000"))   # 每个账号的队列容量
+FORWARD_WORKERS = int(os.getenv("FORWARD_WORKERS", "1"))            # 每个账号的 worker 数（>1 时不保证顺序）
+FORWARD_COALESCE_MS = int(os.getenv("FORWARD_COALESCE_MS", "250"))  # 合并窗口（毫秒），0 表示逐条转发
+FORWARD_BATCH_MAX = int(os.getenv("FORWARD_BATCH_MAX", "100"))      # 单次转发最多消息数（上限 100）
+FORWARD_COALESCE_BUFFER = int(os.getenv("FORWARD_COALESCE_BUFFER", "1000"))  # 合并窗口内每个账号最多缓冲的消息数
+FORWARD_DEDUP_WINDOW = int(os.getenv("FORWARD_DEDUP_WINDOW", "60"))     # 跨账号去重窗口（秒），0 表示关闭
+FORWARD_DEDUP_MAX = int(os.getenv("FORWARD_DEDUP_MAX", "10000"))        # 去重缓存最多条目数
+FORWARD_LATENCY_WINDOW = int(os.getenv("FORWARD_LATENCY_WINDOW", "300"))  # 转发延迟分位数的统计窗口（秒）
+
+# 发送限速（令牌桶，单位：条/秒）
+ACCOUNT_SEND_RATE = float(os.getenv("ACCOUNT_SEND_RATE", "3"))      # 每个账号
+ACCOUNT_SEND_BURST = float(os.getenv("ACCOUNT_SEND_BURST", "10"))
+CHAT_SEND_RATE = float(os.getenv("CHAT_SEND_RATE", "1"))            # 每个账号对单个会话
+CHAT_SEND_BURST = float(os.getenv("CHAT_SEND_BURST", "3"))
+FLOOD_RETRY_LIMIT = int(os.getenv("FLOOD_RETRY_LIMIT", "3"))        # FloodWait 后最多重试次数
+# Telethon 内部自动休眠的 FloodWait 阈值（Telethon 默认 60 秒）；
+# 不经过限速器的调用（登录、实体解析、存活检测等）依赖它处理短暂的 FloodWait，更长的等待由限速器暂停重试
+FLOOD_SLEEP_THRESHOLD = int(os.getenv("FLOOD_SLEEP_THRESHOLD", "60"))
+
+# 启动重连
+RECONNECT_CONCURRENCY = int(os.getenv("RECONNECT_CONCURRENCY", "10"))   # 同时重连的账号数
+RECONNECT_STAGGER_MS = int(os.getenv("RECONNECT_STAGGER_MS", "200"))    # 相邻账号启动的间隔（毫秒）
+
+# 连接监管
+SUPERVISOR_PING_INTERVAL = int(os.getenv("SUPERVISOR_PING_INTERVAL", "60"))          # 存活检测间隔（秒）
+SUPERVISOR_BACKOFF_BASE = int(os.getenv("SUPERVISOR_BACKOFF_BASE", "5"))             # 重连退避基数（秒）
+SUPERVISOR_BACKOFF_MAX = int(os.getenv("SUPERVISOR_BACKOFF_MAX", "300"))             # 重连退避上限（秒）
+SUPERVISOR_CIRCUIT_THRESHOLD = int(os.getenv("SUPERVISOR_CIRCUIT_THRESHOLD", "10"))  # 连续失败多少次后熔断
+SUPERVISOR_CIRCUIT_COOLDOWN = int(os.getenv("SUPERVISOR_CIRCUIT_COOLDOWN", "1800"))  # 熔断冷却时间（秒）
+
+# 转发发件箱（持久化待转发任务，重启后重放）
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_FLUSH_MS = int(os.getenv("OUTBOX_FLUSH_MS", "50"))                  # 组提交间隔（毫秒）
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))             # 攒够多少条立即提交
+OUTBOX_REPLAY_MAX_AGE = int(os.getenv("OUTBOX_REPLAY_MAX_AGE", "86400"))   # 超过该时长（秒）的待转发不再重放
+
+# 多进程分片（>1 时账号按 ID 分配到多个子进程，各自运行事件循环）
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = os.getenv("SHARD_INDEX")                                     # 由协调进程为子进程设置，无需手动配置
+SHARD_RPC_TIMEOUT = int(os.getenv("SHARD_RPC_TIMEOUT", "120"))             # 分片调用超时（秒）
+
+# 事件循环
+EVENT_LOOP = os.getenv("EVENT_LOOP", "auto")                               # auto / asyncio / uvloop
+LOOP_MONITOR_INTERVAL_MS = int(os.getenv("LOOP_MONITOR_INTERVAL_MS", "250"))   # 延迟采样间隔（毫秒），0 表示关闭
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))         # 超过该延迟记录告警和调用栈
+LOOP_LAG_SAMPLES = int(os.getenv("LOOP_LAG_SAMPLES", "2400"))                  # 计算分位数保留的样本数
+
+# Telethon 会话存储：file 为每个账号一个 .session 文件；database 为统一存入主数据库（首次使用时自动迁移 .session 文件）
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "file")
+SESSION_FLUSH_MS = int(os.getenv("SESSION_FLUSH_MS", "1000"))              # 实体缓存等批量写入的间隔（毫秒）
+
+# 按需连接（角色为 schedule 的账号只在定时任务前连接）
+CLIENT_IDLE_TIMEOUT = int(os.getenv("CLIENT_IDLE_TIMEOUT", "300"))        # 空闲多少秒后断开，0 表示不自动断开
+CLIENT_POOL_MAX = int(os.getenv("CLIENT_POOL_MAX", "0"))                  # 同时连接的按需客户端上限，0 表示不限制
+
+# 定时任务预热：触发前提前连接账号并解析发送目标
+SCHEDULER_PREWARM_LEAD = int(os.getenv("SCHEDULER_PREWARM_LEAD", "60"))  # 提前量（秒），0 表示关闭
+
+# 定时任务持久化：任务及下次触发时间存入主数据库，重启后按补跑策略处理停机期间错过的触发
+SCHEDULER_JOBSTORE = os.getenv("SCHEDULER_JOBSTORE", "database")                  # database / memory
+SCHEDULER_CATCHUP = os.getenv("SCHEDULER_CATCHUP", "latest")                      # skip 不补跑 / latest 只补最近一次 / all 逐次补跑
+SCHEDULER_CATCHUP_WINDOW = int(os.getenv("SCHEDULER_CATCHUP_WINDOW", "3600"))     # 只补跑该时长（秒）内错过的触发
+SCHEDULER_CATCHUP_CONCURRENCY = int(os.getenv("SCHEDULER_CATCHUP_CONCURRENCY", "2"))  # 同时进行的补跑数
+
+# 任务日志组提交
+TASK_LOG_FLUSH_MS = int(os.getenv("TASK_LOG_FLUSH_MS", "500"))             # 写入间隔（毫秒）
+TASK_LOG_BATCH_SIZE = int(os.getenv("TASK_LOG_BATCH_SIZE", "200"))         # 攒够多少条立即写入
+
+# 复制模式：按 file reference 重发媒体，缓存各账号最近发送成功的媒体引用
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", "5000"))
@@ -0,0 +1,242 @@
+"""连接监管
+
+由单个监管协程统一维护所有账号的连接状态机，取代每个账号各自的保活循环：
+- 断线后按指数退避 + 随机抖动重连
+- 连续失败达到阈值后熔断，冷却期结束自动半开重试（不会永久放弃）
+- 定期发送轻量 Ping 检测存活并记录 RTT
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from telethon import TelegramClient
+from telethon.tl.functions import PingRequest
+
+logger = logging.getLogger(__name__)
+
+# 连接状态
+CONNECTED = "connected"
+BACKOFF = "backoff"              # 等待下一次重连
+RECONNECTING = "reconnecting"
+CIRCUIT_OPEN = "circuit_open"    # 熔断中，冷却结束后半开重试
+UNAUTHORIZED = "unauthorized"    # session 失效，需要重新登录
+
+# 连续 Ping 失败多少次视为连接已失效
+PING_FAILURE_LIMIT = 2
+PING_TIMEOUT = 10
+
+
+class AccountConnection:
+    """单个账号的连接状态"""
+
+    __slots__ = (
+        "account_id", "client", "state", "since", "failures", "next_attempt_at",
+        "circuit_opens", "ping_failures", "last_ping_at", "rtt_ms", "rtt_avg_ms",
+        "transitions", "task",
+    )
+
+    def __init__(self, account_id: int, client: TelegramClient):
+        self.account_id = account_id
+        self.client: Optional[TelegramClient] = client
+        self.state = CONNECTED
+        self.since = time.time()
+        self.failures = 0                 # 连续重连失败次数
+        self.next_attempt_at = 0.0
+        self.circuit_opens = 0
+        self.ping_failures = 0
+        self.last_ping_at = time.monotonic()
+        self.rtt_ms: Optional[float] = None
+        self.rtt_avg_ms: Optional[float] = None
+        self.transitions: deque = deque(maxlen=20)
+        self.task: Optional[asyncio.Task] = None   # 进行中的重连或 Ping
+
+    def busy(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        return {
+            "state": self.state,
+            "since": self.since,
+            "in_state_seconds": round(now - self.since, 1),
+            "failures": self.failures,
+            "next_attempt_in": round(max(0.0, self.next_attempt_at - time.monotonic()), 1)
+            if self.state in (BACKOFF, CIRCUIT_OPEN) else None,
+            "circuit_opens": self.circuit_opens,
+            "rtt_ms": self.rtt_ms,
+            "rtt_avg_ms": self.rtt_avg_ms,
+            "transitions": [
+                {"at": at, "from": src, "to": dst, "reason": reason, "after_seconds": dur}
+                for at, src, dst, reason, dur in self.transitions
+            ],
+        }
+
+
+class ConnectionSupervisor:
+    """所有账号连接的统一监管者"""
+
+    def __init__(self, reconnect: Callable[[int], Awaitable[Optional[bool]]],
+                 ping_interval: float = 60, backoff_base: float = 5, backoff_max: float = 300,
+                 circuit_threshold: int = 10, circuit_cooldown: float = 1800, tick: float = 1.0):
+        # reconnect(account_id) -> True 成功 / False 失败 / None 需要重新登录
+        # 回调中 unwatch 的账号（已停用或删除）不再处理其结果
+        self._reconnect = reconnect
+        self.ping_interval = ping_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_threshold = circuit_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self.tick = tick
+        self.connections: dict[int, AccountConnection] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self.counters: dict[str, int] = {"disconnects": 0, "reconnects": 0, "reconnect_failures": 0, "circuit_opens": 0}
+
+    # ==================== 注册 ====================
+
+    def watch(self, account_id: int, client: TelegramClient):
+        """客户端连接成功后登记（重连成功也会调用）"""
+        conn = self.connections.get(account_id)
+        if conn is None:
+            conn = self.connections[account_id] = AccountConnection(account_id, client)
+            conn.transitions.append((time.time(), None, CONNECTED, "started", 0.0))
+        else:
+            conn.client = client
+            conn.failures = 0
+            conn.ping_failures = 0
+            conn.last_ping_at = time.monotonic()
+            self._transition(conn, CONNECTED, "connected")
+        self._ensure_loop()
+
+    def unwatch(self, account_id: int):
+        """停止监管（显式停止客户端时调用）"""
+        conn = self.connections.pop(account_id, None)
+        if conn and conn.busy() and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+
+    def _ensure_loop(self):
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [c.task for c in self.connections.values() if c.busy()]
+        if self._loop_task:
+            tasks.append(self._loop_task)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        self.connections.clear()
+
+    # ==================== 状态机 ====================
+
+    def _transition(self, conn: AccountConnection, state: str, reason: str):
+        if conn.state == state:
+            return
+        now = time.time()
+        conn.transitions.append((now, conn.state, state, reason, round(now - conn.since, 1)))
+        logger.info(f"Account #{conn.account_id}: {conn.state} -> {state} ({reason})")
+        conn.state = state
+        conn.since = now
+
+    def _backoff_delay(self, failures: int) -> float:
+        delay = min(self.backoff_base * (2 ** max(0, failures - 1)), self.backoff_max)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _run(self):
+        while True:
+            try:
+                self._check_all()
+            except Exception as e:
+                logger.error(f"Connection supervisor error: {e}")
+            await asyncio.sleep(self.tick)
+
+    def _check_all(self):
+        now = time.monotonic()
+        for conn in list(self.connections.values()):
+            if conn.busy():
+                continue
+            if conn.state == CONNECTED:
+                if conn.client is None or not conn.client.is_connected():
+                    self.counters["disconnects"] += 1
+                    conn.next_attempt_at = now
+                    self._transition(conn, BACKOFF, "disconnected")
+                elif now - conn.last_ping_at >= self.ping_interval:
+                    conn.task = asyncio.create_task(self._ping(conn))
+            elif conn.state in (BACKOFF, CIRCUIT_OPEN) and now >= conn.next_attempt_at:
+                if conn.state == CIRCUIT_OPEN:
+                    # 半开：只试一次，失败立即重新熔断
+                    conn.failures = self.circuit_threshold - 1
+                    reason = "half-open retry"
+                else:
+                    reason = f"attempt {conn.failures + 1}"
+                self._transition(conn, RECONNECTING, reason)
+                conn.task = asyncio.create_task(self._attempt(conn))
+
+    async def _ping(self, conn: AccountConnection):
+        conn.last_ping_at = time.monotonic()
+        client = conn.client
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(client(PingRequest(ping_id=random.getrandbits(63))), PING_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            conn.ping_failures += 1
+            logger.warning(f"Ping failed for account #{conn.account_id} ({conn.ping_failures}/{PING_FAILURE_LIMIT}): {e}")
+            if conn.ping_failures >= PING_FAILURE_LIMIT and conn.state == CONNECTED:
+                self.counters["disconnects"] += 1
+                conn.next_attempt_at = time.monotonic()
+                self._transition(conn, BACKOFF, "ping timeout")
+            return
+        rtt = round((time.perf_counter() - start) * 1000, 1)
+        conn.ping_failures = 0
+        conn.rtt_ms = rtt
+        conn.rtt_avg_ms = rtt if conn.rtt_avg_ms is None else round(conn.rtt_avg_ms * 0.8 + rtt * 0.2, 1)
+
+    async def _attempt(self, conn: AccountConnection):
+        try:
+            ok = await self._reconnect(conn.account_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Reconnect error for account #{conn.account_id}: {e}")
+            ok = False
+
+        if self.connections.get(conn.account_id) is not conn:
+            return  # 期间被停止或替换
+        if ok:
+            # watch() 已在启动成功时更新状态
+            self.counters["reconnects"] += 1
+            return
+        if ok is None:
+            self._transition(conn, UNAUTHORIZED, "session unauthorized")
+            self.connections.pop(conn.account_id, None)
+            return
+
+        self.counters["reconnect_failures"] += 1
+        conn.failures += 1
+        if conn.failures >= self.circuit_threshold:
+            conn.circuit_opens += 1
+            self.counters["circuit_opens"] += 1
+            conn.failures = 0
+            conn.next_attempt_at = time.monotonic() + self.circuit_cooldown
+            self._transition(conn, CIRCUIT_OPEN, f"{self.circuit_threshold} consecutive failures")
+        else:
+            conn.next_attempt_at = time.monotonic() + self._backoff_delay(conn.failures)
+            self._transition(conn, BACKOFF, "reconnect failed")
+
+    # ==================== 查询 ====================
+
+    def stats(self) -> dict:
+        states: dict[str, int] = {}
+        for c in self.connections.values():
+            states[c.state] = states.get(c.state, 0) + 1
+        return {
+            "states": states,
+            **self.counters,
+            "accounts": {aid: c.to_dict() for aid, c in self.connections.items()},
+        }
@@ -1,12 +1,15 @@
 """数据库连接管理"""
 
 import logging
-from sqlalchemy import create_engine, text
+import time
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 try:
     from .config import DATABASE_URL
+    from .metrics import db_query_duration
 except ImportError:
     from config import DATABASE_URL
+    from metrics import db_query_duration
 
 engine = create_engine(
     DATABASE_URL,
@@ -14,6 +17,17 @@ engine = create_engine(
     echo=False,
 )
 
+# 语句耗时：开始时间记在本次执行的 context 上，语句出错时随 context 一起丢弃
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    # 按语句类型（SELECT / INSERT / UPDATE ...）统计，避免指标标签随 SQL 文本膨胀
+    db_query_duration.observe(elapsed, statement.lstrip().split(None, 1)[0].upper())
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -50,6 +64,9 @@ def _migrate():
         ("account_delay_min", "projects", "INTEGER NOT NULL DEFAULT 0"),
         ("account_delay_max", "projects", "INTEGER NOT NULL DEFAULT 0"),
         ("sort_order", "projects", "INTEGER NOT NULL DEFAULT 0"),
+        ("role", "accounts", "VARCHAR(20) NOT NULL DEFAULT 'forward'"),
+        ("copy_mode", "forward_rules", "BOOLEAN NOT NULL DEFAULT 0"),
+        ("parallelism", "projects", "INTEGER NOT NULL DEFAULT 1"),
     ]
     with engine.connect() as conn:
         for col_name, table, col_def in migrations:
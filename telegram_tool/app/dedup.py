@@ -0,0 +1,68 @@
+"""跨账号重复转发抑制
+
+多个小号收到同一条机器人广播时，只有第一份会被转发到目标。
+按内容指纹（发件人 + 文本哈希 + 媒体ID + 时间分桶 + 目标）去重，
+使用有容量上限的 TTL 缓存（按插入顺序淘汰最旧条目）。
+"""
+
+import time
+from collections import OrderedDict
+
+
+def message_fingerprint(message, target: int, window: int) -> tuple:
+    """计算消息指纹（不含时间分桶）及所在时间桶"""
+    media = message.photo or message.document
+    media_id = media.id if media is not None else 0
+    bucket = int(message.date.timestamp()) // window if message.date else 0
+    return (message.sender_id, hash(message.message or ""), media_id, target), bucket
+
+
+class DedupCache:
+    """TTL 去重缓存，超出容量时淘汰最旧条目"""
+
+    def __init__(self, window: int = 60, max_entries: int = 10000):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, float] = OrderedDict()   # key -> 过期时间
+        self.counters: dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def seen(self, message, target: int) -> bool:
+        """已在窗口内出现过则返回 True，否则记录并返回 False"""
+        if not self.enabled:
+            return False
+        fp, bucket = message_fingerprint(message, target, self.window)
+        now = time.monotonic()
+        entries = self._entries
+        # 相邻时间桶也视为重复，避免两份副本恰好跨越桶边界
+        for b in (bucket, bucket - 1, bucket + 1):
+            expires = entries.get((fp, b))
+            if expires is not None and expires > now:
+                self.counters["hits"] += 1
+                return True
+
+        self.counters["misses"] += 1
+        entries[(fp, bucket)] = now + self.window * 2
+        self._evict(now)
+        return False
+
+    def _evict(self, now: float):
+        entries = self._entries
+        # 插入有序：最早的在前，过期或超出容量时从头部淘汰
+        while entries:
+            key, expires = next(iter(entries.items()))
+            if expires > now and len(entries) <= self.max_entries:
+                break
+            entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            **self.counters,
+        }
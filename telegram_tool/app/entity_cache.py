@@ -0,0 +1,173 @@
+"""目标实体解析缓存
+
+将 (账号, 目标字符串) 映射到已解析的 InputPeer，并持久化到 entity_cache 表。
+定时发送直接使用缓存的 InputPeer，不再触发 ResolveUsername / GetEntity；
+未命中或发送时报告实体失效时才重新解析。
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telethon import TelegramClient, errors, utils
+from telethon.tl import types
+
+try:
+    from .database import engine
+    from .models import EntityCache as EntityCacheModel
+except ImportError:
+    from database import engine
+    from models import EntityCache as EntityCacheModel
+
+logger = logging.getLogger(__name__)
+
+_table = EntityCacheModel.__table__
+
+# 发送时遇到这些错误说明缓存的实体可能已失效
+# （不含 ValueError：发送过程中的其他 ValueError 会被误判为实体失效并重发一次）
+INVALID_PEER_ERRORS = (
+    errors.PeerIdInvalidError,
+    errors.ChannelInvalidError,
+    errors.ChatIdInvalidError,
+    errors.UserIdInvalidError,
+    errors.ChannelPrivateError,
+)
+
+
+def normalize_target(target: str) -> str:
+    """规范化目标：@Foo / foo -> foo，数字 ID 原样保留"""
+    target = target.strip()
+    try:
+        return str(int(target))
+    except ValueError:
+        return target.lstrip("@").lower()
+
+
+def chat_key(peer, target: str):
+    """限速用的会话键：已解析 peer 的带标记 ID（与转发任务的目标 ID 同一形式），
+    使同一会话无论按 @username 发送还是被转发，都落在同一个令牌桶里"""
+    try:
+        return utils.get_peer_id(peer)
+    except TypeError:
+        # InputPeerSelf 等无法得到 ID 的 peer 退回规范化的目标字符串
+        return normalize_target(target)
+
+
+def _to_row(peer) -> Optional[tuple[str, str, str]]:
+    if isinstance(peer, types.InputPeerUser):
+        return "user", str(peer.user_id), str(peer.access_hash)
+    if isinstance(peer, types.InputPeerChannel):
+        return "channel", str(peer.channel_id), str(peer.access_hash)
+    if isinstance(peer, types.InputPeerChat):
+        return "chat", str(peer.chat_id), ""
+    if isinstance(peer, types.InputPeerSelf):
+        return "self", "", ""
+    return None   # *FromMessage 等依赖上下文的 peer 不缓存
+
+
+def _from_row(peer_type: str, peer_id: str, access_hash: str):
+    if peer_type == "user":
+        return types.InputPeerUser(int(peer_id), int(access_hash))
+    if peer_type == "channel":
+        return types.InputPeerChannel(int(peer_id), int(access_hash))
+    if peer_type == "chat":
+        return types.InputPeerChat(int(peer_id))
+    if peer_type == "self":
+        return types.InputPeerSelf()
+    return None
+
+
+class EntityCache:
+    """内存 + 数据库两级的实体解析缓存"""
+
+    def __init__(self):
+        self._peers: dict[tuple[int, str], object] = {}
+        self.counters: dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "resolve_failures": 0}
+
+    def load(self):
+        """启动时从数据库载入全部缓存"""
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(_table.c.account_id, _table.c.target, _table.c.peer_type,
+                       _table.c.peer_id, _table.c.access_hash)
+            ).all()
+        for aid, target, peer_type, peer_id, access_hash in rows:
+            peer = _from_row(peer_type, peer_id, access_hash)
+            if peer is not None:
+                self._peers[(aid, target)] = peer
+        logger.info(f"Entity cache loaded: {len(self._peers)} peer(s)")
+
+    def get(self, account_id: int, target: str):
+        return self._peers.get((account_id, normalize_target(target)))
+
+    async def resolve(self, account_id: int, client: TelegramClient, target: str):
+        """返回目标的 InputPeer；缓存未命中时通过 Telethon 解析并持久化"""
+        key = (account_id, normalize_target(target))
+        peer = self._peers.get(key)
+        if peer is not None:
+            self.counters["hits"] += 1
+            return peer
+
+        self.counters["misses"] += 1
+        # Telethon 要求纯数字ID（如群组 -4688142035）以 int 格式传入，
+        # 否则会当作 username 去搜索，导致 "Cannot find any entity" 错误
+        try:
+            entity = int(target)
+        except ValueError:
+            entity = target.strip()  # 保留原始字符串（如 @username）
+        try:
+            peer = await client.get_input_entity(entity)
+        except Exception:
+            self.counters["resolve_failures"] += 1
+            raise
+
+        self._peers[key] = peer
+        row = _to_row(peer)
+        if row is not None:
+            await asyncio.to_thread(self._save, key, row)
+        return peer
+
+    async def invalidate(self, account_id: int, target: str):
+        key = (account_id, normalize_target(target))
+        if self._peers.pop(key, None) is not None:
+            self.counters["invalidations"] += 1
+            await asyncio.to_thread(
+                self._delete, _table.c.account_id == key[0], _table.c.target == key[1],
+            )
+
+    async def forget_account(self, account_id: int):
+        """账号登出或删除时清除其缓存"""
+        for key in [k for k in self._peers if k[0] == account_id]:
+            del self._peers[key]
+        await asyncio.to_thread(self._delete, _table.c.account_id == account_id)
+
+    @staticmethod
+    def _delete(*conditions):
+        with engine.begin() as conn:
+            conn.execute(delete(_table).where(*conditions))
+
+    @staticmethod
+    def _save(key: tuple[int, str], row: tuple[str, str, str]):
+        peer_type, peer_id, access_hash = row
+        stmt = sqlite_insert(_table).values(
+            account_id=key[0], target=key[1], peer_type=peer_type,
+            peer_id=peer_id, access_hash=access_hash, updated_at=datetime.now(timezone.utc),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["account_id", "target"],
+            set_={"peer_type": peer_type, "peer_id": peer_id, "access_hash": access_hash,
+                  "updated_at": stmt.excluded.updated_at},
+        )
+        with engine.begin() as conn:
+            conn.execute(stmt)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "size": len(self._peers),
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            **self.counters,
+        }
@@ -0,0 +1,115 @@
+"""转发事件预过滤
+
+events.NewMessage 默认会为账号看到的每条群组/频道消息构建事件对象，
+再交给处理器判断是否私聊。这里把过滤前移到 Telethon 的事件构建阶段：
+
+1. build 阶段：只看原始 update 的类型与 peer，会话类型不在任何规则范围内、
+   自己发出的消息、或当前没有任何规则时直接丢弃，不构建事件对象；
+2. func 阶段：按发件人 ID 查分发表，既没有 ID 命中、也没有可能命中的用户名规则时丢弃。
+
+规则热更新只替换分发器快照，两个阶段每次都读取最新快照，无需重新注册处理器。
+"""
+
+from typing import Optional
+
+from telethon import events
+from telethon.tl import types
+
+try:
+    from .forward_rules import ForwardDispatcher, chat_type_of
+    from .metrics import forward_received, forward_filtered
+except ImportError:
+    from forward_rules import ForwardDispatcher, chat_type_of
+    from metrics import forward_received, forward_filtered
+
+# 各过滤阶段的丢弃计数（所有客户端共用）
+PREFILTER_STAGES = ("no_rules", "outgoing", "chat_type", "account", "sender")
+
+
+class ForwardNewMessage(events.NewMessage):
+    """在构建阶段按规则快照丢弃无关消息的 NewMessage
+
+    Telethon 以类方法调用 build，且同一 update 对同一事件类型只构建一次，
+    因此分发器与计数器挂在类属性上，由 configure 设置一次。
+    """
+
+    dispatcher: Optional[ForwardDispatcher] = None
+    dropped: dict[str, int] = dict.fromkeys(PREFILTER_STAGES, 0)
+    passed = 0
+
+    @classmethod
+    def configure(cls, dispatcher: ForwardDispatcher):
+        cls.dispatcher = dispatcher
+
+    @classmethod
+    def build(cls, update, others=None, self_id=None):
+        if isinstance(update, (types.UpdateNewMessage, types.UpdateNewChannelMessage)):
+            message = update.message
+            if not isinstance(message, types.Message):
+                return
+            out, peer = message.out, message.peer_id
+        elif isinstance(update, types.UpdateShortMessage):
+            out, peer = update.out, None
+        elif isinstance(update, types.UpdateShortChatMessage):
+            out, peer = update.out, types.PeerChat(update.chat_id)
+        else:
+            return
+
+        if cls.dispatcher is not None:
+            table = cls.dispatcher.snapshot.table
+            if not table.rule_count:
+                cls.dropped["no_rules"] += 1
+                return
+            if out:
+                cls.dropped["outgoing"] += 1
+                return
+            if not _peer_may_match(peer, table.chat_types):
+                cls.dropped["chat_type"] += 1
+                return
+
+        return super().build(update, others, self_id)
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {"passed": cls.passed, "dropped": dict(cls.dropped)}
+
+
+def _peer_may_match(peer, chat_types: frozenset[str]) -> bool:
+    """仅凭 peer 类型判断会话是否可能落在规则的会话类型内（peer 为 None 表示私聊）"""
+    if peer is None or isinstance(peer, types.PeerUser):
+        return "private" in chat_types
+    if isinstance(peer, types.PeerChat):
+        return "group" in chat_types
+    # 频道与超级群组共用 PeerChannel，需要实体信息才能区分
+    return "group" in chat_types or "channel" in chat_types
+
+
+def sender_filter(account_id: int, dispatcher: ForwardDispatcher):
+    """生成按发件人过滤的 func：ID 命中的目标记录在 event.forward_targets 上供处理器复用"""
+    dropped = ForwardNewMessage.dropped
+
+    def check(event) -> bool:
+        table = dispatcher.snapshot.table
+        if not table.uses_account(account_id):
+            dropped["account"] += 1
+            forward_filtered.inc(account_id, "account")
+            return False
+        chat_type = chat_type_of(event)
+        targets = table.match_id(account_id, event.sender_id, chat_type)
+        if not targets and not table.needs_username(account_id, targets):
+            dropped["sender"] += 1
+            forward_filtered.inc(account_id, "sender")
+            return False
+        forward_received.inc(account_id)
+        event.forward_chat_type = chat_type
+        event.forward_targets = targets
+        ForwardNewMessage.passed += 1
+        return True
+
+    return check
+
+
+def forward_event(account_id: int, dispatcher: ForwardDispatcher) -> ForwardNewMessage:
+    """构建某个账号的转发事件过滤器"""
+    ForwardNewMessage.configure(dispatcher)
+    return ForwardNewMessage(incoming=True, func=sender_filter(account_id, dispatcher))
@@ -0,0 +1,307 @@
+"""转发队列
+
+消息处理器只负责把转发任务放入按账号划分的有界队列，
+由每个账号独立的 worker 协程池异步消费，避免慢速转发阻塞 Telethon 的更新分发。
+入队前由合并器在短时间窗口内把同一 (账号, 来源会话, 目标) 的消息合并为一次转发，
+并保证相册（同一 grouped_id）不会被拆开。合并器为每个账号缓冲的消息数有上限，
+达到上限时处理器直接等待入队，队列满的背压仍能传递到更新分发。
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+try:
+    from .metrics import forward_sent, forward_failed, forward_latency
+    from .outbox import OutboxWriteError
+except ImportError:
+    from metrics import forward_sent, forward_failed, forward_latency
+    from outbox import OutboxWriteError
+
+logger = logging.getLogger(__name__)
+
+
+# Telegram 单次 forward_messages 最多 100 条
+MAX_FORWARD_BATCH = 100
+
+
+@dataclass(slots=True)
+class ForwardJob:
+    """一次转发请求（同一来源会话的若干条消息）"""
+    account_id: int
+    chat_id: int                      # 来源会话
+    target: int
+    messages: list                    # telethon Message 列表；从发件箱重放时为消息 ID 列表
+    enqueued_at: float = field(default_factory=time.monotonic)
+    outbox_key: Optional[str] = None  # 发件箱记录键
+    received_at: float = field(default_factory=time.monotonic)  # 批次中第一条消息被处理器收到的时间
+
+    @property
+    def message_ids(self) -> list[int]:
+        return [m if isinstance(m, int) else m.id for m in self.messages]
+
+
+class RateCounter:
+    """按秒分桶的滑动窗口计数器，用于计算速率"""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._buckets = [0] * window
+        self._stamps = [0] * window
+
+    def add(self, n: int = 1):
+        sec = int(time.monotonic())
+        idx = sec % self.window
+        if self._stamps[idx] != sec:
+            self._stamps[idx] = sec
+            self._buckets[idx] = 0
+        self._buckets[idx] += n
+
+    def rate(self) -> float:
+        """最近 window 秒内的平均每秒次数"""
+        now = int(time.monotonic())
+        total = sum(
+            b for b, s in zip(self._buckets, self._stamps) if now - s < self.window
+        )
+        return total / self.window
+
+
+class ForwardQueue:
+    """按账号划分的有界转发队列 + worker 池"""
+
+    def __init__(self, handler: Callable[[ForwardJob], Awaitable[None]],
+                 maxsize: int = 1000, workers: int = 1, outbox=None, latency=None):
+        self._handler = handler
+        self.outbox = outbox
+        self.latency = latency
+        self.maxsize = maxsize
+        self.workers = max(1, workers)
+        self._queues: dict[int, asyncio.Queue] = {}          # account_id -> queue
+        self._tasks: dict[int, list[asyncio.Task]] = {}      # account_id -> workers
+        self._drain = RateCounter()
+        self.counters: dict[str, int] = {"enqueued": 0, "processed": 0, "failed": 0, "blocked": 0, "unpersisted": 0}
+
+    def _ensure(self, account_id: int) -> asyncio.Queue:
+        queue = self._queues.get(account_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.maxsize)
+            self._queues[account_id] = queue
+            self._tasks[account_id] = [
+                asyncio.create_task(self._worker(account_id, queue))
+                for _ in range(self.workers)
+            ]
+        return queue
+
+    async def put(self, job: ForwardJob):
+        """入队；队列满时等待（对该账号的更新分发形成背压）"""
+        queue = self._ensure(job.account_id)
+        if queue.full():
+            self.counters["blocked"] += 1
+            logger.warning(f"Forward queue full for account #{job.account_id}, applying backpressure")
+        # 入队前先持久化到发件箱（组提交，不逐条同步 commit）
+        await self.persist(job)
+        await queue.put(job)
+        self.counters["enqueued"] += 1
+
+    async def persist(self, job: ForwardJob):
+        """把任务写入发件箱；多次写入失败时记录日志，任务照常转发但不再能重放"""
+        if self.outbox is None or job.outbox_key is not None:
+            return
+        try:
+            job.outbox_key = await self.outbox.record(job)
+        except OutboxWriteError as e:
+            self.counters["unpersisted"] += 1
+            logger.error(
+                f"Outbox record failed for account #{job.account_id} "
+                f"({len(job.messages)} message(s)), forwarding without replay: {e}"
+            )
+
+    async def _worker(self, account_id: int, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            dequeued_at = time.monotonic()
+            try:
+                await self._handler(job)
+                completed_at = time.monotonic()
+                self.counters["processed"] += 1
+                forward_sent.inc(account_id, amount=len(job.messages))
+                forward_latency.observe(completed_at - job.enqueued_at, account_id)
+                if self.latency is not None:
+                    self.latency.record(job, dequeued_at, completed_at)
+                if self.outbox is not None:
+                    self.outbox.mark_done(job.outbox_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["failed"] += 1
+                forward_failed.inc(account_id)
+                logger.error(f"Forward failed (account #{account_id}): {e}")
+                if self.outbox is not None:
+                    self.outbox.mark_failed(job.outbox_key, str(e))
+            finally:
+                queue.task_done()
+                self._drain.add()
+
+    async def stop(self):
+        """取消所有 worker"""
+        tasks = [t for ts in self._tasks.values() for t in ts]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queues.clear()
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "per_account": {aid: q.qsize() for aid, q in self._queues.items()},
+            "maxsize": self.maxsize,
+            "workers_per_account": self.workers,
+            "drain_rate": round(self._drain.rate(), 3),
+            **self.counters,
+        }
+
+
+class _Batch:
+    __slots__ = ("messages", "first_added", "last_added", "task")
+
+    def __init__(self):
+        self.messages: list = []
+        self.first_added = time.monotonic()
+        self.last_added = 0.0
+        self.task: asyncio.Task | None = None
+
+
+class ForwardCoalescer:
+    """在 window 秒内合并同一 (账号, 来源会话, 目标) 的消息，批量入队"""
+
+    # 窗口到期时若相册仍在陆续到达，最多再延长的次数
+    ALBUM_EXTENSIONS = 3
+
+    def __init__(self, queue: ForwardQueue, window: float, max_batch: int = MAX_FORWARD_BATCH,
+                 max_buffered: int = 1000):
+        self.queue = queue
+        self.window = window
+        self.max_batch = max(1, min(max_batch, MAX_FORWARD_BATCH))
+        self.max_buffered = max(self.max_batch, max_buffered)
+        self._batches: dict[tuple, _Batch] = {}
+        # account_id -> 已缓冲但尚未进入队列的消息数（含等待入队的批次）
+        self._buffered: dict[int, int] = {}
+        self.counters: dict[str, int] = {
+            "messages": 0, "batches": 0, "album_splits_avoided": 0, "buffer_full_flushes": 0,
+        }
+
+    async def add(self, account_id: int, chat_id: int, target: int, message):
+        self.counters["messages"] += 1
+        if self.window <= 0:
+            await self._emit(account_id, chat_id, target, [message])
+            return
+
+        if self._buffered.get(account_id, 0) >= self.max_buffered:
+            # 缓冲已满：在处理器中直接发出该账号的批次，等待入队形成背压
+            self.counters["buffer_full_flushes"] += 1
+            await self._flush_account(account_id)
+
+        key = (account_id, chat_id, target)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._new_batch(key)
+        batch.messages.append(message)
+        batch.last_added = time.monotonic()
+        self._buffered[account_id] = self._buffered.get(account_id, 0) + 1
+
+        if len(batch.messages) >= self.max_batch:
+            await self._flush_full(key, batch)
+
+    async def _flush_account(self, account_id: int):
+        for key in [k for k in self._batches if k[0] == account_id]:
+            batch = self._batches.pop(key)
+            batch.task.cancel()
+            await self._emit(*key, batch.messages, batch.first_added)
+
+    def _new_batch(self, key: tuple) -> _Batch:
+        batch = _Batch()
+        batch.task = asyncio.create_task(self._flush_later(key, batch))
+        self._batches[key] = batch
+        return batch
+
+    async def _flush_full(self, key: tuple, batch: _Batch):
+        """批次已满：立即发出，末尾未完整的相册留到下一批"""
+        del self._batches[key]
+        batch.task.cancel()
+        messages = batch.messages
+        gid = getattr(messages[-1], "grouped_id", None)
+        if gid:
+            split = len(messages)
+            while split > 0 and getattr(messages[split - 1], "grouped_id", None) == gid:
+                split -= 1
+            if split > 0:
+                carry = self._new_batch(key)
+                carry.messages = messages[split:]
+                carry.first_added = batch.last_added
+                carry.last_added = batch.last_added
+                messages = messages[:split]
+                self.counters["album_splits_avoided"] += 1
+        await self._emit(*key, messages, batch.first_added)
+
+    async def _flush_later(self, key: tuple, batch: _Batch):
+        await asyncio.sleep(self.window)
+        # 相册的各条消息以独立更新到达，窗口到期时若仍在到达则稍作延长
+        for _ in range(self.ALBUM_EXTENSIONS):
+            last = batch.messages[-1] if batch.messages else None
+            if not getattr(last, "grouped_id", None):
+                break
+            remaining = batch.last_added + self.window - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+            await self._emit(*key, batch.messages, batch.first_added)
+
+    async def _emit(self, account_id: int, chat_id: int, target: int, messages: list,
+                    received_at: Optional[float] = None):
+        self.counters["batches"] += 1
+        job = ForwardJob(account_id, chat_id, target, messages)
+        if received_at is not None:
+            job.received_at = received_at
+        try:
+            await self.queue.put(job)
+        finally:
+            if self.window > 0:
+                left = self._buffered.get(account_id, 0) - len(messages)
+                if left > 0:
+                    self._buffered[account_id] = left
+                else:
+                    self._buffered.pop(account_id, None)
+
+    async def stop(self):
+        """停止合并：窗口内尚未发出的批次写入发件箱，下次启动时重放"""
+        batches, self._batches = self._batches, {}
+        tasks = [b.task for b in batches.values() if b.task]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._buffered.clear()
+        jobs = []
+        for (account_id, chat_id, target), batch in batches.items():
+            job = ForwardJob(account_id, chat_id, target, batch.messages)
+            job.received_at = batch.first_added
+            jobs.append(job)
+        if jobs and self.queue.outbox is not None:
+            await asyncio.gather(*(self.queue.persist(job) for job in jobs))
+            logger.info(f"Coalescer stopped, {len(jobs)} pending batch(es) saved to outbox for replay")
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": int(self.window * 1000),
+            "pending_batches": len(self._batches),
+            "buffered": sum(self._buffered.values()),
+            "max_buffered_per_account": self.max_buffered,
+            **self.counters,
+        }
@@ -0,0 +1,233 @@
+"""转发规则编译
+
+把数据库中的转发规则（含旧版单例 ForwardConfig）编译成内存分发表：
+以 (账号ID, 发件人ID) 为键的字典，收到消息时只需常数次字典查找即可得到目标列表，
+与规则数量无关。
+
+分发表以不可变快照的形式发布，所有客户端共用一个 ForwardDispatcher；
+配置变更时只读一次数据库构建新快照并整体替换，事件处理器无需重新注册。
+"""
+
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+try:
+    from .database import SessionLocal
+    from .models import ForwardConfig, ForwardRule
+except ImportError:
+    from database import SessionLocal
+    from models import ForwardConfig, ForwardRule
+
+logger = logging.getLogger(__name__)
+
+CHAT_TYPES = ("private", "group", "channel")
+PRIVATE_ONLY = frozenset({"private"})
+
+# 兼容旧版单例转发配置时使用的规则 ID
+LEGACY_RULE_ID = 0
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledRule:
+    """编译后的单条规则"""
+    id: int
+    name: str
+    chat_types: frozenset[str]
+    targets: tuple[int, ...]
+    copy: bool = False          # 以副本方式发送（不带“转发自”）
+
+
+def parse_json_list(raw: Optional[str]) -> list:
+    """解析 JSON 数组字段，非法内容视为空列表"""
+    try:
+        value = json.loads(raw) if raw else []
+    except json.JSONDecodeError:
+        return []
+    return value if isinstance(value, list) else []
+
+
+def split_senders(senders: Iterable) -> tuple[set[int], set[str]]:
+    """将发件人列表拆分为 (数字 ID 集合, 小写且去掉 @ 的用户名集合)"""
+    ids: set[int] = set()
+    names: set[str] = set()
+    for item in senders:
+        item = str(item).strip()
+        if not item:
+            continue
+        try:
+            ids.add(int(item))
+        except ValueError:
+            name = item.lower().lstrip("@")
+            if name:
+                names.add(name)
+    return ids, names
+
+
+def chat_type_of(event) -> str:
+    """判断消息所在会话类型：private / group / channel"""
+    if event.is_private:
+        return "private"
+    if event.is_group:
+        return "group"
+    return "channel"
+
+
+class DispatchTable:
+    """转发分发表
+
+    键中的 None 表示通配：(None, sid) 对所有账号生效，(aid, None) 对该账号的所有发件人生效。
+    """
+
+    def __init__(self):
+        self.by_id: dict[tuple[Optional[int], Optional[int]], tuple[CompiledRule, ...]] = {}
+        self.by_name: dict[tuple[Optional[int], str], tuple[CompiledRule, ...]] = {}
+        # 用户名规则涉及的目标，按账号归类（None 表示对所有账号生效）
+        self.name_targets: dict[Optional[int], set[int]] = {}
+        self.chat_types: frozenset[str] = frozenset()
+        # 规则涉及的接收账号（None 表示存在对所有账号生效的规则）
+        self.accounts: set[Optional[int]] = set()
+        # 以副本方式发送的目标（任一复制模式规则指向的目标）
+        self.copy_targets: set[int] = set()
+        self.rule_count = 0
+
+    def _add(self, table: dict, key, rule: CompiledRule):
+        table[key] = table.get(key, ()) + (rule,)
+
+    def add_rule(self, rule: CompiledRule, accounts: set[int],
+                 sender_ids: set[int], sender_names: set[str]):
+        account_keys = accounts or {None}
+        if not sender_ids and not sender_names:
+            for aid in account_keys:
+                self._add(self.by_id, (aid, None), rule)
+        for sid in sender_ids:
+            for aid in account_keys:
+                self._add(self.by_id, (aid, sid), rule)
+        for name in sender_names:
+            for aid in account_keys:
+                self._add(self.by_name, (aid, name), rule)
+                self.name_targets.setdefault(aid, set()).update(rule.targets)
+        self.chat_types |= rule.chat_types
+        self.accounts.update(account_keys)
+        if rule.copy:
+            self.copy_targets.update(rule.targets)
+        self.rule_count += 1
+
+    def uses_account(self, account_id: int) -> bool:
+        """该账号是否需要参与转发"""
+        return None in self.accounts or account_id in self.accounts
+
+    @property
+    def private_only(self) -> bool:
+        """所有规则都只针对私聊"""
+        return self.chat_types <= PRIVATE_ONLY
+
+    def match_id(self, account_id: int, sender_id: Optional[int], chat_type: str) -> set[int]:
+        """按发件人 ID 匹配（无 RPC），返回目标集合"""
+        targets: set[int] = set()
+        get = self.by_id.get
+        for key in ((account_id, sender_id), (None, sender_id), (account_id, None), (None, None)):
+            for rule in get(key, ()):
+                if chat_type in rule.chat_types:
+                    targets.update(rule.targets)
+        return targets
+
+    def needs_username(self, account_id: int, matched: set[int]) -> bool:
+        """是否还需要按用户名匹配：只有用户名规则可能带来尚未命中的目标时才需要"""
+        names = self.name_targets
+        if not names:
+            return False
+        pending = names.get(account_id, set()) | names.get(None, set())
+        return not pending <= matched
+
+    def match_username(self, account_id: int, username: str, chat_type: str) -> set[int]:
+        """按发件人用户名匹配，返回目标集合"""
+        targets: set[int] = set()
+        name = username.lower()
+        for key in ((account_id, name), (None, name)):
+            for rule in self.by_name.get(key, ()):
+                if chat_type in rule.chat_types:
+                    targets.update(rule.targets)
+        return targets
+
+
+def _parse_targets(values: Iterable) -> tuple[int, ...]:
+    targets = []
+    for v in values:
+        try:
+            targets.append(int(v))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid forward target ignored: {v!r}")
+    return tuple(dict.fromkeys(targets))
+
+
+def build_dispatch_table(legacy, rules) -> DispatchTable:
+    """由旧版 ForwardConfig 与 ForwardRule 行构建分发表"""
+    table = DispatchTable()
+
+    if legacy is not None and legacy.is_enabled and legacy.target_chat_id:
+        targets = _parse_targets([legacy.target_chat_id])
+        if targets:
+            ids, names = split_senders(parse_json_list(legacy.allowed_senders))
+            rule = CompiledRule(LEGACY_RULE_ID, "默认规则", PRIVATE_ONLY, targets)
+            table.add_rule(rule, set(), ids, names)
+
+    for r in rules:
+        if not r.is_enabled:
+            continue
+        targets = _parse_targets(parse_json_list(r.target_chat_ids))
+        if not targets:
+            continue
+        chat_types = frozenset(t for t in parse_json_list(r.chat_types) if t in CHAT_TYPES) or PRIVATE_ONLY
+        accounts = set()
+        for a in parse_json_list(r.account_ids):
+            try:
+                accounts.add(int(a))
+            except (TypeError, ValueError):
+                pass
+        ids, names = split_senders(parse_json_list(r.sender_filters))
+        table.add_rule(CompiledRule(r.id, r.name, chat_types, targets, bool(r.copy_mode)), accounts, ids, names)
+
+    return table
+
+
+@dataclass(frozen=True, slots=True)
+class RuleSnapshot:
+    """某一版本的规则快照（发布后不再修改）"""
+    version: int
+    table: DispatchTable
+    loaded_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class ForwardDispatcher:
+    """持有当前规则快照，供所有客户端的转发处理器读取"""
+
+    def __init__(self):
+        self.snapshot = RuleSnapshot(0, DispatchTable())
+
+    def reload(self) -> RuleSnapshot:
+        """从数据库读取一次规则，构建新快照并原子替换"""
+        db = SessionLocal()
+        try:
+            table = build_dispatch_table(
+                db.query(ForwardConfig).first(),
+                db.query(ForwardRule).order_by(ForwardRule.sort_order, ForwardRule.id).all(),
+            )
+        finally:
+            db.close()
+
+        snapshot = RuleSnapshot(self.snapshot.version + 1, table)
+        self.snapshot = snapshot
+        logger.info(f"Forward rules loaded: version {snapshot.version}, {table.rule_count} rule(s)")
+        return snapshot
+
+    def stats(self) -> dict:
+        snap = self.snapshot
+        return {
+            "version": snap.version,
+            "rule_count": snap.table.rule_count,
+            "copy_targets": len(snap.table.copy_targets),
+            "loaded_at": snap.loaded_at.isoformat(),
+        }
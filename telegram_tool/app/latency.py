@@ -0,0 +1,176 @@
+"""端到端转发延迟统计
+
+每次转发记录三个时间点：收到消息（处理器收到事件）、出队（worker 取出任务）、完成（转发成功），
+并结合消息自身的 message.date 计算以下阶段的耗时：
+- total：消息在 Telegram 的发送时间 → 转发完成（message.date 只精确到秒）
+- local：本进程收到 → 转发完成
+- queue：收到 → 出队（含合并窗口与排队等待）
+- send：出队 → 完成（限速等待 + forward_messages 调用）
+
+耗时按毫秒记录到 HDR 风格的对数线性直方图中：每个 2 的幂区间再均分 16 个子桶，相对误差不超过 1/16，
+桶数与取值范围无关地保持很少。直方图按时间片滚动，只统计最近 window 秒，按账号和目标分别维护。
+"""
+
+import time
+from collections import deque
+from typing import Iterable
+
+STAGES = ("total", "local", "queue", "send")
+PERCENTILES = (50, 90, 99, 99.9)
+
+# 每个 2 的幂区间的子桶数（2^SUB_BITS）
+SUB_BITS = 4
+SUB_COUNT = 1 << SUB_BITS
+
+
+def bucket_index(value_ms: int) -> int:
+    """毫秒值 -> 桶序号（小于 SUB_COUNT 的值各占一个桶）"""
+    if value_ms < SUB_COUNT:
+        return max(0, value_ms)
+    shift = value_ms.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_COUNT + (value_ms >> shift) - SUB_COUNT
+
+
+def bucket_value(index: int) -> int:
+    """桶序号 -> 该桶可表示的最大毫秒值"""
+    if index < SUB_COUNT:
+        return index
+    shift = index // SUB_COUNT - 1
+    lower = (index % SUB_COUNT + SUB_COUNT) << shift
+    return lower + (1 << shift) - 1
+
+
+class RollingHistogram:
+    """按时间片滚动的稀疏直方图"""
+
+    __slots__ = ("slices",)
+
+    def __init__(self):
+        # [(时间片序号, {桶序号: 次数}), ...]
+        self.slices: deque[tuple[int, dict[int, int]]] = deque()
+
+    def record(self, value_ms: int, slice_id: int, keep: int):
+        if not self.slices or self.slices[-1][0] != slice_id:
+            self.slices.append((slice_id, {}))
+            while self.slices[0][0] <= slice_id - keep:
+                self.slices.popleft()
+        counts = self.slices[-1][1]
+        idx = bucket_index(value_ms)
+        counts[idx] = counts.get(idx, 0) + 1
+
+    def snapshot(self, slice_id: int, keep: int) -> dict[int, int]:
+        """合并仍在窗口内的时间片"""
+        merged: dict[int, int] = {}
+        for sid, counts in self.slices:
+            if sid > slice_id - keep:
+                for idx, n in counts.items():
+                    merged[idx] = merged.get(idx, 0) + n
+        return merged
+
+
+def merge_counts(parts: Iterable[dict]) -> dict[int, int]:
+    merged: dict[int, int] = {}
+    for counts in parts:
+        for idx, n in counts.items():
+            idx = int(idx)
+            merged[idx] = merged.get(idx, 0) + n
+    return merged
+
+
+def summarize(counts: dict[int, int]) -> dict:
+    """由桶计数计算分位数（毫秒）"""
+    total = sum(counts.values())
+    result: dict = {"count": total}
+    if not total:
+        return result
+    ordered = sorted((int(i), n) for i, n in counts.items())
+    targets = [(p, total * p / 100) for p in PERCENTILES]
+    seen = 0
+    pos = 0
+    for idx, n in ordered:
+        seen += n
+        while pos < len(targets) and seen >= targets[pos][1]:
+            result[f"p{targets[pos][0]:g}"] = bucket_value(idx)
+            pos += 1
+    result["max"] = bucket_value(ordered[-1][0])
+    return result
+
+
+class ForwardLatencyTracker:
+    """按账号、按目标统计转发各阶段的耗时"""
+
+    def __init__(self, window: int = 300, slices: int = 10):
+        self.window = window
+        self.slices = max(1, slices)
+        self.slice_seconds = max(1, window // self.slices)
+        self._accounts: dict[int, dict[str, RollingHistogram]] = {}
+        self._targets: dict[int, dict[str, RollingHistogram]] = {}
+        self.recorded = 0
+
+    def _slice_id(self) -> int:
+        return int(time.monotonic() // self.slice_seconds)
+
+    def record(self, job, dequeued_at: float, completed_at: float):
+        """记录一次成功转发（从发件箱重放的任务没有收到时间，不计入）"""
+        if not job.messages or isinstance(job.messages[0], int):
+            return
+        values = {
+            "local": completed_at - job.received_at,
+            "queue": dequeued_at - job.received_at,
+            "send": completed_at - dequeued_at,
+        }
+        date = getattr(job.messages[0], "date", None)
+        if date is not None:
+            values["total"] = time.time() - date.timestamp()
+
+        sid = self._slice_id()
+        for key, table in ((job.account_id, self._accounts), (job.target, self._targets)):
+            stages = table.get(key)
+            if stages is None:
+                stages = table[key] = {s: RollingHistogram() for s in STAGES}
+            for stage, seconds in values.items():
+                stages[stage].record(int(max(0.0, seconds) * 1000), sid, self.slices)
+        self.recorded += 1
+
+    def export(self) -> dict:
+        """导出窗口内的原始桶计数（可跨进程合并）"""
+        sid = self._slice_id()
+
+        def dump(table: dict) -> dict:
+            result = {}
+            for key, stages in table.items():
+                counts = {s: h.snapshot(sid, self.slices) for s, h in stages.items()}
+                if any(counts.values()):
+                    result[str(key)] = counts
+            return result
+
+        return {"window": self.window, "accounts": dump(self._accounts), "targets": dump(self._targets)}
+
+
+def merge_exports(parts: list[dict]) -> dict:
+    """合并多个进程导出的桶计数"""
+    merged: dict = {"window": parts[0]["window"] if parts else 0, "accounts": {}, "targets": {}}
+    for part in parts:
+        for section in ("accounts", "targets"):
+            for key, stages in part[section].items():
+                dest = merged[section].setdefault(key, {})
+                for stage, counts in stages.items():
+                    dest[stage] = merge_counts([dest.get(stage, {}), counts])
+    return merged
+
+
+def latency_report(export: dict) -> dict:
+    """把桶计数转换为各阶段的分位数报表"""
+    overall = {
+        stage: summarize(merge_counts(s.get(stage, {}) for s in export["accounts"].values()))
+        for stage in STAGES
+    }
+    accounts = {
+        key: {stage: summarize(stages.get(stage, {})) for stage in STAGES}
+        for key, stages in export["accounts"].items()
+    }
+    targets = {
+        key: {stage: summarize(stages.get(stage, {})) for stage in STAGES}
+        for key, stages in export["targets"].items()
+    }
+    return {"window": export["window"], "overall": overall, "accounts": accounts, "targets": targets}
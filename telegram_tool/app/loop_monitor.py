@@ -0,0 +1,166 @@
+"""事件循环延迟监控
+
+监控协程每隔 interval 休眠一次，实际唤醒时间与预期的差值即调度延迟（loop lag），
+反映事件循环被同步调用（如 SQLAlchemy 查询）阻塞的程度。最近的样本保存在环形缓冲区中用于计算分位数。
+
+协程只能在阻塞结束后才测到延迟，无法看到是谁阻塞了循环；因此另有一个看门狗线程检查
+监控协程的心跳，心跳超过阈值未更新时，直接从 sys._current_frames() 抓取事件循环线程的
+当前调用栈并记录日志，定位阻塞转发的代码路径。
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+try:
+    from .config import LOOP_MONITOR_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS, LOOP_LAG_SAMPLES
+    from .metrics import registry, gauge, counter_family
+except ImportError:
+    from config import LOOP_MONITOR_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS, LOOP_LAG_SAMPLES
+    from metrics import registry, gauge, counter_family
+
+logger = logging.getLogger(__name__)
+
+# 记录最近多少条阻塞调用栈
+STALL_HISTORY = 20
+
+
+def use_uvloop(backend: str) -> bool:
+    """按配置决定是否使用 uvloop（auto 表示已安装时使用）"""
+    if backend == "asyncio":
+        return False
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        if backend == "uvloop":
+            logger.warning("EVENT_LOOP=uvloop but uvloop is not installed, falling back to asyncio")
+        return False
+    return True
+
+
+def run(main, backend: str = "auto"):
+    """以配置的事件循环实现运行协程（供独立进程入口使用）"""
+    if use_uvloop(backend):
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(main)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class LoopLagMonitor:
+    """事件循环调度延迟监控"""
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.2, samples: int = 2400):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: deque[float] = deque(maxlen=samples)
+        self.stalls: deque[dict] = deque(maxlen=STALL_HISTORY)
+        self.counters: dict[str, int] = {"ticks": 0, "over_threshold": 0, "stack_samples": 0}
+        self.max_lag = 0.0
+        self.backend = ""
+        self._heartbeat = 0.0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.interval <= 0 or self._task:
+            return
+        loop = asyncio.get_running_loop()
+        self.backend = type(loop).__module__.split(".")[0]
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Loop monitor started ({self.backend}, interval {self.interval * 1000:.0f}ms)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.samples.append(lag)
+            self.counters["ticks"] += 1
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.counters["over_threshold"] += 1
+                logger.warning(f"Event loop lag {lag * 1000:.0f}ms")
+
+    def _watch(self):
+        """看门狗线程：心跳超时说明事件循环正被阻塞，抓取其调用栈（每次阻塞只记录一次）"""
+        sampled_for = 0.0
+        while not self._stop.wait(self.interval):
+            beat = self._heartbeat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == sampled_for:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            sampled_for = beat
+            stack = "".join(traceback.format_stack(frame))
+            self.counters["stack_samples"] += 1
+            self.stalls.append({
+                "at": time.time(),
+                "stalled_ms": round(stalled * 1000, 1),
+                "stack": stack,
+            })
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f}ms, stack:\n{stack}")
+
+    def collect_metrics(self) -> list:
+        values = sorted(self.samples)
+        return [
+            gauge("tgf_event_loop_lag_seconds", "Event loop scheduling lag over recent samples",
+                  [({"quantile": str(q)}, percentile(values, q)) for q in (0.5, 0.9, 0.99)]),
+            counter_family("tgf_event_loop_stalls", "Event loop lag samples over the threshold",
+                           [({}, self.counters["over_threshold"])]),
+        ]
+
+    def stats(self) -> dict:
+        values = sorted(self.samples)
+        return {
+            "backend": self.backend,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            **self.counters,
+            "lag_ms": {
+                "p50": round(percentile(values, 0.5) * 1000, 2),
+                "p90": round(percentile(values, 0.9) * 1000, 2),
+                "p99": round(percentile(values, 0.99) * 1000, 2),
+                "max": round(self.max_lag * 1000, 2),
+            },
+            "recent_stalls": list(self.stalls),
+        }
+
+
+# 全局单例（每个进程一个）
+loop_monitor = LoopLagMonitor(
+    LOOP_MONITOR_INTERVAL_MS / 1000, LOOP_LAG_THRESHOLD_MS / 1000, LOOP_LAG_SAMPLES,
+)
+registry.register_collector(loop_monitor.collect_metrics)
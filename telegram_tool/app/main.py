@@ -6,38 +6,48 @@ from contextlib import asynccontextmanager
 from datetime import datetime
 
 from fastapi import FastAPI, Depends, HTTPException, Query
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 
 try:
     from .database import SessionLocal, init_db, get_db
-    from .models import Account, ForwardConfig, Project, TaskLog, SubTask
+    from .models import Account, ForwardConfig, ForwardRule, Project, TaskLog, SubTask
     from .schemas import (
         AccountCreate, AccountUpdate, AccountResponse,
         LoginCodeRequest, LoginVerifyRequest,
-        ForwardConfigRequest, ForwardConfigResponse,
+        ForwardConfigRequest, ForwardConfigResponse, ForwardRuleCreate, ForwardRuleUpdate,
         ProjectCreate, ProjectUpdate, ProjectAssignAccounts, ProjectResponse,
         TaskLogResponse, DashboardResponse,
         SubTaskCreate, SubTaskUpdate, SubTaskResponse,
     )
     from .client_manager import client_manager
+    from .forward_rules import CHAT_TYPES, parse_json_list
     from .scheduler_service import scheduler_service
-    from .config import PORT, HOST
+    from .config import PORT, HOST, EVENT_LOOP
+    from .loop_monitor import loop_monitor
+    from .metrics import registry as metrics_registry, merge_families, render as render_metrics
+    from .shard import ShardCoordinator
+    from .session_store import remove_session
 except ImportError:
     from database import SessionLocal, init_db, get_db
-    from models import Account, ForwardConfig, Project, TaskLog, SubTask
+    from models import Account, ForwardConfig, ForwardRule, Project, TaskLog, SubTask
     from schemas import (
         AccountCreate, AccountUpdate, AccountResponse,
         LoginCodeRequest, LoginVerifyRequest,
-        ForwardConfigRequest, ForwardConfigResponse,
+        ForwardConfigRequest, ForwardConfigResponse, ForwardRuleCreate, ForwardRuleUpdate,
         ProjectCreate, ProjectUpdate, ProjectAssignAccounts, ProjectResponse,
         TaskLogResponse, DashboardResponse,
         SubTaskCreate, SubTaskUpdate, SubTaskResponse,
     )
     from client_manager import client_manager
+    from forward_rules import CHAT_TYPES, parse_json_list
     from scheduler_service import scheduler_service
-    from config import PORT, HOST
+    from config import PORT, HOST, EVENT_LOOP
+    from loop_monitor import loop_monitor
+    from metrics import registry as metrics_registry, merge_families, render as render_metrics
+    from shard import ShardCoordinator
+    from session_store import remove_session
 
 # ==================== 日志 ====================
 logging.basicConfig(
@@ -51,13 +61,27 @@ logger = logging.getLogger("tg_forward")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting Telegram Forward Tool...")
+    loop_monitor.start()
     init_db()
-    await client_manager.reconnect_all()
+    await client_manager.prepare()
+    # 后台并发重连，服务立即可用，可通过 /api/accounts/reconnect-progress 查看进度
+    reconnect_task = asyncio.create_task(
+        client_manager.reconnect_all(scheduler_service.upcoming_account_runs())
+    )
     await scheduler_service.start()
     yield
     logger.info("Shutting down...")
+    # 先等启动重连真正退出，避免它在客户端停止期间继续创建连接
+    reconnect_task.cancel()
+    try:
+        await reconnect_task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.error(f"Startup reconnect failed: {e}")
     await scheduler_service.stop()
     await client_manager.stop_all()
+    await loop_monitor.stop()
 
 app = FastAPI(title="Telegram 消息转发工具", lifespan=lifespan)
 
@@ -89,6 +113,8 @@ def project_to_dict(p: Project) -> dict:
     d["created_at"] = d["created_at"].isoformat() if d["created_at"] else ""
     d["updated_at"] = d["updated_at"].isoformat() if d["updated_at"] else ""
     d["account_ids"] = [a.id for a in p.accounts]
+    d["last_run"] = scheduler_service.last_runs.get(p.id)
+    d["active_runs"] = [r.to_dict() for r in scheduler_service.timeline.runs.values() if r.project_id == p.id]
     d["subtasks"] = [
         {
             "id": s.id, "project_id": s.project_id,
@@ -103,6 +129,28 @@ def project_to_dict(p: Project) -> dict:
     return d
 
 
+def forward_rule_to_dict(r: ForwardRule) -> dict:
+    return {
+        "id": r.id,
+        "name": r.name or "",
+        "sender_filters": parse_json_list(r.sender_filters),
+        "chat_types": parse_json_list(r.chat_types),
+        "account_ids": parse_json_list(r.account_ids),
+        "target_chat_ids": [str(t) for t in parse_json_list(r.target_chat_ids)],
+        "copy_mode": bool(r.copy_mode),
+        "is_enabled": r.is_enabled,
+        "sort_order": r.sort_order or 0,
+        "created_at": r.created_at.isoformat() if r.created_at else "",
+        "updated_at": r.updated_at.isoformat() if r.updated_at else "",
+    }
+
+
+def check_chat_types(chat_types: list[str]):
+    invalid = [t for t in chat_types if t not in CHAT_TYPES]
+    if invalid:
+        raise HTTPException(400, f"无效的会话类型: {', '.join(invalid)}")
+
+
 # ==================== API 路由 ====================
 
 # -- 仪表盘 --
@@ -112,6 +160,7 @@ def api_dashboard(db: Session = Depends(get_db)):
     accounts = db.query(Account).all()
     projects = db.query(Project).all()
     fwd = db.query(ForwardConfig).first()
+    rules_enabled = db.query(ForwardRule).filter(ForwardRule.is_enabled == True).count()
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     today_logs = db.query(TaskLog).filter(TaskLog.created_at >= today).count()
 
@@ -122,7 +171,7 @@ def api_dashboard(db: Session = Depends(get_db)):
         project_count=len(projects),
         project_enabled=sum(1 for p in projects if p.is_enabled),
         today_logs=today_logs,
-        forward_enabled=fwd.is_enabled if fwd else False,
+        forward_enabled=bool(fwd and fwd.is_enabled) or rules_enabled > 0,
     )
 
 
@@ -140,6 +189,24 @@ def api_list_accounts(db: Session = Depends(get_db)):
     return result
 
 
+@app.get("/api/accounts/reconnect-progress")
+async def api_reconnect_progress():
+    """启动时各账号的重连进度"""
+    return await client_manager.reconnect_summary()
+
+
+@app.get("/api/accounts/connections")
+async def api_account_connections():
+    """各账号的连接状态机、状态切换记录和 Ping RTT"""
+    return await client_manager.connection_stats()
+
+
+@app.get("/api/accounts/entity-cache")
+async def api_entity_cache_stats():
+    """定时发送目标实体缓存的命中统计"""
+    return await client_manager.entity_cache_stats()
+
+
 @app.post("/api/accounts")
 def api_create_account(data: AccountCreate, db: Session = Depends(get_db)):
     session_name = f"session_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
@@ -148,6 +215,7 @@ def api_create_account(data: AccountCreate, db: Session = Depends(get_db)):
         api_id=data.api_id,
         api_hash=data.api_hash,
         session_name=session_name,
+        role=data.role,
     )
     db.add(acc)
     db.commit()
@@ -156,7 +224,7 @@ def api_create_account(data: AccountCreate, db: Session = Depends(get_db)):
 
 
 @app.put("/api/accounts/{account_id}")
-def api_update_account(account_id: int, data: AccountUpdate, db: Session = Depends(get_db)):
+async def api_update_account(account_id: int, data: AccountUpdate, db: Session = Depends(get_db)):
     acc = db.query(Account).get(account_id)
     if not acc:
         raise HTTPException(404, "账号不存在")
@@ -168,7 +236,18 @@ def api_update_account(account_id: int, data: AccountUpdate, db: Session = Depen
         acc.api_hash = data.api_hash
     if data.is_active is not None:
         acc.is_active = data.is_active
+    role_changed = data.role is not None and data.role != acc.role
+    if role_changed:
+        acc.role = data.role
     db.commit()
+    if data.is_active is False:
+        # 停用账号：断开连接并停止监管
+        await client_manager.stop_client(account_id)
+    elif role_changed and client_manager.has_client(account_id):
+        # 切换角色：断开后按新角色重新连接（按需账号等下次定时任务再连接）
+        await client_manager.stop_client(account_id)
+        if acc.role == "forward" and acc.is_active and acc.is_logged_in:
+            await client_manager.start_client(acc)
     return {"message": "账号已更新"}
 
 
@@ -178,12 +257,8 @@ async def api_delete_account(account_id: int, db: Session = Depends(get_db)):
     if not acc:
         raise HTTPException(404, "账号不存在")
     await client_manager.stop_client(account_id)
-    session_file = f"data/sessions/{acc.session_name}.session"
-    if os.path.exists(session_file):
-        os.remove(session_file)
-    session_journal = session_file + "-journal"
-    if os.path.exists(session_journal):
-        os.remove(session_journal)
+    await client_manager.forget_account(account_id)
+    await remove_session(acc.session_name)
     db.delete(acc)
     db.commit()
     return {"message": "账号已删除"}
@@ -229,15 +304,15 @@ async def api_qr_start(account_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/api/accounts/{account_id}/qr-status")
-def api_qr_status(account_id: int):
+async def api_qr_status(account_id: int):
     """查询 QR 登录状态"""
-    return client_manager.check_qr_login(account_id)
+    return await client_manager.check_qr_login(account_id)
 
 
 @app.post("/api/accounts/{account_id}/qr-cancel")
-def api_qr_cancel(account_id: int):
+async def api_qr_cancel(account_id: int):
     """取消 QR 登录"""
-    client_manager.cancel_qr_login(account_id)
+    await client_manager.cancel_qr_login(account_id)
     return {"message": "已取消"}
 
 
@@ -259,7 +334,7 @@ async def api_connect_account(account_id: int, db: Session = Depends(get_db)):
     if not acc.is_logged_in:
         raise HTTPException(400, "账号未登录，请先登录后再连接")
     try:
-        if acc.id in client_manager.clients:
+        if client_manager.has_client(acc.id):
             await client_manager.stop_client(acc.id)
         ok = await client_manager.start_client(acc)
         if ok:
@@ -306,6 +381,103 @@ async def api_update_forward_config(data: ForwardConfigRequest, db: Session = De
     return {"message": "转发配置已更新"}
 
 
+# -- 转发规则 --
+
+@app.get("/api/forward-rules")
+def api_list_forward_rules(db: Session = Depends(get_db)):
+    rules = db.query(ForwardRule).order_by(ForwardRule.sort_order, ForwardRule.id).all()
+    return [forward_rule_to_dict(r) for r in rules]
+
+
+@app.post("/api/forward-rules")
+async def api_create_forward_rule(data: ForwardRuleCreate, db: Session = Depends(get_db)):
+    check_chat_types(data.chat_types)
+    r = ForwardRule(
+        name=data.name,
+        sender_filters=json.dumps(data.sender_filters, ensure_ascii=False),
+        chat_types=json.dumps(data.chat_types or ["private"]),
+        account_ids=json.dumps(data.account_ids),
+        target_chat_ids=json.dumps(data.target_chat_ids),
+        copy_mode=data.copy_mode,
+        is_enabled=data.is_enabled,
+        sort_order=data.sort_order,
+    )
+    db.add(r)
+    db.commit()
+    db.refresh(r)
+    await client_manager.refresh_forward_handlers()
+    return {"id": r.id, "message": "转发规则已创建"}
+
+
+@app.put("/api/forward-rules/{rule_id}")
+async def api_update_forward_rule(rule_id: int, data: ForwardRuleUpdate, db: Session = Depends(get_db)):
+    r = db.query(ForwardRule).get(rule_id)
+    if not r:
+        raise HTTPException(404, "转发规则不存在")
+    if data.chat_types is not None:
+        check_chat_types(data.chat_types)
+    for field in ["name", "copy_mode", "is_enabled", "sort_order"]:
+        val = getattr(data, field, None)
+        if val is not None:
+            setattr(r, field, val)
+    for field in ["sender_filters", "chat_types", "account_ids", "target_chat_ids"]:
+        val = getattr(data, field, None)
+        if val is not None:
+            setattr(r, field, json.dumps(val, ensure_ascii=False))
+    db.commit()
+    await client_manager.refresh_forward_handlers()
+    return {"message": "转发规则已更新"}
+
+
+@app.delete("/api/forward-rules/{rule_id}")
+async def api_delete_forward_rule(rule_id: int, db: Session = Depends(get_db)):
+    r = db.query(ForwardRule).get(rule_id)
+    if not r:
+        raise HTTPException(404, "转发规则不存在")
+    db.delete(r)
+    db.commit()
+    await client_manager.refresh_forward_handlers()
+    return {"message": "转发规则已删除"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 指标（文本格式）"""
+    families = metrics_registry.collect()
+    if isinstance(client_manager, ShardCoordinator):
+        families = merge_families([({}, families), *await client_manager.metric_groups()])
+    return PlainTextResponse(render_metrics(families), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/forward-latency")
+async def api_forward_latency():
+    """转发端到端延迟分位数（毫秒），按账号、按目标统计最近窗口内的转发"""
+    return await client_manager.latency_stats()
+
+
+@app.get("/api/loop-stats")
+async def api_loop_stats():
+    """事件循环调度延迟分位数及最近的阻塞调用栈"""
+    result = loop_monitor.stats()
+    if isinstance(client_manager, ShardCoordinator):
+        result["shards"] = await client_manager.loop_stats()
+    return result
+
+
+@app.get("/api/shards")
+async def api_shards():
+    """分片子进程状态（未启用分片时为空列表）"""
+    if isinstance(client_manager, ShardCoordinator):
+        return client_manager.shard_stats()
+    return []
+
+
+@app.get("/api/forward-stats")
+async def api_forward_stats():
+    """转发运行统计"""
+    return await client_manager.forward_stats()
+
+
 # -- 项目管理 --
 
 @app.get("/api/projects")
@@ -327,6 +499,7 @@ async def api_create_project(data: ProjectCreate, db: Session = Depends(get_db))
         jitter_max=data.jitter_max,
         account_delay_min=data.account_delay_min,
         account_delay_max=data.account_delay_max,
+        parallelism=data.parallelism,
     )
     db.add(p)
     db.commit()
@@ -342,7 +515,7 @@ async def api_update_project(project_id: int, data: ProjectUpdate, db: Session =
         raise HTTPException(404, "项目不存在")
     for field in ["name", "target_type", "target_bot", "message", "schedule_type", "schedule_rule",
                    "is_enabled", "jitter_min", "jitter_max", "account_delay_min", "account_delay_max",
-                   "sort_order"]:
+                   "parallelism", "sort_order"]:
         val = getattr(data, field, None)
         if val is not None:
             setattr(p, field, val)
@@ -409,8 +582,40 @@ def api_assign_accounts(project_id: int, data: ProjectAssignAccounts, db: Sessio
 @app.post("/api/projects/{project_id}/execute")
 async def api_execute_project_now(project_id: int):
     """立即手动执行一次项目任务"""
-    results = await scheduler_service.execute_now(project_id)
-    return {"results": results}
+    run = await scheduler_service.execute_now(project_id)
+    if run is None:
+        return {"results": [], "run": None}
+    return {"results": run.results, "run": run.to_dict()}
+
+
+@app.get("/api/scheduler/stats")
+async def api_scheduler_stats():
+    """调度统计：发送时间线与任务日志写入队列"""
+    return scheduler_service.stats()
+
+
+@app.get("/api/scheduler/timelines")
+async def api_list_timelines():
+    """进行中的发送时间线、定时器状态和最近结束的运行"""
+    return scheduler_service.timeline.stats()
+
+
+@app.get("/api/scheduler/timelines/{run_id}")
+async def api_get_timeline(run_id: int):
+    """某次运行尚未开始的发送计划"""
+    entries = scheduler_service.timeline.entries(run_id)
+    if entries is None:
+        raise HTTPException(404, "运行不存在或已结束")
+    return {"run": scheduler_service.timeline.runs[run_id].to_dict(), "entries": entries}
+
+
+@app.delete("/api/scheduler/timelines/{run_id}")
+async def api_cancel_timeline(run_id: int):
+    """取消一次运行（已开始的发送不受影响）"""
+    run = scheduler_service.timeline.cancel(run_id)
+    if run is None:
+        raise HTTPException(404, "运行不存在或已结束")
+    return {"message": "运行已取消", "run": run.to_dict()}
 
 
 # -- 子任务管理 --
@@ -650,6 +855,19 @@ tr:hover td { background: #f0f0ff; }
             <div class="stat-card gray"><div class="stat-value">{{dash.today_logs}}</div><div class="stat-label">今日执行</div></div>
             <div :class="['stat-card', dash.forward_enabled?'green':'red']"><div class="stat-value">{{dash.forward_enabled?'已开启':'未开启'}}</div><div class="stat-label">转发状态</div></div>
         </div>
+        <div class="card" v-if="latency.overall.total.count||latency.overall.local.count">
+            <div class="card-title">转发延迟（最近 {{latency.window}} 秒，毫秒）</div>
+            <table>
+                <thead><tr><th>账号</th><th>转发次数</th><th>端到端 P50 / P90 / P99</th><th>本地 P99</th><th>排队 P99</th><th>发送 P99</th></tr></thead>
+                <tbody>
+                    <tr v-for="row in latencyRows()" :key="row.key">
+                        <td>{{row.name}}</td><td>{{row.stats.local.count}}</td>
+                        <td>{{row.stats.total.p50??'-'}} / {{row.stats.total.p90??'-'}} / {{row.stats.total.p99??'-'}}</td>
+                        <td>{{row.stats.local.p99??'-'}}</td><td>{{row.stats.queue.p99??'-'}}</td><td>{{row.stats.send.p99??'-'}}</td>
+                    </tr>
+                </tbody>
+            </table>
+        </div>
         <div class="card" v-if="recentLogs.length">
             <div class="card-title">最近执行记录</div>
             <table>
@@ -677,7 +895,7 @@ tr:hover td { background: #f0f0ff; }
                 <thead><tr><th>备注</th><th>API ID</th><th>API Hash</th><th>状态</th><th>Telegram</th><th>分配任务</th><th>操作</th></tr></thead>
                 <tbody>
                     <tr v-for="a in accounts" :key="a.id">
-                        <td><strong>{{a.name}}</strong></td>
+                        <td><strong>{{a.name}}</strong> <span class="badge badge-info" v-if="a.role==='schedule'" title="仅定时任务，按需连接">按需</span></td>
                         <td><span class="mask">{{a.api_id}}</span></td>
                         <td><span class="mask">{{maskStr(a.api_hash)}}</span></td>
                         <td><span :class="['badge', a.is_connected?'badge-success':a.is_logged_in?'badge-warning':'badge-danger']">{{a.is_connected?'在线':a.is_logged_in?'离线':'未登录'}}</span></td>
@@ -713,6 +931,12 @@ tr:hover td { background: #f0f0ff; }
             <div class="form-group"><label>备注名称 *</label><input type="text" v-model="accountModal.form.name" placeholder="例如：甲-主签到"></div>
             <div class="form-group"><label>API ID *</label><input type="text" v-model="accountModal.form.api_id" placeholder="从 my.telegram.org 获取"></div>
             <div class="form-group"><label>API Hash *</label><input type="text" v-model="accountModal.form.api_hash" placeholder="从 my.telegram.org 获取"></div>
+            <div class="form-group"><label>连接方式</label>
+                <select v-model="accountModal.form.role">
+                    <option value="forward">常驻连接（消息转发 + 定时任务）</option>
+                    <option value="schedule">按需连接（仅定时任务，空闲后断开）</option>
+                </select>
+            </div>
             <div v-if="accountModal.step==='login'">
                 <div class="login-method-bar">
                     <div :class="['login-method-btn',accountModal.loginMethod==='code'?'active':'']" @click="accountModal.loginMethod='code'">📱 手机验证码</div>
@@ -776,6 +1000,59 @@ tr:hover td { background: #f0f0ff; }
                 <span class="help-text" v-if="fwdMsg">{{fwdMsg}}</span>
             </div>
         </div>
+        <div class="card">
+            <div class="flex-between" style="margin-bottom:15px">
+                <div class="card-title" style="margin-bottom:0;border-bottom:none;padding-bottom:0">转发规则</div>
+                <button class="btn btn-primary" @click="showRuleModal()">+ 添加规则</button>
+            </div>
+            <div class="info-box">
+                <strong>多规则说明：</strong>每条规则可按发件人、会话类型、接收账号过滤，并转发到一个或多个目标；与上方默认配置同时生效。
+            </div>
+            <table v-if="rules.length">
+                <thead><tr><th>名称</th><th>发件人</th><th>会话类型</th><th>接收账号</th><th>目标</th><th>状态</th><th>操作</th></tr></thead>
+                <tbody>
+                    <tr v-for="r in rules" :key="r.id">
+                        <td><strong>{{r.name||('#'+r.id)}}</strong></td>
+                        <td>{{r.sender_filters.length?r.sender_filters.join(', '):'全部'}}</td>
+                        <td>{{r.chat_types.map(function(t){return chatTypeLabels[t]||t}).join(', ')}}</td>
+                        <td>{{r.account_ids.length?r.account_ids.map(getAccountName).join(', '):'全部'}}</td>
+                        <td>{{r.target_chat_ids.join(', ')}} <span class="badge badge-info" v-if="r.copy_mode" title="以副本方式发送，不显示转发来源">副本</span></td>
+                        <td><span :class="['badge', r.is_enabled?'badge-success':'badge-danger']">{{r.is_enabled?'启用':'停用'}}</span></td>
+                        <td>
+                            <div class="flex-row">
+                                <button class="btn btn-outline btn-sm" @click="showRuleModal(r)">编辑</button>
+                                <button class="btn btn-danger btn-sm" @click="deleteRule(r.id)">删除</button>
+                            </div>
+                        </td>
+                    </tr>
+                </tbody>
+            </table>
+            <div class="empty" v-else>暂无规则</div>
+        </div>
+    </div>
+
+    <!-- 转发规则弹窗 -->
+    <div class="modal-overlay" v-if="ruleModal.show">
+        <div class="modal-content" style="max-width:600px;max-height:90vh;overflow-y:auto">
+            <div class="modal-title">{{ruleModal.editId?'编辑':'添加'}}转发规则</div>
+            <div class="error" v-if="ruleModal.error">{{ruleModal.error}}</div>
+            <div class="form-group"><label>规则名称</label><input type="text" v-model="ruleModal.form.name" placeholder="例如：签到机器人"></div>
+            <div class="form-group"><label>目标 Chat ID * <span class="help-text">每行一个</span></label><textarea v-model="ruleModal.form.targets" placeholder="-4688142035" rows="2" style="width:100%;padding:8px;border:1px solid #ddd;border-radius:5px;font-size:14px;resize:vertical"></textarea></div>
+            <div class="form-group"><label>发件人 <span class="help-text">每行一个 @username 或数字ID，留空表示全部</span></label><textarea v-model="ruleModal.form.senders" placeholder="@HaxBot&#10;123456789" rows="3" style="width:100%;padding:8px;border:1px solid #ddd;border-radius:5px;font-size:14px;resize:vertical"></textarea></div>
+            <div class="form-group"><label>会话类型</label>
+                <label v-for="(label,t) in chatTypeLabels" :key="t" style="display:inline-block;margin-right:12px"><input type="checkbox" :value="t" v-model="ruleModal.form.chat_types"> {{label}}</label>
+            </div>
+            <div class="section-title">👤 接收账号（不选表示全部）</div>
+            <div v-for="a in accounts" :key="a.id" style="margin:3px 0">
+                <label><input type="checkbox" :value="a.id" v-model="ruleModal.form.account_ids"> {{a.name}}</label>
+            </div>
+            <div class="form-group" style="margin-top:10px"><label><input type="checkbox" v-model="ruleModal.form.copy_mode" style="margin-right:6px">复制模式 <span class="help-text">以副本方式发送，不显示“转发自”</span></label></div>
+            <div class="form-group" style="margin-top:10px"><label><input type="checkbox" v-model="ruleModal.form.is_enabled" style="margin-right:6px">启用规则</label></div>
+            <div class="modal-actions">
+                <button class="btn btn-outline" @click="ruleModal.show=false">取消</button>
+                <button class="btn btn-primary" @click="saveRule()" :disabled="ruleModal.loading"><span v-if="ruleModal.loading" class="spinner"></span>保存</button>
+            </div>
+        </div>
     </div>
 
     <!-- ====== 签到任务（卡片视图） ====== -->
@@ -809,6 +1086,15 @@ tr:hover td { background: #f0f0ff; }
                     <span v-if="(p.jitter_min||p.jitter_max)&&(p.account_delay_min||p.account_delay_max)"> | </span>
                     <span v-if="p.account_delay_min||p.account_delay_max">账号间隔 {{p.account_delay_min}}s~{{p.account_delay_max}}s</span>
                 </div>
+                <div class="project-meta" v-if="p.parallelism>1||p.last_run">
+                    <span v-if="p.parallelism>1">⚡ 并发 {{p.parallelism}} 个账号</span>
+                    <span v-if="p.parallelism>1&&p.last_run"> | </span>
+                    <span v-if="p.last_run">上次运行 {{fmtSec(Math.round(p.last_run.duration))}}，成功 {{p.last_run.success}}/{{p.last_run.success+p.last_run.error}}</span>
+                </div>
+                <div class="project-meta" v-for="r in p.active_runs" :key="r.id">
+                    ▶ 运行中 #{{r.id}}：剩余 {{r.pending}}/{{r.total}}
+                    <button class="btn btn-outline btn-sm" @click="cancelRun(r.id)">取消</button>
+                </div>
                 <div style="margin-top:6px">
                     <span class="badge badge-info" v-if="p.account_ids.length">{{p.account_ids.length}} 个账号</span>
                 </div>
@@ -856,6 +1142,7 @@ tr:hover td { background: #f0f0ff; }
             <div class="flex-row" style="gap:8px">
                 <div class="form-group" style="flex:1"><label>账号间隔下限（秒）</label><input type="number" v-model="projectModal.form.account_delay_min" placeholder="0" min="0" max="43200"></div>
                 <div class="form-group" style="flex:1"><label>账号间隔上限（秒）</label><input type="number" v-model="projectModal.form.account_delay_max" placeholder="0" min="0" max="43200"></div>
+                <div class="form-group" style="flex:1"><label>并发账号数</label><input type="number" v-model="projectModal.form.parallelism" placeholder="1" min="1" max="100"></div>
             </div>
 
             <!-- 主目标（无子任务时使用） -->
@@ -947,12 +1234,16 @@ setup(){
     const tab=ref('dash')
     const dash=reactive({account_count:0,account_online:0,project_count:0,project_enabled:0,today_logs:0,forward_enabled:false})
     const recentLogs=ref([])
+    const latency=reactive({window:0,overall:{total:{count:0},local:{count:0},queue:{count:0},send:{count:0}},accounts:{},targets:{}})
     const accounts=ref([])
-    const accountModal=reactive({show:false,edit:false,step:'form',error:'',loading:false,form:{name:'',api_id:'',api_hash:''},loginPhone:'',loginCode:'',loginPwd:'',loginMethod:'code',qrStatus:'idle',qrImage:'',qrError:'',qrPollId:null})
+    const accountModal=reactive({show:false,edit:false,step:'form',error:'',loading:false,form:{name:'',api_id:'',api_hash:'',role:'forward'},loginPhone:'',loginCode:'',loginPwd:'',loginMethod:'code',qrStatus:'idle',qrImage:'',qrError:'',qrPollId:null})
     const fwd=reactive({target_chat_id:'',allowed_senders:'',is_enabled:false})
     const fwdLoading=ref(false),fwdMsg=ref('')
+    const rules=ref([])
+    const ruleModal=reactive({show:false,loading:false,error:'',editId:null,form:{name:'',targets:'',senders:'',chat_types:['private'],account_ids:[],copy_mode:false,is_enabled:true}})
+    const chatTypeLabels={private:'私聊',group:'群组',channel:'频道'}
     const projects=ref([])
-    const projectModal=reactive({show:false,edit:false,loading:false,error:'',form:{name:'',target_type:'bot',target_bot:'',message:'',schedule_type:'cron',schedule_rule:'',is_enabled:true,jitter_min:0,jitter_max:0,account_delay_min:0,account_delay_max:0},assignIds:[],editId:null,subtasks:[]})
+    const projectModal=reactive({show:false,edit:false,loading:false,error:'',form:{name:'',target_type:'bot',target_bot:'',message:'',schedule_type:'cron',schedule_rule:'',is_enabled:true,jitter_min:0,jitter_max:0,account_delay_min:0,account_delay_max:0,parallelism:1},assignIds:[],editId:null,subtasks:[]})
     const logs=reactive({items:[],total:0,page:1,size:20})
     const logFilter=reactive({status:'',project_id:''})
 
@@ -965,18 +1256,28 @@ setup(){
     }
 
     async function loadDash(){var r=await axios.get('/api/dashboard');Object.assign(dash,r.data)}
+    async function loadLatency(){var r=await axios.get('/api/forward-latency');Object.assign(latency,r.data)}
+    function latencyRows(){
+        var rows=[{key:'all',name:'全部',stats:latency.overall}]
+        Object.keys(latency.accounts).forEach(function(id){
+            var a=accounts.value.find(function(x){return String(x.id)===id})
+            rows.push({key:id,name:a?a.name:('#'+id),stats:latency.accounts[id]})
+        })
+        return rows
+    }
     async function loadRecentLogs(){var r=await axios.get('/api/logs?size=10');recentLogs.value=r.data.items}
     async function loadAccounts(){var r=await axios.get('/api/accounts');accounts.value=r.data}
     async function loadFwd(){var r=await axios.get('/api/forward-config');Object.assign(fwd,r.data);try{var arr=JSON.parse(fwd.allowed_senders);if(Array.isArray(arr)){fwd.allowed_senders=arr.join('\n')}}catch(e){}}
+    async function loadRules(){var r=await axios.get('/api/forward-rules');rules.value=r.data}
     async function loadProjects(){var r=await axios.get('/api/projects');projects.value=r.data}
     async function loadLogs(){var params={page:logs.page,size:logs.size};if(logFilter.status)params.status=logFilter.status;if(logFilter.project_id)params.project_id=logFilter.project_id;var r=await axios.get('/api/logs',{params:params});logs.items=r.data.items;logs.total=r.data.total}
     async function goPage(p){logs.page=p;await loadLogs()}
-    async function refreshAll(){await Promise.all([loadDash(),loadRecentLogs(),loadAccounts(),loadFwd(),loadProjects(),loadLogs()])}
+    async function refreshAll(){await Promise.all([loadDash(),loadLatency(),loadRecentLogs(),loadAccounts(),loadFwd(),loadRules(),loadProjects(),loadLogs()])}
     onMounted(refreshAll)
     watch(tab,function(t){
-        if(t==='dash'){loadDash();loadRecentLogs()}
+        if(t==='dash'){loadDash();loadLatency();loadRecentLogs()}
         if(t==='accounts')loadAccounts()
-        if(t==='forward')loadFwd()
+        if(t==='forward'){loadFwd();loadRules();loadAccounts()}
         if(t==='projects')loadProjects()
         if(t==='logs')loadLogs()
     })
@@ -989,8 +1290,8 @@ setup(){
     // 账号
     function showAccountModal(acc){
         accountModal.show=true;accountModal.step='form';accountModal.error='';accountModal.loginMethod='code';accountModal.qrStatus='idle';accountModal.qrImage='';accountModal.qrError='';if(accountModal.qrPollId){clearInterval(accountModal.qrPollId);accountModal.qrPollId=null}
-        if(acc){accountModal.edit=true;accountModal.form={name:acc.name,api_id:acc.api_id,api_hash:acc.api_hash};accountModal.editId=acc.id}
-        else{accountModal.edit=false;accountModal.form={name:'',api_id:'',api_hash:''};accountModal.editId=null}
+        if(acc){accountModal.edit=true;accountModal.form={name:acc.name,api_id:acc.api_id,api_hash:acc.api_hash,role:acc.role||'forward'};accountModal.editId=acc.id}
+        else{accountModal.edit=false;accountModal.form={name:'',api_id:'',api_hash:'',role:'forward'};accountModal.editId=null}
     }
     function closeAccountModal(){cancelQrLogin();accountModal.show=false}
     function _resetQrState(){accountModal.qrStatus='idle';accountModal.qrImage='';accountModal.qrError='';if(accountModal.qrPollId){clearInterval(accountModal.qrPollId);accountModal.qrPollId=null}}
@@ -1059,16 +1360,35 @@ setup(){
         catch(e){fwdMsg.value='错误: '+errMsg(e)};
         fwdLoading.value=false
     }
+    function splitLines(s){return s.split('\n').map(function(x){return x.trim()}).filter(function(x){return x.length>0})}
+    function showRuleModal(r){
+        ruleModal.show=true;ruleModal.error='';ruleModal.editId=r?r.id:null
+        ruleModal.form=r?{name:r.name,targets:r.target_chat_ids.join('\n'),senders:r.sender_filters.join('\n'),chat_types:[].concat(r.chat_types),account_ids:[].concat(r.account_ids),copy_mode:r.copy_mode,is_enabled:r.is_enabled}
+            :{name:'',targets:'',senders:'',chat_types:['private'],account_ids:[],copy_mode:false,is_enabled:true}
+    }
+    async function saveRule(){
+        ruleModal.loading=true;ruleModal.error=''
+        var f=ruleModal.form
+        var body={name:f.name,target_chat_ids:splitLines(f.targets),sender_filters:splitLines(f.senders),chat_types:f.chat_types,account_ids:f.account_ids,copy_mode:f.copy_mode,is_enabled:f.is_enabled}
+        try{
+            if(ruleModal.editId){await axios.put('/api/forward-rules/'+ruleModal.editId,body)}
+            else{await axios.post('/api/forward-rules',body)}
+            ruleModal.show=false;loadRules();loadDash()
+        }catch(e){ruleModal.error=errMsg(e)}
+        ruleModal.loading=false
+    }
+    async function cancelRun(id){if(!confirm('确认取消这次运行？尚未发送的消息将不再发送。'))return;try{await axios.delete('/api/scheduler/timelines/'+id)}catch(e){}loadProjects()}
+    async function deleteRule(id){if(!confirm('确认删除此规则？'))return;await axios.delete('/api/forward-rules/'+id);loadRules();loadDash()}
     // 项目
     function showProjectModal(p){
-        projectModal.show=true;projectModal.error='';projectModal.form={name:'',target_type:'bot',target_bot:'',message:'',schedule_type:'cron',schedule_rule:'',is_enabled:true,jitter_min:0,jitter_max:0,account_delay_min:0,account_delay_max:0};projectModal.assignIds=[];projectModal.subtasks=[]
+        projectModal.show=true;projectModal.error='';projectModal.form={name:'',target_type:'bot',target_bot:'',message:'',schedule_type:'cron',schedule_rule:'',is_enabled:true,jitter_min:0,jitter_max:0,account_delay_min:0,account_delay_max:0,parallelism:1};projectModal.assignIds=[];projectModal.subtasks=[]
         if(p){
             projectModal.edit=true;projectModal.editId=p.id
             var schedRule=p.schedule_rule
             // jitter 后端存秒，前端显示分钟
             var jmin=Math.round((p.jitter_min||0)/60*10)/10
             var jmax=Math.round((p.jitter_max||0)/60*10)/10
-            Object.assign(projectModal.form,{name:p.name,target_type:p.target_type||'bot',target_bot:p.target_bot,message:p.message,schedule_type:p.schedule_type,schedule_rule:schedRule,is_enabled:p.is_enabled,jitter_min:jmin,jitter_max:jmax,account_delay_min:p.account_delay_min||0,account_delay_max:p.account_delay_max||0})
+            Object.assign(projectModal.form,{name:p.name,target_type:p.target_type||'bot',target_bot:p.target_bot,message:p.message,schedule_type:p.schedule_type,schedule_rule:schedRule,is_enabled:p.is_enabled,jitter_min:jmin,jitter_max:jmax,account_delay_min:p.account_delay_min||0,account_delay_max:p.account_delay_max||0,parallelism:p.parallelism||1})
             projectModal.assignIds=[].concat(p.account_ids)
             // 加载子任务
             projectModal.subtasks=(p.subtasks||[]).map(function(s){return {_key:'s'+s.id,target_type:s.target_type,target_bot:s.target_bot,message:s.message,sort_order:s.sort_order,id:s.id}})
@@ -1085,6 +1405,7 @@ setup(){
             form.jitter_min=Math.round(parseFloat(form.jitter_min||0)*60) // 分钟转秒
             form.jitter_max=Math.round(parseFloat(form.jitter_max||0)*60)
             form.schedule_rule=String(form.schedule_rule)
+            form.parallelism=parseInt(form.parallelism)||1
 
             if(projectModal.edit){
                 await axios.put('/api/projects/'+projectModal.editId,form)
@@ -1121,10 +1442,10 @@ setup(){
     async function execProject(id){try{var r=await axios.post('/api/projects/'+id+'/execute');alert('执行结果: '+JSON.stringify(r.data.results,null,2));loadLogs();loadDash()}catch(e){alert('执行失败: '+errMsg(e))}}
     async function clearLogs(){if(!confirm('确认清空所有日志？'))return;await axios.delete('/api/logs');loadLogs();loadDash()}
 
-    return{tab,dash,recentLogs,accounts,accountModal,fwd,fwdLoading,fwdMsg,projects,projectModal,logs,logFilter,
+    return{tab,dash,recentLogs,latency,latencyRows,accounts,accountModal,fwd,fwdLoading,fwdMsg,rules,ruleModal,chatTypeLabels,projects,projectModal,logs,logFilter,
         maskStr,fmtTime,fmtSec,getAccountName,
         showAccountModal,closeAccountModal,saveAccount,sendCode,verifyCode,startQrLogin,cancelQrLogin,connectAccount,logoutAccount,deleteAccount,
-        saveForward,showProjectModal,closeProjectModal,saveProject,addSubtask,toggleAllAccounts,allAccountsSelected,toggleProject,moveProject,deleteProject,execProject,loadLogs,goPage,clearLogs}
+        saveForward,showRuleModal,saveRule,deleteRule,showProjectModal,closeProjectModal,saveProject,addSubtask,toggleAllAccounts,allAccountsSelected,toggleProject,moveProject,deleteProject,execProject,cancelRun,loadLogs,goPage,clearLogs}
 }
 }).mount('#app')
 </script>
@@ -1139,6 +1460,6 @@ if __name__ == "__main__":
     import uvicorn
     # 支持从 telegram_tool/ 或 telegram_tool/app/ 目录运行
     if os.path.basename(os.getcwd()) == "app":
-        uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
+        uvicorn.run("main:app", host=HOST, port=PORT, reload=True, loop=EVENT_LOOP)
     else:
-        uvicorn.run("app.main:app", host=HOST, port=PORT, reload=True)
+        uvicorn.run("app.main:app", host=HOST, port=PORT, reload=True, loop=EVENT_LOOP)
@@ -0,0 +1,158 @@
+"""复制模式转发
+
+规则开启复制模式后，发往其目标的消息不再使用 forward_messages（会带“转发自”标头），
+而是重新发送一份副本：
+- 纯文本（含网页预览）按原文本和格式实体发送；
+- 图片 / 文件按已有的 file reference 以 InputMediaPhoto / InputMediaDocument 发送，
+  不下载也不重新上传；相册合并为一次 SendMultiMedia；
+- 投票、位置、阅后即焚等无法复制的消息退回普通转发。
+
+MediaCache 按 (账号, 媒体 ID) 记录最近一次发送成功后拿到的 InputMedia：
+同一媒体发往多个目标时复用最新的 file reference，引用过期时只重新获取一次源消息。
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from telethon import errors, utils
+from telethon.tl import types
+
+logger = logging.getLogger(__name__)
+
+# 消息的复制方式
+TEXT = "text"
+MEDIA = "media"
+FORWARD = "forward"
+
+
+def copy_kind(message) -> str:
+    """判断消息能否以副本方式发送"""
+    media = message.media
+    if media is None or isinstance(media, types.MessageMediaWebPage):
+        return TEXT
+    if isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo) and not media.ttl_seconds:
+        return MEDIA
+    if isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document) \
+            and not media.ttl_seconds:
+        return MEDIA
+    return FORWARD
+
+
+def media_key(media) -> Optional[tuple[str, int]]:
+    if isinstance(media, types.MessageMediaPhoto) and media.photo:
+        return "photo", media.photo.id
+    if isinstance(media, types.MessageMediaDocument) and media.document:
+        return "document", media.document.id
+    return None
+
+
+def _groups(messages: list) -> list[list]:
+    """按相册（grouped_id）切分，相邻且同一相册的消息归为一组"""
+    groups: list[list] = []
+    for m in messages:
+        if groups and m.grouped_id and groups[-1][-1].grouped_id == m.grouped_id:
+            groups[-1].append(m)
+        else:
+            groups.append([m])
+    return groups
+
+
+class MediaCache:
+    """(账号, 媒体) -> 最近可用的 InputMedia（LRU）"""
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._items: OrderedDict[tuple, types.TypeInputMedia] = OrderedDict()
+        self.counters: dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def input_media(self, account_id: int, media) -> types.TypeInputMedia:
+        key = (account_id, media_key(media))
+        cached = self._items.get(key)
+        if cached is not None:
+            self._items.move_to_end(key)
+            self.counters["hits"] += 1
+            return cached
+        self.counters["misses"] += 1
+        return utils.get_input_media(media)
+
+    def remember(self, account_id: int, source_media, sent_media):
+        """发送成功后记录副本的媒体引用（file reference 最新）"""
+        key = (account_id, media_key(source_media))
+        if key[1] is None or sent_media is None:
+            return
+        self._items[key] = utils.get_input_media(sent_media)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, account_id: int, media):
+        if self._items.pop((account_id, media_key(media)), None) is not None:
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), **self.counters}
+
+
+class MessageCopier:
+    """以副本方式发送一批消息"""
+
+    def __init__(self, cache_size: int = 5000):
+        self.cache = MediaCache(cache_size)
+        self.counters: dict[str, int] = {"text": 0, "media": 0, "albums": 0, "forwarded": 0, "refreshed": 0}
+
+    async def copy(self, client, job, call: Callable[..., Awaitable]):
+        """发送 job 中的消息副本；call(fn, *args) 为经过限速器的调用"""
+        messages = job.messages
+        if isinstance(messages[0], int):
+            # 从发件箱重放的任务只有消息 ID，先取回消息
+            messages = [m for m in await client.get_messages(job.chat_id, ids=list(messages)) if m]
+        for group in _groups(messages):
+            kinds = {copy_kind(m) for m in group}
+            if FORWARD in kinds:
+                await call(client.forward_messages, job.target, group)
+                self.counters["forwarded"] += len(group)
+            elif kinds == {TEXT}:
+                for m in group:
+                    await call(
+                        client.send_message, job.target, m.message, formatting_entities=m.entities,
+                        link_preview=isinstance(m.media, types.MessageMediaWebPage),
+                    )
+                    self.counters["text"] += 1
+            else:
+                await self._send_media(client, job, group, call)
+
+    async def _send_media(self, client, job, group: list, call: Callable[..., Awaitable]):
+        aid = job.account_id
+        try:
+            sent = await self._send_group(client, job.target, aid, group, call)
+        except errors.FileReferenceExpiredError:
+            # 引用过期：丢弃缓存，重新获取源消息后再发一次
+            for m in group:
+                self.cache.invalidate(aid, m.media)
+            fresh = await client.get_messages(job.chat_id, ids=[m.id for m in group])
+            group = [m for m in fresh if m]
+            if not group:
+                raise
+            self.counters["refreshed"] += 1
+            sent = await self._send_group(client, job.target, aid, group, call)
+
+        sent = sent if isinstance(sent, list) else [sent]
+        for src, dst in zip(group, sent):
+            self.cache.remember(aid, src.media, getattr(dst, "media", None))
+        self.counters["media"] += len(group)
+
+    async def _send_group(self, client, target: int, account_id: int, group: list, call):
+        if len(group) == 1:
+            m = group[0]
+            media = self.cache.input_media(account_id, m.media)
+            return await call(
+                client.send_file, target, media, caption=m.message, formatting_entities=m.entities,
+            )
+        self.counters["albums"] += 1
+        files = [self.cache.input_media(account_id, m.media) for m in group]
+        # 相册的各条说明文字按客户端默认格式往返转换
+        return await call(client.send_file, target, files, caption=[m.text or "" for m in group])
+
+    def stats(self) -> dict:
+        return {**self.counters, "cache": self.cache.stats()}
@@ -0,0 +1,190 @@
+"""Prometheus 指标
+
+不依赖 prometheus_client 的轻量实现：计数器/直方图在热路径上只做字典累加，
+队列深度等状态量在抓取时由采集函数（collector）从各子系统读取，抓取开销与事件量无关。
+/metrics 以 Prometheus 文本格式（text exposition format 0.0.4）输出。
+
+分片模式下各子进程返回结构化的指标族，由 API 进程加上 shard 标签后合并输出。
+"""
+
+import bisect
+import math
+from typing import Callable, Iterable
+
+# 指标族：(名称, 类型, 说明, [(名称后缀, 标签字典, 值), ...])；可 JSON 序列化，便于跨进程传递
+Family = tuple[str, str, str, list]
+
+# 秒级延迟的默认分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 数据库查询耗时分桶
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+class Counter:
+    """带标签的单调计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self) -> Family:
+        samples = [
+            ("_total", dict(zip(self.labelnames, key)), value)
+            for key, value in self._values.items()
+        ]
+        return self.name, self.type, self.help, samples
+
+
+class Histogram:
+    """带标签的累积分桶直方图"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数..., +Inf 桶计数, 总和]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labelvalues):
+        row = self._values.get(labelvalues)
+        if row is None:
+            row = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def collect(self) -> Family:
+        samples = []
+        for key, row in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                samples.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            cumulative += row[len(self.buckets)]
+            samples.append(("_bucket", {**labels, "le": "+Inf"}, cumulative))
+            samples.append(("_sum", labels, row[-1]))
+            samples.append(("_count", labels, cumulative))
+        return self.name, self.type, self.help, samples
+
+
+class MetricsRegistry:
+    """指标注册表：静态指标 + 抓取时调用的采集函数"""
+
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def collect(self) -> list[Family]:
+        families = [m.collect() for m in self._metrics]
+        for collector in self._collectors:
+            families.extend(collector())
+        return families
+
+
+def gauge(name: str, help: str, samples: Iterable[tuple[dict, float]]) -> Family:
+    """由采集函数构造 gauge 指标族"""
+    return name, "gauge", help, [("", labels, value) for labels, value in samples]
+
+
+def counter_family(name: str, help: str, samples: Iterable[tuple[dict, float]]) -> Family:
+    """由采集函数构造 counter 指标族（值来自子系统自身的计数器）"""
+    return name, "counter", help, [("_total", labels, value) for labels, value in samples]
+
+
+def merge_families(groups: Iterable[tuple[dict, list[Family]]]) -> list[Family]:
+    """合并多个进程的指标族：同名指标合并样本，并为每组样本加上额外标签"""
+    merged: dict[str, Family] = {}
+    for extra, families in groups:
+        for name, mtype, help, samples in families:
+            if name not in merged:
+                merged[name] = (name, mtype, help, [])
+            merged[name][3].extend(
+                (suffix, {**labels, **extra}, value) for suffix, labels, value in samples
+            )
+    return list(merged.values())
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families: Iterable[Family]) -> str:
+    """输出 Prometheus 文本格式"""
+    lines = []
+    for name, mtype, help, samples in families:
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {mtype}")
+        for suffix, labels, value in samples:
+            if labels:
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{suffix}{{{label_str}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name}{suffix} {_format_value(value)}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+# ==================== 全局指标 ====================
+
+registry = MetricsRegistry()
+
+forward_received = registry.counter(
+    "tgf_forward_received", "Incoming messages that passed the event pre-filter", ("account",))
+forward_filtered = registry.counter(
+    "tgf_forward_filtered", "Incoming messages dropped before forwarding", ("account", "stage"))
+forward_sent = registry.counter(
+    "tgf_forward_sent_messages", "Messages forwarded successfully", ("account",))
+forward_failed = registry.counter(
+    "tgf_forward_failed_jobs", "Forward jobs that failed", ("account",))
+forward_latency = registry.histogram(
+    "tgf_forward_latency_seconds", "Time from forward job creation to completion", ("account",))
+scheduler_fire_lag = registry.histogram(
+    "tgf_scheduler_fire_lag_seconds", "Delay between scheduled and actual job start", ("project",))
+scheduler_run_duration = registry.histogram(
+    "tgf_scheduler_run_duration_seconds", "Project run duration from the first send to the last, excluding task jitter", ("project",),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+scheduler_prewarm = registry.counter(
+    "tgf_scheduler_prewarm_accounts", "Accounts pre-connected ahead of scheduled runs", ("result",))
+scheduler_catchup = registry.counter(
+    "tgf_scheduler_catchup_fires", "Fires missed while the service was down", ("result",))
+telethon_reconnects = registry.counter(
+    "tgf_telethon_reconnects", "Supervised reconnect attempts", ("account", "result"))
+db_query_duration = registry.histogram(
+    "tgf_db_query_seconds", "Database statement execution time", ("operation",), buckets=DB_BUCKETS)
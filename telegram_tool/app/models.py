@@ -2,8 +2,8 @@
 
 from datetime import datetime, timezone
 from sqlalchemy import (
-    Column, Integer, String, Text, Boolean, DateTime,
-    ForeignKey, Table
+    Column, Integer, String, Text, Boolean, DateTime, LargeBinary,
+    ForeignKey, Table, UniqueConstraint
 )
 from sqlalchemy.orm import relationship
 try:
@@ -35,6 +35,7 @@ class Account(Base):
     first_name = Column(String(100), nullable=True, default="")
     is_logged_in = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
+    role = Column(String(20), nullable=False, default="forward", comment="forward 常驻连接 / schedule 仅定时任务按需连接")
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
@@ -53,6 +54,96 @@ class ForwardConfig(Base):
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
 
+class ForwardRule(Base):
+    """转发规则（可多条，每条含来源过滤和一个或多个目标）"""
+    __tablename__ = "forward_rules"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False, default="", comment="规则名称")
+    sender_filters = Column(Text, nullable=False, default="[]", comment="JSON 数组，发件人 ID 或 @用户名，空=全部")
+    chat_types = Column(Text, nullable=False, default='["private"]', comment="JSON 数组，private / group / channel")
+    account_ids = Column(Text, nullable=False, default="[]", comment="JSON 数组，接收消息的账号ID，空=全部")
+    target_chat_ids = Column(Text, nullable=False, default="[]", comment="JSON 数组，转发目标 Chat ID")
+    copy_mode = Column(Boolean, nullable=False, default=False, comment="以副本方式发送，不显示转发来源")
+    is_enabled = Column(Boolean, default=True)
+    sort_order = Column(Integer, default=0, comment="排序值，越小越靠前")
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+class ForwardOutbox(Base):
+    """转发发件箱：记录待转发任务，进程崩溃或断线后可重放"""
+    __tablename__ = "forward_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_key = Column(String(32), nullable=False, unique=True, comment="任务唯一键")
+    account_id = Column(Integer, nullable=False, index=True)
+    source_chat_id = Column(String(50), nullable=False, comment="来源会话 ID")
+    target_chat_id = Column(String(50), nullable=False, comment="目标 Chat ID")
+    message_ids = Column(Text, nullable=False, default="[]", comment="JSON 数组，消息 ID")
+    status = Column(String(20), nullable=False, default="pending", index=True, comment="pending / done / failed / expired")
+    detail = Column(Text, nullable=True, default="")
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+class EntityCache(Base):
+    """已解析的目标实体缓存（每个账号独立，避免重复 ResolveUsername）"""
+    __tablename__ = "entity_cache"
+    __table_args__ = (UniqueConstraint("account_id", "target", name="uq_entity_cache_account_target"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, nullable=False, index=True)
+    target = Column(String(200), nullable=False, comment="规范化后的 @username 或 Chat ID")
+    peer_type = Column(String(20), nullable=False, comment="user / chat / channel / self")
+    peer_id = Column(String(50), nullable=False, default="")
+    access_hash = Column(String(50), nullable=False, default="")
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+class TelegramSession(Base):
+    """Telethon 会话：数据中心与授权密钥（SESSION_BACKEND=database 时使用）"""
+    __tablename__ = "telegram_sessions"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_name = Column(String(100), nullable=False, unique=True)
+    dc_id = Column(Integer, nullable=False, default=0)
+    server_address = Column(String(100), nullable=True)
+    port = Column(Integer, nullable=True)
+    auth_key = Column(LargeBinary, nullable=True)
+    takeout_id = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+class TelegramEntity(Base):
+    """Telethon 会话的实体缓存（对应 .session 文件中的 entities 表）"""
+    __tablename__ = "telegram_entities"
+    __table_args__ = (UniqueConstraint("session_name", "entity_id", name="uq_telegram_entities_session_entity"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_name = Column(String(100), nullable=False, index=True)
+    entity_id = Column(Integer, nullable=False, comment="带类型标记的 peer ID")
+    hash = Column(Integer, nullable=False, default=0)
+    username = Column(String(100), nullable=True)
+    phone = Column(String(50), nullable=True)
+    name = Column(String(200), nullable=True)
+    date = Column(Integer, nullable=False, default=0)
+
+
+class TelegramUpdateState(Base):
+    """Telethon 会话的更新状态（pts / qts / seq），用于重连后补齐更新"""
+    __tablename__ = "telegram_update_states"
+    __table_args__ = (UniqueConstraint("session_name", "entity_id", name="uq_telegram_update_states_session_entity"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_name = Column(String(100), nullable=False, index=True)
+    entity_id = Column(Integer, nullable=False, comment="0 表示账号全局状态，其余为频道 ID")
+    pts = Column(Integer, nullable=False, default=0)
+    qts = Column(Integer, nullable=False, default=0)
+    date = Column(Integer, nullable=False, default=0)
+    seq = Column(Integer, nullable=False, default=0)
+
+
 class Project(Base):
     """签到/定时任务项目"""
     __tablename__ = "projects"
@@ -71,6 +162,7 @@ class Project(Base):
     jitter_max = Column(Integer, default=0, comment="任务级随机延迟上限（秒）")
     account_delay_min = Column(Integer, default=0, comment="账号间随机间隔下限（秒），0=不延迟")
     account_delay_max = Column(Integer, default=0, comment="账号间随机间隔上限（秒）")
+    parallelism = Column(Integer, default=1, comment="同时执行的账号数")
 
     # 排序
     sort_order = Column(Integer, default=0, comment="排序值，越小越靠前")
@@ -0,0 +1,237 @@
+"""转发发件箱
+
+转发任务在入队前写入 forward_outbox 表，转发完成后标记为 done。
+写入采用组提交：记录先进入内存缓冲，由后台协程每隔 flush_interval 或攒够 batch_size 条后
+在线程中用一次 executemany 写入，调用方只等待所在批次落盘，热路径上没有逐条同步 commit。
+启动时未完成（pending）的记录会被重放。
+写入失败时整批保留到下一次提交重试，连续失败 MAX_FLUSH_ATTEMPTS 次后放弃该批，
+等待中的 record() 收到 OutboxWriteError，由调用方决定是否继续转发。
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, delete, select, update
+
+try:
+    from .database import engine
+    from .models import ForwardOutbox as OutboxModel
+except ImportError:
+    from database import engine
+    from models import ForwardOutbox as OutboxModel
+
+logger = logging.getLogger(__name__)
+
+_table = OutboxModel.__table__
+
+# 同一批记录最多尝试写入的次数
+MAX_FLUSH_ATTEMPTS = 3
+
+
+class OutboxWriteError(Exception):
+    """发件箱记录多次写入失败，未能持久化"""
+
+
+class ForwardOutbox:
+    """组提交的持久化发件箱"""
+
+    # 已结束（done / failed / expired）记录的保留时间
+    DONE_RETENTION = timedelta(days=1)
+
+    def __init__(self, enabled: bool = True, flush_interval: float = 0.05, batch_size: int = 200):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._inserts: list[dict] = []
+        self._updates: list[dict] = []
+        self._waiters: list[asyncio.Future] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._attempts = 0
+        self.counters: dict[str, int] = {
+            "recorded": 0, "completed": 0, "failed": 0, "flushes": 0, "replayed": 0,
+            "flush_errors": 0, "dropped": 0,
+        }
+
+    # ==================== 写入 ====================
+
+    async def record(self, job) -> Optional[str]:
+        """登记一个待转发任务，等待所在批次提交后返回记录键；多次写入失败时抛出 OutboxWriteError"""
+        if not self.enabled:
+            return None
+        key = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        self._inserts.append({
+            "job_key": key,
+            "account_id": job.account_id,
+            "source_chat_id": str(job.chat_id),
+            "target_chat_id": str(job.target),
+            "message_ids": json.dumps(job.message_ids),
+            "status": "pending",
+            "detail": "",
+            "created_at": now,
+            "updated_at": now,
+        })
+        self.counters["recorded"] += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self._ensure_task()
+        if len(self._inserts) >= self.batch_size:
+            self._wakeup.set()
+        await fut
+        return key
+
+    def mark_done(self, key: Optional[str]):
+        self._mark(key, "done", "")
+        if key:
+            self.counters["completed"] += 1
+
+    def mark_failed(self, key: Optional[str], detail: str):
+        self._mark(key, "failed", detail)
+        if key:
+            self.counters["failed"] += 1
+
+    def _mark(self, key: Optional[str], status: str, detail: str):
+        """状态更新不需要等待落盘，随下一批次写入"""
+        if not self.enabled or not key:
+            return
+        self._updates.append({
+            "k": key, "s": status, "d": detail[:500], "t": datetime.now(timezone.utc),
+        })
+        self._ensure_task()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """将缓冲区写入数据库（一个事务）并唤醒等待者；写入失败且还可重试时返回 False"""
+        if not self._inserts and not self._updates:
+            return True
+        inserts, self._inserts = self._inserts, []
+        updates, self._updates = self._updates, []
+        waiters, self._waiters = self._waiters, []
+        try:
+            await asyncio.to_thread(self._write, inserts, updates)
+        except Exception as e:
+            self._attempts += 1
+            self.counters["flush_errors"] += 1
+            if self._attempts < MAX_FLUSH_ATTEMPTS:
+                # 整批放回缓冲区头部，下一次提交重试，等待者继续等待
+                logger.warning(
+                    f"Outbox flush failed ({len(inserts)} inserts, {len(updates)} updates), "
+                    f"retrying (attempt {self._attempts}/{MAX_FLUSH_ATTEMPTS}): {e}"
+                )
+                self._inserts[:0] = inserts
+                self._updates[:0] = updates
+                self._waiters[:0] = waiters
+                return False
+            self._attempts = 0
+            self.counters["dropped"] += len(inserts) + len(updates)
+            logger.error(
+                f"Outbox flush failed {MAX_FLUSH_ATTEMPTS} times, dropping "
+                f"{len(inserts)} inserts and {len(updates)} updates: {e}"
+            )
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_exception(OutboxWriteError(str(e)))
+            return True
+        self._attempts = 0
+        self.counters["flushes"] += 1
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+        return True
+
+    @staticmethod
+    def _write(inserts: list[dict], updates: list[dict]):
+        with engine.begin() as conn:
+            if inserts:
+                conn.execute(_table.insert(), inserts)
+            if updates:
+                conn.execute(
+                    update(_table)
+                    .where(_table.c.job_key == bindparam("k"))
+                    .values(status=bindparam("s"), detail=bindparam("d"), updated_at=bindparam("t")),
+                    updates,
+                )
+
+    async def stop(self):
+        """停止后台写入并落盘剩余记录"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 写入失败时按重试次数继续提交，直到成功或放弃
+        while not await self.flush():
+            await asyncio.sleep(self.flush_interval)
+
+    # ==================== 重放 ====================
+
+    async def load_pending(self, max_age: float) -> list[dict]:
+        """读取待重放的记录；超龄的标记为 expired，与已完成记录重复的直接标记 done"""
+        if not self.enabled:
+            return []
+        rows, duplicates = await asyncio.to_thread(self._load_pending, max_age)
+        for key in duplicates:
+            self._mark(key, "done", "duplicate")
+        return rows
+
+    def _load_pending(self, max_age: float) -> tuple[list[dict], list[str]]:
+        now = datetime.now(timezone.utc)
+        with engine.begin() as conn:
+            conn.execute(
+                delete(_table).where(
+                    _table.c.status.in_(("done", "failed", "expired")),
+                    _table.c.updated_at < now - self.DONE_RETENTION,
+                )
+            )
+            conn.execute(
+                update(_table)
+                .where(_table.c.status == "pending", _table.c.created_at < now - timedelta(seconds=max_age))
+                .values(status="expired", updated_at=now)
+            )
+            rows = conn.execute(
+                select(_table).where(_table.c.status == "pending").order_by(_table.c.id)
+            ).mappings().all()
+            done = set(conn.execute(
+                select(
+                    _table.c.account_id, _table.c.source_chat_id,
+                    _table.c.target_chat_id, _table.c.message_ids,
+                ).where(_table.c.status == "done")
+            ).tuples())
+
+        result, duplicates = [], []
+        seen = set()
+        for r in rows:
+            ident = (r["account_id"], r["source_chat_id"], r["target_chat_id"], r["message_ids"])
+            if ident in done or ident in seen:
+                duplicates.append(r["job_key"])
+                continue
+            seen.add(ident)
+            result.append(dict(r))
+        return result, duplicates
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered_inserts": len(self._inserts),
+            "buffered_updates": len(self._updates),
+            **self.counters,
+        }
@@ -0,0 +1,104 @@
+"""项目快照
+
+调度相关的代码（触发、预热、启动重连排序）只需要读取项目配置，
+却曾在整次运行期间持有 ORM 对象和数据库会话。
+这里在一个短会话内把项目及其账号、子任务一次性读成不可变的快照，会话随即关闭；
+快照之后在时间线、预热和日志记录之间传递，不再触发延迟加载，也不占用 SQLite 连接。
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import selectinload
+
+try:
+    from .database import SessionLocal
+    from .models import Project
+except ImportError:
+    from database import SessionLocal
+    from models import Project
+
+
+@dataclass(frozen=True, slots=True)
+class AccountRef:
+    """项目关联的账号"""
+    id: int
+    name: str
+    is_active: bool
+    is_logged_in: bool
+
+
+@dataclass(frozen=True, slots=True)
+class SendTarget:
+    """一个发送目标（子任务或项目主目标）"""
+    bot: str
+    message: str
+    type: str = "bot"
+
+
+@dataclass(frozen=True, slots=True)
+class ProjectSnapshot:
+    """项目调度配置的只读副本"""
+    id: int
+    name: str
+    is_enabled: bool
+    schedule_type: str
+    schedule_rule: str
+    accounts: tuple[AccountRef, ...]
+    targets: tuple[SendTarget, ...]
+    parallelism: int = 1
+    jitter_min: int = 0
+    jitter_max: int = 0
+    account_delay_min: int = 0
+    account_delay_max: int = 0
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_model(cls, project: Project) -> "ProjectSnapshot":
+        # 发信目标：优先用子任务，否则用项目主目标
+        if project.subtasks:
+            subtasks = sorted(project.subtasks, key=lambda s: s.sort_order)
+            targets = tuple(SendTarget(s.target_bot, s.message, s.target_type) for s in subtasks)
+        else:
+            targets = (SendTarget(project.target_bot, project.message, project.target_type),)
+        return cls(
+            id=project.id,
+            name=project.name,
+            is_enabled=bool(project.is_enabled),
+            schedule_type=project.schedule_type,
+            schedule_rule=project.schedule_rule,
+            accounts=tuple(
+                AccountRef(a.id, a.name, bool(a.is_active), bool(a.is_logged_in)) for a in project.accounts
+            ),
+            targets=targets,
+            parallelism=max(1, project.parallelism or 1),
+            jitter_min=project.jitter_min or 0,
+            jitter_max=project.jitter_max or 0,
+            account_delay_min=project.account_delay_min or 0,
+            account_delay_max=project.account_delay_max or 0,
+            updated_at=project.updated_at,
+        )
+
+    @property
+    def active_accounts(self) -> tuple[AccountRef, ...]:
+        return tuple(a for a in self.accounts if a.is_active)
+
+
+def load_snapshots(project_ids: Optional[Iterable[int]] = None, enabled_only: bool = True) -> list[ProjectSnapshot]:
+    """在一个短会话内读取项目快照（账号和子任务一并预加载）"""
+    db = SessionLocal()
+    try:
+        query = db.query(Project).options(selectinload(Project.accounts), selectinload(Project.subtasks))
+        if project_ids is not None:
+            query = query.filter(Project.id.in_(list(project_ids)))
+        if enabled_only:
+            query = query.filter(Project.is_enabled == True)
+        return [ProjectSnapshot.from_model(p) for p in query.all()]
+    finally:
+        db.close()
+
+
+def load_snapshot(project_id: int) -> Optional[ProjectSnapshot]:
+    snapshots = load_snapshots([project_id], enabled_only=False)
+    return snapshots[0] if snapshots else None
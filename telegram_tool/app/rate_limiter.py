@@ -0,0 +1,150 @@
+"""发送限速器
+
+按账号和按 (账号, 目标会话) 两级令牌桶控制所有出站发送，
+收到 FloodWait / SlowModeWait 时暂停对应的桶，并在等待结束后自动重试。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为突发上限"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距离可取得一个令牌还需等待的秒数"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """暂停到 now + seconds，并清空令牌避免恢复瞬间突发"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return now >= self.paused_until and self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """账号级 + 会话级两级令牌桶限速"""
+
+    # 会话桶数量超过该值时清理已回满的空闲桶
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, account_rate: float, account_burst: float,
+                 chat_rate: float, chat_burst: float, max_retries: int = 3):
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._accounts: dict[int, TokenBucket] = {}
+        self._chats: dict[tuple[int, Hashable], TokenBucket] = {}
+        self.counters: dict[str, int] = {"acquired": 0, "throttled": 0, "flood_waits": 0, "retries": 0}
+
+    def _account_bucket(self, account_id: int) -> TokenBucket:
+        bucket = self._accounts.get(account_id)
+        if bucket is None:
+            bucket = self._accounts[account_id] = TokenBucket(self.account_rate, self.account_burst)
+        return bucket
+
+    def _chat_bucket(self, account_id: int, chat: Hashable) -> TokenBucket:
+        key = (account_id, chat)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._prune()
+            bucket = self._chats[key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, b in self._chats.items() if b.is_idle(now)]:
+            del self._chats[key]
+
+    async def acquire(self, account_id: int, chat: Hashable):
+        """等待直到账号桶和会话桶都有令牌，然后同时扣除"""
+        acc = self._account_bucket(account_id)
+        cht = self._chat_bucket(account_id, chat)
+        throttled = False
+        while True:
+            now = time.monotonic()
+            wait = max(acc.wait_time(now), cht.wait_time(now))
+            if wait <= 0:
+                acc.take()
+                cht.take()
+                self.counters["acquired"] += 1
+                return
+            if not throttled:
+                throttled = True
+                self.counters["throttled"] += 1
+            await asyncio.sleep(wait)
+
+    def on_flood(self, account_id: int, chat: Hashable, error: Exception):
+        """根据 Telegram 返回的等待时间暂停对应的桶"""
+        seconds = getattr(error, "seconds", 0) or 0
+        self.counters["flood_waits"] += 1
+        if isinstance(error, SlowModeWaitError):
+            # 慢速模式只限制该会话
+            self._chat_bucket(account_id, chat).pause(seconds)
+        else:
+            self._account_bucket(account_id).pause(seconds)
+        logger.warning(f"Flood wait {seconds}s for account #{account_id} (chat {chat})")
+
+    async def call(self, account_id: int, chat: Hashable,
+                   func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """限速执行一次发送；遇到 FloodWait 暂停后重新排队重试，超过重试次数才抛出"""
+        attempt = 0
+        while True:
+            await self.acquire(account_id, chat)
+            try:
+                return await func(*args, **kwargs)
+            except (FloodWaitError, SlowModeWaitError) as e:
+                self.on_flood(account_id, chat, e)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.counters["retries"] += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        paused = {
+            str(aid): round(b.paused_until - now, 1)
+            for aid, b in self._accounts.items() if b.paused_until > now
+        }
+        return {
+            "account_buckets": len(self._accounts),
+            "chat_buckets": len(self._chats),
+            "paused_accounts": paused,
+            **self.counters,
+        }
@@ -1,24 +1,61 @@
 """定时任务调度服务
 
 基于 APScheduler，管理签到 / 定时发送任务的调度与执行。
+预热协程按 APScheduler 的下次触发时间向前看 SCHEDULER_PREWARM_LEAD 秒，
+提前连接项目用到的账号并解析发送目标，任务触发时直接在已连接的客户端上发送。
+
+项目触发时只计算一次整次运行的发送时间线（见 send_timeline），由全局定时器按时发送，
+同时进行的发送数不超过项目的 parallelism。账号间的随机间隔
+不再串行累加，而是预先为每个账号生成随机的开始时刻：相邻开始时刻的间隔服从
+[账号间隔下限, 上限] / parallelism 的均匀分布，整体发送速率与串行时按配置间隔发送
+的单个账号队列一致，但一次运行的总耗时约缩短为原来的 1 / parallelism。
+
+项目配置在触发、预热时通过 project_snapshot 在短会话内读成不可变快照，会话立即释放；
+运行期间只传递快照，发送日志交给 task_log_writer 组提交，多个项目同时运行不会长时间占用 SQLite。
+
+SCHEDULER_JOBSTORE=database 时任务存入主数据库的 scheduler_jobs 表，记录项目的 updated_at 作为版本。
+启动时只比对项目 ID 与 updated_at，仅重新添加有变化的项目；停机期间错过的触发按
+SCHEDULER_CATCHUP 策略补跑，同时进行的补跑不超过 SCHEDULER_CATCHUP_CONCURRENCY 个。
 """
 
 import asyncio
 import logging
 import random
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
+from apscheduler.events import EVENT_JOB_SUBMITTED
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from sqlalchemy.orm import Session
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import column, select, table
 
 try:
-    from .database import SessionLocal
-    from .models import Project, Account, TaskLog
+    from .database import SessionLocal, engine
+    from .models import Project, Account
     from .client_manager import client_manager
+    from .metrics import scheduler_fire_lag, scheduler_run_duration, scheduler_prewarm, scheduler_catchup
+    from .config import (
+        SCHEDULER_PREWARM_LEAD, RECONNECT_CONCURRENCY, SCHEDULER_JOBSTORE,
+        SCHEDULER_CATCHUP, SCHEDULER_CATCHUP_WINDOW, SCHEDULER_CATCHUP_CONCURRENCY,
+    )
+    from .send_timeline import SendTimeline, TimelineRun
+    from .project_snapshot import AccountRef, ProjectSnapshot, SendTarget, load_snapshot, load_snapshots
+    from .task_log_writer import task_log_writer
 except ImportError:
-    from database import SessionLocal
-    from models import Project, Account, TaskLog
+    from database import SessionLocal, engine
+    from models import Project, Account
     from client_manager import client_manager
+    from metrics import scheduler_fire_lag, scheduler_run_duration, scheduler_prewarm, scheduler_catchup
+    from config import (
+        SCHEDULER_PREWARM_LEAD, RECONNECT_CONCURRENCY, SCHEDULER_JOBSTORE,
+        SCHEDULER_CATCHUP, SCHEDULER_CATCHUP_WINDOW, SCHEDULER_CATCHUP_CONCURRENCY,
+    )
+    from send_timeline import SendTimeline, TimelineRun
+    from project_snapshot import AccountRef, ProjectSnapshot, SendTarget, load_snapshot, load_snapshots
+    from task_log_writer import task_log_writer
 
 logger = logging.getLogger(__name__)
 
@@ -31,66 +68,146 @@ DEFAULT_DELAY_MAX = 60
 # 子任务间间隔（秒）
 SUBTASK_DELAY = 3
 
+SCHEDULER_TIMEZONE = "Asia/Shanghai"
+
+# 持久化任务表名及预热扫描用到的列（表由 SQLAlchemyJobStore 创建）
+JOB_TABLE = "scheduler_jobs"
+_job_table = table(JOB_TABLE, column("id"), column("next_run_time"))
+# 计算错过的触发次数时最多回溯的次数
+MAX_MISSED_FIRES = 1000
+
+
+def build_trigger(schedule_type: str, schedule_rule: str):
+    """根据项目调度配置构建 APScheduler 触发器，规则无效时返回 None"""
+    try:
+        if schedule_type == "cron":
+            parts = schedule_rule.strip().split()
+            if len(parts) != 5:
+                return None
+            return CronTrigger(
+                minute=parts[0],
+                hour=parts[1],
+                day=parts[2],
+                month=parts[3],
+                day_of_week=parts[4],
+                timezone=SCHEDULER_TIMEZONE,
+            )
+        if schedule_type == "interval":
+            return IntervalTrigger(seconds=int(schedule_rule), timezone=SCHEDULER_TIMEZONE)
+    except ValueError:
+        return None
+    return None
+
+
+def start_offsets(count: int, delay_min: float, delay_max: float, parallelism: int) -> list[float]:
+    """为 count 个账号生成随机开始时刻（秒），第一个账号立即开始
+
+    相邻间隔取 U(delay_min, delay_max) / parallelism，平均每 (delay_min + delay_max) / 2 秒
+    每个并发槽位开始一个账号，与串行时的节奏相同。
+    """
+    offsets = [0.0]
+    for _ in range(count - 1):
+        offsets.append(offsets[-1] + random.uniform(delay_min, delay_max) / parallelism)
+    return offsets[:count]
+
+
+def job_version(project) -> str:
+    """任务版本：项目的 updated_at，变化时才需要重新添加任务"""
+    return project.updated_at.isoformat() if project.updated_at else ""
+
+
+def missed_fire_times(trigger, next_run_time: datetime, now: datetime) -> list[datetime]:
+    """从任务保存的下次触发时间到现在之间错过的所有触发时刻"""
+    times: list[datetime] = []
+    t = next_run_time
+    while t is not None and t <= now and len(times) < MAX_MISSED_FIRES:
+        times.append(t)
+        t = trigger.get_next_fire_time(t, now)
+    return times
+
+
+async def run_project(project_id: int, version: str = ""):
+    """APScheduler 任务入口
+
+    持久化任务按“模块:函数”的文本引用保存，不能直接引用单例的绑定方法。
+    version 只用于启动时比对，执行时不使用。
+    """
+    await scheduler_service._execute_project(project_id)
+
 
 class SchedulerService:
     """定时任务调度服务（单例）"""
 
     def __init__(self):
-        self.scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
+        self._jobstore: Optional[SQLAlchemyJobStore] = None
+        jobstores = {}
+        if SCHEDULER_JOBSTORE == "database":
+            self._jobstore = SQLAlchemyJobStore(engine=engine, tablename=JOB_TABLE)
+            jobstores["default"] = self._jobstore
+        self.scheduler = AsyncIOScheduler(timezone=SCHEDULER_TIMEZONE, jobstores=jobstores)
+        self.scheduler.add_listener(self._on_job_event, EVENT_JOB_SUBMITTED)
+        # 项目触发后的发送时间线（全局最小堆定时器）
+        self.timeline = SendTimeline(self._send_entry, self._on_run_finished)
+        # job_id -> 已预热的触发时间，同一次触发只预热一次
+        self._prewarmed: dict[str, datetime] = {}
+        # project_id -> 最近一次运行的耗时与结果统计
+        self.last_runs: dict[int, dict] = {}
+        self._prewarm_task: Optional[asyncio.Task] = None
+        self._catchup_task: Optional[asyncio.Task] = None
+        self.catchup_stats: dict[str, int] = {"missed": 0, "queued": 0, "skipped": 0, "finished": 0}
+        # 因上一次运行未结束而跳过的触发数
+        self.overlap_skipped = 0
 
     async def start(self):
-        """启动调度器并加载所有启用的项目"""
-        self.scheduler.start()
-        await self._load_projects()
+        """启动调度器，与项目表增量同步任务，并补跑停机期间错过的触发"""
+        # 暂停状态下同步，避免调度器在处理错过的触发前自行执行
+        self.scheduler.start(paused=True)
+        catchup = self._sync_jobs()
+        self.scheduler.resume()
+        if catchup:
+            self._catchup_task = asyncio.create_task(self._run_catchup(catchup))
+        if SCHEDULER_PREWARM_LEAD > 0:
+            self._prewarm_task = asyncio.create_task(self._prewarm_loop())
         logger.info("Scheduler started")
 
     async def stop(self):
         """停止调度器"""
+        for task in (self._prewarm_task, self._catchup_task):
+            if task:
+                task.cancel()
+        self._prewarm_task = self._catchup_task = None
         self.scheduler.shutdown(wait=False)
+        await self.timeline.stop()
+        await task_log_writer.stop()
         logger.info("Scheduler stopped")
 
     # ==================== 任务管理 ====================
 
-    def add_job(self, project: Project):
-        """添加或更新一个项目的调度任务"""
+    def add_job(self, project: Project | ProjectSnapshot):
+        """添加或更新一个项目的调度任务（只读取调度字段，ORM 对象或快照均可）"""
         job_id = f"project_{project.id}"
 
-        # 移除旧任务
-        if self.scheduler.get_job(job_id):
-            self.scheduler.remove_job(job_id)
-
-        if not project.is_enabled:
+        trigger = build_trigger(project.schedule_type, project.schedule_rule) if project.is_enabled else None
+        if trigger is None:
+            # 移除旧任务
+            if self.scheduler.get_job(job_id):
+                self.scheduler.remove_job(job_id)
+            if project.is_enabled:
+                logger.error(f"Invalid schedule rule: {project.schedule_type} {project.schedule_rule}")
+            else:
+                # 停用项目时取消尚未发送完的运行
+                self.timeline.cancel_project(project.id)
             return
 
-        if project.schedule_type == "cron":
-            parts = project.schedule_rule.strip().split()
-            if len(parts) != 5:
-                logger.error(f"Invalid cron rule: {project.schedule_rule}")
-                return
-            self.scheduler.add_job(
-                self._execute_project,
-                "cron",
-                args=[project.id],
-                id=job_id,
-                minute=parts[0],
-                hour=parts[1],
-                day=parts[2],
-                month=parts[3],
-                day_of_week=parts[4],
-                replace_existing=True,
-                misfire_grace_time=300,
-            )
-        elif project.schedule_type == "interval":
-            seconds = int(project.schedule_rule)
-            self.scheduler.add_job(
-                self._execute_project,
-                "interval",
-                args=[project.id],
-                id=job_id,
-                seconds=seconds,
-                replace_existing=True,
-                misfire_grace_time=30,
-            )
+        self.scheduler.add_job(
+            run_project,
+            trigger,
+            args=[project.id],
+            kwargs={"version": job_version(project)},
+            id=job_id,
+            replace_existing=True,
+            misfire_grace_time=300 if project.schedule_type == "cron" else 30,
+        )
 
         logger.info(f"Job added: {project.name} ({project.schedule_type}: {project.schedule_rule})")
 
@@ -100,149 +217,300 @@ class SchedulerService:
         if self.scheduler.get_job(job_id):
             self.scheduler.remove_job(job_id)
             logger.info(f"Job removed: project #{project_id}")
+        self._prewarmed.pop(job_id, None)
+        self.timeline.cancel_project(project_id)
+
+    async def execute_now(self, project_id: int) -> Optional[TimelineRun]:
+        """立即手动执行一次项目任务（跳过随机延迟），等待运行结束并返回这次运行
+
+        手动执行不受重叠检查限制：定时运行尚未结束时也会另起一次运行，返回的是手动这一次的结果。
+        """
+        run = await self._execute_project(project_id, skip_delay=True)
+        if run is None:
+            return None
+        await run.finished
+        # 让调用方随后查询日志时能看到本次运行的记录
+        await task_log_writer.flush()
+        return run
+
+    def stats(self) -> dict:
+        return {
+            "jobstore": SCHEDULER_JOBSTORE,
+            "catchup": {"policy": SCHEDULER_CATCHUP, **self.catchup_stats},
+            "overlap_skipped": self.overlap_skipped,
+            "timeline": self.timeline.stats(),
+            "task_log": task_log_writer.stats(),
+        }
+
+    def upcoming_account_runs(self) -> dict[int, float]:
+        """计算每个账号最近一次定时任务距今的秒数（用于启动时的重连排序）"""
+        now = datetime.now(timezone.utc)
+        result: dict[int, float] = {}
+        for p in load_snapshots():
+            trigger = build_trigger(p.schedule_type, p.schedule_rule)
+            next_time = trigger.get_next_fire_time(None, now) if trigger else None
+            if next_time is None:
+                continue
+            seconds = (next_time - now).total_seconds()
+            for acc in p.accounts:
+                if seconds < result.get(acc.id, float("inf")):
+                    result[acc.id] = seconds
+        return result
+
+    # ==================== 连接预热 ====================
+
+    async def _prewarm_loop(self):
+        # 扫描间隔取提前量的一半，保证每次触发前至少被扫描到一次
+        interval = max(1.0, min(30.0, SCHEDULER_PREWARM_LEAD / 2))
+        while True:
+            try:
+                await self._prewarm_due()
+            except Exception as e:
+                logger.error(f"Prewarm failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def _prewarm_due(self):
+        """预热即将在提前量内触发的项目"""
+        horizon = datetime.now(timezone.utc) + timedelta(seconds=SCHEDULER_PREWARM_LEAD)
+        due: list[int] = []
+        for job_id, next_run_time in self._job_times(horizon):
+            if not job_id.startswith("project_") or self._prewarmed.get(job_id) == next_run_time:
+                continue
+            self._prewarmed[job_id] = next_run_time
+            due.append(int(job_id.removeprefix("project_")))
+        if not due:
+            return
 
-    async def execute_now(self, project_id: int) -> list[dict]:
-        """立即手动执行一次项目任务（跳过随机延迟），返回执行结果列表"""
-        return await self._execute_project(project_id, skip_delay=True)
-
-    # ==================== 内部方法 ====================
-
-    async def _load_projects(self):
-        """从数据库加载所有启用的项目"""
+        # 账号 -> 需要解析的目标（多个项目共用账号时合并）
+        pending: dict[int, set[str]] = {}
+        for p in load_snapshots(due):
+            targets = [t.bot for t in p.targets]
+            for acc in p.active_accounts:
+                if acc.is_logged_in:
+                    pending.setdefault(acc.id, set()).update(targets)
+
+        sem = asyncio.Semaphore(max(1, RECONNECT_CONCURRENCY))
+
+        async def warm(account_id: int, targets: set[str]):
+            async with sem:
+                try:
+                    ok = await client_manager.prewarm(account_id, sorted(targets))
+                except Exception as e:
+                    logger.warning(f"Prewarm account #{account_id} failed: {e}")
+                    ok = False
+            scheduler_prewarm.inc("success" if ok else "failure")
+
+        await asyncio.gather(*(warm(aid, ts) for aid, ts in pending.items()))
+        logger.info(f"Prewarmed {len(pending)} account(s) for project(s) {due}")
+
+    def _job_times(self, horizon: datetime) -> list[tuple[str, datetime]]:
+        """在 horizon 之前触发的任务及其下次触发时间"""
+        if self._jobstore is None:
+            return [
+                (job.id, job.next_run_time) for job in self.scheduler.get_jobs()
+                if job.next_run_time is not None and job.next_run_time <= horizon
+            ]
+        # 持久化任务只读 ID 和时间列，不反序列化任务
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(_job_table.c.id, _job_table.c.next_run_time)
+                .where(_job_table.c.next_run_time <= horizon.timestamp())
+            ).all()
+        return [(job_id, datetime.fromtimestamp(ts, timezone.utc)) for job_id, ts in rows]
+
+    # ==================== 任务同步与补跑 ====================
+
+    def _sync_jobs(self) -> dict[int, int]:
+        """按 updated_at 增量同步任务，返回需要补跑的项目及次数"""
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        jobs = {job.id: job for job in self.scheduler.get_jobs() if job.id.startswith("project_")}
         db = SessionLocal()
         try:
-            projects = db.query(Project).filter(Project.is_enabled == True).all()
-            for p in projects:
-                self.add_job(p)
+            rows = db.query(Project.id, Project.updated_at).filter(Project.is_enabled == True).all()
         finally:
             db.close()
 
-    async def _execute_project(self, project_id: int, skip_delay: bool = False) -> list[dict]:
-        """执行一个项目：遍历子任务和账号，发送消息（定时任务含随机延迟，手动执行跳过延迟）"""
-        db = SessionLocal()
-        results = []
-
-        try:
-            project = db.query(Project).get(project_id)
-            if not project or not project.is_enabled:
-                return results
-
-            accounts = project.accounts if project.accounts else []
-            if not accounts:
-                logger.warning(f"Project '{project.name}': no accounts assigned")
-                return results
-
-            # 过滤启用的账号
-            active_accounts = [a for a in accounts if a.is_active]
-            if not active_accounts:
-                logger.info(f"Project '{project.name}': no active accounts")
-                return results
-
-            # 构建发信目标列表：优先用子任务，否则用项目主目标
-            subtask_list = sorted(project.subtasks, key=lambda s: s.sort_order) if project.subtasks else []
-            if subtask_list:
-                targets = [
-                    {"target_bot": s.target_bot, "message": s.message, "target_type": s.target_type}
-                    for s in subtask_list
-                ]
-            else:
-                targets = [
-                    {"target_bot": project.target_bot, "message": project.message, "target_type": project.target_type}
-                ]
-
-            if not skip_delay:
-                # 任务级随机抖动（使用项目配置，否则默认值）
-                jitter_min = project.jitter_min if project.jitter_min > 0 else DEFAULT_JITTER_MIN
-                jitter_max = project.jitter_max if project.jitter_max > 0 else DEFAULT_JITTER_MAX
-                if jitter_min > 0 and jitter_max > jitter_min:
-                    jitter = random.randint(jitter_min, jitter_max)
-                    logger.info(
-                        f"[{project.name}] jitter delay {jitter}s "
-                        f"before executing with {len(active_accounts)} accounts, {len(targets)} targets"
-                    )
-                    await asyncio.sleep(jitter)
-
-            for i, account in enumerate(active_accounts):
-                if not skip_delay:
-                    # 账号间随机间隔
-                    delay_min = project.account_delay_min if project.account_delay_min > 0 else DEFAULT_DELAY_MIN
-                    delay_max = project.account_delay_max if project.account_delay_max > 0 else DEFAULT_DELAY_MAX
-                    if i > 0 and delay_min > 0 and delay_max > delay_min:
-                        delay = random.randint(delay_min, delay_max)
-                        logger.info(f"[{project.name}] waiting {delay}s before next account...")
-                        await asyncio.sleep(delay)
-
-                # 对该账号发送所有子任务
-                for j, target in enumerate(targets):
-                    if j > 0 and not skip_delay:
-                        await asyncio.sleep(SUBTASK_DELAY)
-
-                    result = await self._send_for_account(db, project, account,
-                                                          target["target_bot"], target["message"],
-                                                          target.get("target_type", "bot"))
-                    results.append(result)
-
-        finally:
-            db.close()
+        changed: list[int] = []
+        catchup: dict[int, int] = {}
+        for project_id, updated_at in rows:
+            job = jobs.pop(f"project_{project_id}", None)
+            stale = job is None or job.kwargs.get("version") != (updated_at.isoformat() if updated_at else "")
+            if stale:
+                changed.append(project_id)
+            if job is None or job.next_run_time is None or job.next_run_time > now:
+                continue
+            # 停机期间改过的项目也按旧任务保存的触发时间计算错过的触发，再重新添加任务
+            count = self._missed_runs(job.trigger, job.next_run_time, now)
+            if count:
+                catchup[project_id] = count
+            if not stale:
+                # 跳过错过的触发，由补跑协程按策略执行
+                job.modify(next_run_time=job.trigger.get_next_fire_time(None, now))
+
+        # 项目已删除或停用
+        for job_id in jobs:
+            self.scheduler.remove_job(job_id)
+        for p in load_snapshots(changed):
+            self.add_job(p)
+        logger.info(
+            f"Scheduler synced {len(rows)} projects in {time.monotonic() - started:.2f}s: "
+            f"{len(changed)} added/updated, {len(jobs)} removed, {len(catchup)} to catch up"
+        )
+        return catchup
+
+    def _missed_runs(self, trigger, next_run_time: datetime, now: datetime) -> int:
+        """按补跑策略计算一个项目要补跑几次"""
+        times = missed_fire_times(trigger, next_run_time, now)
+        recent = [t for t in times if (now - t).total_seconds() <= SCHEDULER_CATCHUP_WINDOW]
+        if SCHEDULER_CATCHUP == "all":
+            count = len(recent)
+        elif SCHEDULER_CATCHUP == "latest":
+            count = min(1, len(recent))
+        else:
+            count = 0
+        self.catchup_stats["missed"] += len(times)
+        self.catchup_stats["queued"] += count
+        self.catchup_stats["skipped"] += len(times) - count
+        scheduler_catchup.inc("queued", amount=count)
+        scheduler_catchup.inc("skipped", amount=len(times) - count)
+        return count
+
+    async def _run_catchup(self, catchup: dict[int, int]):
+        """补跑错过的触发：同一项目依次执行，不同项目最多同时进行 SCHEDULER_CATCHUP_CONCURRENCY 个"""
+        sem = asyncio.Semaphore(max(1, SCHEDULER_CATCHUP_CONCURRENCY))
+
+        async def catch_up(project_id: int, count: int):
+            async with sem:
+                for _ in range(count):
+                    try:
+                        run = await self._execute_project(project_id)
+                        if run is not None:
+                            await run.finished
+                    except Exception as e:
+                        logger.error(f"Catch-up run of project #{project_id} failed: {e}")
+                    self.catchup_stats["finished"] += 1
+
+        logger.info(f"Catching up {sum(catchup.values())} missed run(s) of {len(catchup)} project(s)")
+        await asyncio.gather(*(catch_up(pid, n) for pid, n in catchup.items()))
 
-        return results
+    # ==================== 内部方法 ====================
 
-    async def _send_for_account(self, db: Session, project: Project, account: Account,
-                                 target_bot: str, message: str, target_type: str = "bot") -> dict:
+    def _on_job_event(self, event):
+        """记录触发延迟（计划时间到实际提交）；运行耗时在时间线结束时记录"""
+        project = event.job_id.removeprefix("project_")
+        now = datetime.now(timezone.utc)
+        for run_time in event.scheduled_run_times:
+            scheduler_fire_lag.observe(max(0.0, (now - run_time).total_seconds()), project)
+
+    async def _execute_project(self, project_id: int, skip_delay: bool = False) -> Optional[TimelineRun]:
+        """触发一个项目：算出整次运行的发送时间线并交给定时器（定时任务含随机延迟，手动执行跳过延迟）
+
+        只在读取项目快照时短暂打开数据库会话，任务协程随即结束，不再等待整次运行完成。
+        任务协程提前返回后 APScheduler 的 max_instances 不再起作用，上一次运行尚未结束时跳过本次定时触发，
+        避免同一批消息重复发送；手动执行（skip_delay）是用户明确要求的，不做这项检查。
+        """
+        active = None if skip_delay else self.timeline.active_run(project_id)
+        if active is not None:
+            self.overlap_skipped += 1
+            logger.warning(
+                f"[{active.project_name}] previous run #{active.id} still has {active.pending} pending send(s), "
+                f"skipping this fire"
+            )
+            return None
+        project = load_snapshot(project_id)
+        if not project or not project.is_enabled:
+            return None
+        if not project.accounts:
+            logger.warning(f"Project '{project.name}': no accounts assigned")
+            return None
+        # 只使用启用的账号
+        active_accounts = project.active_accounts
+        if not active_accounts:
+            logger.info(f"Project '{project.name}': no active accounts")
+            return None
+
+        parallelism = project.parallelism
+        jitter = 0
+        offsets = [0.0] * len(active_accounts)
+        if not skip_delay:
+            # 任务级随机抖动（使用项目配置，否则默认值）
+            jitter_min = project.jitter_min if project.jitter_min > 0 else DEFAULT_JITTER_MIN
+            jitter_max = project.jitter_max if project.jitter_max > 0 else DEFAULT_JITTER_MAX
+            if jitter_min > 0 and jitter_max > jitter_min:
+                jitter = random.randint(jitter_min, jitter_max)
+            # 账号间随机间隔
+            delay_min = project.account_delay_min if project.account_delay_min > 0 else DEFAULT_DELAY_MIN
+            delay_max = project.account_delay_max if project.account_delay_max > 0 else DEFAULT_DELAY_MAX
+            if delay_min > 0 and delay_max > delay_min:
+                offsets = start_offsets(len(active_accounts), delay_min, delay_max, parallelism)
+
+        # 每个账号依次发送所有子任务（子任务间隔 SUBTASK_DELAY）
+        subtask_delay = 0 if skip_delay else SUBTASK_DELAY
+        run = self.timeline.create_run(project, manual=skip_delay, send_gap=subtask_delay)
+        entries = [
+            (jitter + offset + j * subtask_delay, i, j)
+            for i, offset in enumerate(offsets)
+            for j in range(len(project.targets))
+        ]
+        self.timeline.submit(run, entries)
+        logger.info(
+            f"[{project.name}] timeline #{run.id}: {len(entries)} send(s) for {len(active_accounts)} accounts, "
+            f"jitter {jitter}s, spread over {offsets[-1]:.0f}s (parallelism {parallelism})"
+        )
+        return run
+
+    def _on_run_finished(self, run: TimelineRun):
+        """记录一次运行的墙钟耗时（不含任务级抖动）"""
+        summary = run.to_dict()
+        self.last_runs[run.project_id] = summary
+        if run.first_sent is not None:
+            # 从第一次发送开始计时，与 last_runs 中的耗时一致
+            scheduler_run_duration.observe(run.duration, str(run.project_id))
+        logger.info(
+            f"[{run.project_name}] timeline #{run.id} {'cancelled' if run.cancelled else 'finished'} "
+            f"in {summary['duration']:.1f}s: {summary['success']}/{run.total} succeeded "
+            f"({summary['accounts']} accounts, parallelism {run.parallelism})"
+        )
+
+    async def _send_entry(self, run: TimelineRun, account_idx: int, target_idx: int) -> dict:
+        """时间线到期的一条发送"""
+        return await self._send_for_account(run.project, run.accounts[account_idx], run.targets[target_idx])
+
+    async def _send_for_account(self, project: ProjectSnapshot, account: AccountRef, target: SendTarget) -> dict:
         """通过单个账号发送消息到指定目标"""
         now = datetime.now(timezone.utc)
 
         try:
-            # 确保客户端已连接
+            # 确保客户端已连接（通常已由预热连上）
             if not client_manager.is_connected(account.id):
                 logger.info(f"Account '{account.name}' not connected, reconnecting...")
-                ok = await client_manager.start_client(account)
-                if not ok:
+                db = SessionLocal()
+                try:
+                    orm_account = db.query(Account).get(account.id)
+                finally:
+                    db.close()
+                if not orm_account or not await client_manager.start_client(orm_account):
                     raise RuntimeError("Failed to connect")
-                await asyncio.sleep(2)
-
-            if not client_manager.is_connected(account.id):
-                raise RuntimeError("Account not connected after retry")
 
             # 发送消息
-            await client_manager.send_message(
-                account.id,
-                target_bot,
-                message,
-            )
+            await client_manager.send_message(account.id, target.bot, target.message)
 
             # 记录成功日志
-            log = TaskLog(
-                project_id=project.id,
-                account_id=account.id,
-                account_name=account.name,
-                project_name=project.name,
-                status="success",
-                detail=f"[{target_type}] → {target_bot}: {message}",
-                created_at=now,
+            task_log_writer.write(
+                project.id, account.id, project.name, account.name,
+                "success", f"[{target.type}] → {target.bot}: {target.message}", now,
             )
-            db.add(log)
-            db.commit()
 
-            logger.info(f"[{project.name}] {account.name} → {target_bot}: {message}")
-            return {"account": account.name, "target": target_bot, "status": "success"}
+            logger.info(f"[{project.name}] {account.name} → {target.bot}: {target.message}")
+            return {"account": account.name, "target": target.bot, "status": "success"}
 
         except Exception as e:
             err_msg = str(e)
-            log = TaskLog(
-                project_id=project.id,
-                account_id=account.id,
-                account_name=account.name,
-                project_name=project.name,
-                status="error",
-                detail=err_msg,
-                created_at=now,
-            )
-            db.add(log)
-            db.commit()
+            task_log_writer.write(project.id, account.id, project.name, account.name, "error", err_msg, now)
 
             logger.error(f"[{project.name}] {account.name} failed: {err_msg}")
-            return {"account": account.name, "target": target_bot, "status": "error", "message": err_msg}
+            return {"account": account.name, "target": target.bot, "status": "error", "message": err_msg}
 
 
 # 全局单例
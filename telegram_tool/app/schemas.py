@@ -11,6 +11,7 @@ class AccountCreate(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
     api_id: str = Field(..., min_length=1, max_length=50)
     api_hash: str = Field(..., min_length=1, max_length=100)
+    role: str = Field(default="forward", pattern="^(forward|schedule)$")
 
 
 class AccountUpdate(BaseModel):
@@ -18,6 +19,7 @@ class AccountUpdate(BaseModel):
     api_id: Optional[str] = Field(None, max_length=50)
     api_hash: Optional[str] = Field(None, max_length=100)
     is_active: Optional[bool] = None
+    role: Optional[str] = Field(None, pattern="^(forward|schedule)$")
 
 
 class AccountResponse(BaseModel):
@@ -32,6 +34,7 @@ class AccountResponse(BaseModel):
     first_name: str = ""
     is_logged_in: bool
     is_active: bool
+    role: str = "forward"
     created_at: datetime
     updated_at: datetime
 
@@ -69,6 +72,28 @@ class ForwardConfigResponse(BaseModel):
         from_attributes = True
 
 
+class ForwardRuleCreate(BaseModel):
+    name: str = Field(default="", max_length=100)
+    sender_filters: List[str] = []
+    chat_types: List[str] = Field(default=["private"])
+    account_ids: List[int] = []
+    target_chat_ids: List[int] = Field(..., min_length=1)
+    copy_mode: bool = False
+    is_enabled: bool = True
+    sort_order: int = 0
+
+
+class ForwardRuleUpdate(BaseModel):
+    name: Optional[str] = Field(None, max_length=100)
+    sender_filters: Optional[List[str]] = None
+    chat_types: Optional[List[str]] = None
+    account_ids: Optional[List[int]] = None
+    target_chat_ids: Optional[List[int]] = Field(None, min_length=1)
+    copy_mode: Optional[bool] = None
+    is_enabled: Optional[bool] = None
+    sort_order: Optional[int] = None
+
+
 # ============ 项目 ============
 
 class ProjectCreate(BaseModel):
@@ -82,6 +107,7 @@ class ProjectCreate(BaseModel):
     jitter_max: int = Field(default=0, ge=0, le=43200)
     account_delay_min: int = Field(default=0, ge=0, le=43200)
     account_delay_max: int = Field(default=0, ge=0, le=43200)
+    parallelism: int = Field(default=1, ge=1, le=100)
 
 
 class ProjectUpdate(BaseModel):
@@ -96,6 +122,7 @@ class ProjectUpdate(BaseModel):
     jitter_max: Optional[int] = Field(None, ge=0, le=43200)
     account_delay_min: Optional[int] = Field(None, ge=0, le=43200)
     account_delay_max: Optional[int] = Field(None, ge=0, le=43200)
+    parallelism: Optional[int] = Field(None, ge=1, le=100)
     sort_order: Optional[int] = None
 
 
@@ -117,6 +144,7 @@ class ProjectResponse(BaseModel):
     jitter_max: int = 0
     account_delay_min: int = 0
     account_delay_max: int = 0
+    parallelism: int = 1
     sort_order: int = 0
     subtasks: List["SubTaskResponse"] = []
     created_at: datetime
@@ -0,0 +1,268 @@
+"""定时发送时间线
+
+项目触发时一次性算出整次运行的发送计划（时间, 账号, 目标），交给一个全局的最小堆定时器，
+不再由任务协程在抖动、账号间隔、子任务间隔中逐个 sleep：
+- 每条待发送记录只是堆中的一个元组 (到期时刻, 序号, 运行ID, 账号序号, 目标序号)，
+  账号与目标的详细信息取自运行持有的项目快照（见 project_snapshot），按运行共享一份；
+- 单个调度协程只等待堆顶的到期时刻，新计划插入更早的记录时被唤醒；
+- 同一运行内同一账号的发送保持先后顺序，且与该账号上一次发送至少相隔 send_gap 秒，
+  前一条发送拖慢时后一条顺延，而不是紧跟着发出；整次运行同时进行的发送数受 parallelism 限制；
+- 运行可随时查看剩余计划或取消，取消后堆中的记录在出堆时惰性丢弃。
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable, Optional
+
+try:
+    from .project_snapshot import AccountRef, ProjectSnapshot, SendTarget
+except ImportError:
+    from project_snapshot import AccountRef, ProjectSnapshot, SendTarget
+
+logger = logging.getLogger(__name__)
+
+# 保留的已结束运行摘要条数
+HISTORY_SIZE = 50
+
+
+class TimelineRun:
+    """一次项目运行的发送计划"""
+
+    def __init__(self, run_id: int, project: ProjectSnapshot, manual: bool = False, send_gap: float = 0):
+        self.id = run_id
+        self.project = project
+        self.project_id = project.id
+        self.project_name = project.name
+        self.accounts: tuple[AccountRef, ...] = project.active_accounts
+        self.targets: tuple[SendTarget, ...] = project.targets
+        self.parallelism = project.parallelism
+        self.manual = manual
+        # 同一账号两次发送之间的最小间隔（秒）
+        self.send_gap = send_gap
+        self.created_at = datetime.now(timezone.utc)
+        self.created = time.monotonic()
+        self.first_sent: Optional[float] = None
+        self.ended: Optional[float] = None
+        self.total = 0
+        self.pending = 0
+        self.cancelled = False
+        self.results: list[dict] = []
+        self.finished: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._sem = asyncio.Semaphore(self.parallelism)
+        self._locks: dict[int, asyncio.Lock] = {}
+        # 账号序号 -> 上一次发送结束的时刻
+        self._last_sent: dict[int, float] = {}
+
+    def lock(self, account_idx: int) -> asyncio.Lock:
+        lock = self._locks.get(account_idx)
+        if lock is None:
+            lock = self._locks[account_idx] = asyncio.Lock()
+        return lock
+
+    @property
+    def duration(self) -> float:
+        """墙钟耗时：第一次发送到结束（不含任务级抖动）"""
+        if self.first_sent is None:
+            return 0.0
+        return (self.ended or time.monotonic()) - self.first_sent
+
+    def to_dict(self) -> dict:
+        success = sum(1 for r in self.results if r["status"] == "success")
+        return {
+            "id": self.id,
+            "project_id": self.project_id,
+            "project_name": self.project_name,
+            "created_at": self.created_at.isoformat(),
+            "manual": self.manual,
+            "parallelism": self.parallelism,
+            "accounts": len(self.accounts),
+            "total": self.total,
+            "pending": self.pending,
+            "success": success,
+            "error": len(self.results) - success,
+            "cancelled": self.cancelled,
+            "duration": round(self.duration, 1),
+        }
+
+
+class SendTimeline:
+    """全局最小堆定时器"""
+
+    def __init__(self, send: Callable[[TimelineRun, int, int], Awaitable[dict]],
+                 on_finish: Optional[Callable[[TimelineRun], None]] = None):
+        # send(run, 账号序号, 目标序号) -> 结果字典
+        self._send = send
+        self._on_finish = on_finish
+        self._heap: list[tuple[float, int, int, int, int]] = []
+        self._seq = itertools.count()
+        self._run_ids = itertools.count(1)
+        self.runs: dict[int, TimelineRun] = {}
+        self.history: deque[dict] = deque(maxlen=HISTORY_SIZE)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set[asyncio.Task] = set()
+        self.counters: dict[str, int] = {"scheduled": 0, "dispatched": 0, "cancelled": 0, "submitted_runs": 0}
+
+    # ==================== 提交与取消 ====================
+
+    def create_run(self, project: ProjectSnapshot, manual: bool = False, send_gap: float = 0) -> TimelineRun:
+        return TimelineRun(next(self._run_ids), project, manual, send_gap)
+
+    def submit(self, run: TimelineRun, entries: Iterable[tuple[float, int, int]]) -> TimelineRun:
+        """提交运行计划：entries 为 (距现在的秒数, 账号序号, 目标序号)"""
+        now = time.monotonic()
+        heap = self._heap
+        for offset, account_idx, target_idx in entries:
+            heapq.heappush(heap, (now + offset, next(self._seq), run.id, account_idx, target_idx))
+            run.total += 1
+        run.pending = run.total
+        self.counters["scheduled"] += run.total
+        self.counters["submitted_runs"] += 1
+        self.runs[run.id] = run
+        if not run.total:
+            self._finish(run)
+            return run
+        self._ensure_task()
+        self._wakeup.set()
+        return run
+
+    def cancel(self, run_id: int) -> Optional[TimelineRun]:
+        """取消一次运行：尚未开始的发送全部丢弃，进行中的发送不受影响"""
+        run = self.runs.get(run_id)
+        if run is None:
+            return None
+        run.cancelled = True
+        self.counters["cancelled"] += run.pending
+        logger.info(f"Timeline run #{run_id} ({run.project_name}) cancelled, {run.pending} send(s) dropped")
+        self._finish(run)
+        return run
+
+    def active_run(self, project_id: int) -> Optional[TimelineRun]:
+        """项目尚未结束的运行"""
+        for run in self.runs.values():
+            if run.project_id == project_id:
+                return run
+        return None
+
+    def cancel_project(self, project_id: int) -> int:
+        runs = [r.id for r in self.runs.values() if r.project_id == project_id]
+        for run_id in runs:
+            self.cancel(run_id)
+        return len(runs)
+
+    def _finish(self, run: TimelineRun):
+        run.ended = time.monotonic()
+        self.runs.pop(run.id, None)
+        self.history.append(run.to_dict())
+        if not run.finished.done():
+            run.finished.set_result(run.results)
+        if self._on_finish:
+            try:
+                self._on_finish(run)
+            except Exception as e:
+                logger.error(f"Timeline finish callback failed: {e}")
+
+    # ==================== 调度 ====================
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        heap = self._heap
+        while True:
+            # 丢弃已取消运行的记录
+            while heap and heap[0][2] not in self.runs:
+                heapq.heappop(heap)
+            self._wakeup.clear()
+            if not heap:
+                await self._wakeup.wait()
+                continue
+            delay = heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, run_id, account_idx, target_idx = heapq.heappop(heap)
+            task = asyncio.create_task(self._dispatch(self.runs[run_id], account_idx, target_idx))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, run: TimelineRun, account_idx: int, target_idx: int):
+        # 同一账号按计划顺序发送，并与上一次发送保持 send_gap 间隔；整次运行的并发受 parallelism 限制
+        async with run.lock(account_idx):
+            last = run._last_sent.get(account_idx)
+            if last is not None and run.send_gap > 0:
+                wait = last + run.send_gap - time.monotonic()
+                if wait > 0:
+                    # 在账号锁内等待（不占用并发名额），同一账号的后续发送随之顺延
+                    await asyncio.sleep(wait)
+            async with run._sem:
+                if run.cancelled:
+                    return
+                if run.first_sent is None:
+                    run.first_sent = time.monotonic()
+                self.counters["dispatched"] += 1
+                try:
+                    result = await self._send(run, account_idx, target_idx)
+                except Exception as e:
+                    name = run.accounts[account_idx].name
+                    logger.error(f"[{run.project_name}] send for {name} crashed: {e}")
+                    result = {"account": name, "target": run.targets[target_idx].bot, "status": "error", "message": str(e)}
+                run._last_sent[account_idx] = time.monotonic()
+        run.results.append(result)
+        if run.cancelled:
+            return
+        run.pending -= 1
+        if run.pending <= 0:
+            self._finish(run)
+
+    async def stop(self):
+        tasks = list(self._inflight)
+        if self._task:
+            tasks.append(self._task)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        for run in list(self.runs.values()):
+            self.cancel(run.id)
+        self._heap.clear()
+
+    # ==================== 查询 ====================
+
+    def entries(self, run_id: int) -> Optional[list[dict]]:
+        """某次运行尚未开始的发送（按到期时间排序）"""
+        run = self.runs.get(run_id)
+        if run is None:
+            return None
+        now = time.monotonic()
+        pending = sorted(e for e in self._heap if e[2] == run_id)
+        return [
+            {
+                "in_seconds": round(max(0.0, due - now), 1),
+                "account_id": run.accounts[a].id,
+                "account": run.accounts[a].name,
+                "target": run.targets[t].bot,
+                "message": run.targets[t].message,
+            }
+            for due, _, _, a, t in pending
+        ]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "heap_size": len(self._heap),
+            "next_due_in": round(self._heap[0][0] - now, 1) if self._heap else None,
+            "inflight": len(self._inflight),
+            **self.counters,
+            "runs": [r.to_dict() for r in self.runs.values()],
+            "history": list(self.history),
+        }
@@ -0,0 +1,412 @@
+"""统一的 Telethon 会话存储
+
+默认每个账号使用一个 data/sessions/<session_name>.session SQLite 文件，账号多时意味着大量文件句柄、
+实体缓存更新时频繁 fsync、冷启动时逐个打开文件。SESSION_BACKEND=database 时改为：
+
+- 授权密钥、实体缓存、更新状态统一存入主数据库的 telegram_sessions / telegram_entities /
+  telegram_update_states 三张表；
+- 启动时一次性读入内存，Telethon 的所有读取都走内存索引（按 ID / 用户名 / 手机号 / 名称的字典）；
+- 写入先进入脏数据缓冲，由后台协程每隔 SESSION_FLUSH_MS 在线程中批量 upsert；
+  授权密钥变化（登录、切换数据中心）会立即触发一次写入；
+- 打开会话时若数据库中没有记录但存在旧的 .session 文件，自动导入并把文件改名为 .session.migrated。
+"""
+
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.tl import types
+
+try:
+    from .config import SESSION_DIR, SESSION_FLUSH_MS
+    from .database import engine
+    from .models import TelegramSession, TelegramEntity, TelegramUpdateState
+except ImportError:
+    from config import SESSION_DIR, SESSION_FLUSH_MS
+    from database import engine
+    from models import TelegramSession, TelegramEntity, TelegramUpdateState
+
+logger = logging.getLogger(__name__)
+
+_sessions = TelegramSession.__table__
+_entities = TelegramEntity.__table__
+_states = TelegramUpdateState.__table__
+
+SESSION_EXTENSION = ".session"
+
+
+def _state_to_row(state) -> tuple[int, int, int, int]:
+    return state.pts, state.qts, int(state.date.timestamp()), state.seq
+
+
+def _row_to_state(row: tuple) -> types.updates.State:
+    pts, qts, date, seq = row
+    return types.updates.State(
+        pts=pts, qts=qts, date=datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc),
+        seq=seq, unread_count=0,
+    )
+
+
+class DatabaseSession(MemorySession):
+    """读取全部走内存、写入交给 SessionStore 批量落库的 Telethon 会话"""
+
+    def __init__(self, store: "SessionStore", name: str, data: dict):
+        super().__init__()
+        self.store = store
+        self.name = name
+        self.save_entities = True
+        self._by_id: dict[int, tuple] = {}
+        self._by_username: dict[str, tuple] = {}
+        self._by_phone: dict[str, tuple] = {}
+        self._by_name: dict[str, tuple] = {}
+
+        session = data.get("session")
+        if session:
+            self._dc_id, self._server_address, self._port, key, self._takeout_id = session
+            self._auth_key = AuthKey(data=key) if key else None
+        for row in data.get("entities", {}).values():
+            self._index(row)
+        self._update_states = {eid: _row_to_state(r) for eid, r in data.get("states", {}).items()}
+
+    # ==================== 会话信息 ====================
+
+    def _persist_session(self):
+        self.store.mark_session(self.name, (
+            self._dc_id, self._server_address, self._port,
+            self._auth_key.key if self._auth_key else b"", self._takeout_id,
+        ))
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._persist_session()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._persist_session()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._persist_session()
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self.store.mark_state(self.name, entity_id, _state_to_row(state))
+
+    def save(self):
+        self.store.request_flush()
+
+    def delete(self):
+        # Telethon 同步调用（如 log_out）：先丢弃待写入的记录，数据库删除交给后台
+        self.store.delete_soon(self.name)
+        return True
+
+    # ==================== 实体缓存 ====================
+
+    def _index(self, row: tuple):
+        eid, ehash, username, phone, name = row
+        old = self._by_id.get(eid)
+        if old is not None:
+            # 用户名等变更后移除旧索引
+            for index, value in ((self._by_username, old[2]), (self._by_phone, old[3]), (self._by_name, old[4])):
+                if value and index.get(value) is old:
+                    del index[value]
+        self._by_id[eid] = row
+        if username:
+            self._by_username[username] = row
+        if phone:
+            self._by_phone[phone] = row
+        if name:
+            self._by_name[name] = row
+
+    def process_entities(self, tlo):
+        if not self.save_entities:
+            return
+        changed = []
+        for row in self._entities_to_rows(tlo):
+            if self._by_id.get(row[0]) != row:
+                self._index(row)
+                changed.append(row)
+        if changed:
+            self.store.mark_entities(self.name, changed)
+
+    def get_entity_rows_by_phone(self, phone):
+        row = self._by_phone.get(phone)
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_username(self, username):
+        row = self._by_username.get(username)
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_name(self, name):
+        row = self._by_name.get(name)
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            row = self._by_id.get(id)
+            return (row[0], row[1]) if row else None
+        from telethon import utils
+        for peer in (types.PeerUser(id), types.PeerChat(id), types.PeerChannel(id)):
+            row = self._by_id.get(utils.get_peer_id(peer))
+            if row:
+                return row[0], row[1]
+        return None
+
+
+class SessionStore:
+    """所有账号共用的会话存储：内存读取 + 批量写入"""
+
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._data: Optional[dict[str, dict]] = None
+        self._dirty_sessions: dict[str, tuple] = {}
+        self._dirty_entities: dict[str, dict[int, tuple]] = {}
+        self._dirty_states: dict[str, dict[int, tuple]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 批量写入与删除、迁移互斥：删除前进行中的写入必须已落库，否则会把已删除的会话写回
+        self._lock = asyncio.Lock()
+        self.counters: dict[str, int] = {"flushes": 0, "rows_written": 0, "migrated": 0}
+
+    # ==================== 读取 ====================
+
+    def load(self):
+        """一次性读入所有会话（每张表一次查询）"""
+        data: dict[str, dict] = {}
+        with engine.connect() as conn:
+            for r in conn.execute(select(_sessions)):
+                data.setdefault(r.session_name, {})["session"] = (
+                    r.dc_id, r.server_address, r.port, r.auth_key, r.takeout_id,
+                )
+            for r in conn.execute(select(_entities)):
+                data.setdefault(r.session_name, {}).setdefault("entities", {})[r.entity_id] = (
+                    r.entity_id, r.hash, r.username, r.phone, r.name,
+                )
+            for r in conn.execute(select(_states)):
+                data.setdefault(r.session_name, {}).setdefault("states", {})[r.entity_id] = (
+                    r.pts, r.qts, r.date, r.seq,
+                )
+        self._data = data
+        logger.info(f"Session store loaded: {len(data)} session(s)")
+
+    async def open(self, name: str) -> DatabaseSession:
+        """打开（必要时从旧 .session 文件迁移）一个会话；读库和迁移在线程中执行"""
+        if self._data is None:
+            await asyncio.to_thread(self.load)
+        if name not in self._data:
+            legacy = SESSION_DIR / f"{name}{SESSION_EXTENSION}"
+            async with self._lock:
+                if name not in self._data and legacy.exists():
+                    self._data[name] = await asyncio.to_thread(self._import_file, name, legacy)
+        return DatabaseSession(self, name, self._data.setdefault(name, {}))
+
+    def _import_file(self, name: str, path: Path) -> dict:
+        """把旧的 .session 文件导入数据库，成功后改名保留"""
+        conn = sqlite3.connect(str(path))
+        try:
+            session = conn.execute(
+                "select dc_id, server_address, port, auth_key, takeout_id from sessions"
+            ).fetchone()
+            entities = conn.execute("select id, hash, username, phone, name from entities").fetchall()
+            try:
+                states = conn.execute("select id, pts, qts, date, seq from update_state").fetchall()
+            except sqlite3.OperationalError:
+                states = []
+        finally:
+            conn.close()
+
+        data = {
+            "session": tuple(session) if session else None,
+            # 旧文件的 phone 列为整数亲和，统一转成字符串
+            "entities": {e[0]: (e[0], e[1], e[2], str(e[3]) if e[3] is not None else None, e[4]) for e in entities},
+            "states": {s[0]: (s[1], s[2], int(s[3] or 0), s[4]) for s in states},
+        }
+        self._write(
+            {name: data["session"]} if session else {},
+            {name: data["entities"]},
+            {name: data["states"]},
+        )
+        os.replace(path, path.with_name(path.name + ".migrated"))
+        self.counters["migrated"] += 1
+        logger.info(f"Session {name} migrated to database ({len(entities)} entities)")
+        return data
+
+    # ==================== 写入 ====================
+
+    def mark_session(self, name: str, row: tuple):
+        self._dirty_sessions[name] = row
+        self._cached(name)["session"] = row
+        # 授权密钥不能丢，尽快落库
+        self.request_flush()
+
+    def mark_entities(self, name: str, rows: list[tuple]):
+        dirty = self._dirty_entities.setdefault(name, {})
+        # 同步更新内存数据：同一进程内重新打开会话（重连、按需连接）时能读到最新的实体
+        cached = self._cached(name).setdefault("entities", {})
+        for row in rows:
+            dirty[row[0]] = row
+            cached[row[0]] = row
+        self._ensure_task()
+
+    def mark_state(self, name: str, entity_id: int, row: tuple):
+        self._dirty_states.setdefault(name, {})[entity_id] = row
+        self._cached(name).setdefault("states", {})[entity_id] = row
+        self._ensure_task()
+
+    def _cached(self, name: str) -> dict:
+        if self._data is None:
+            self._data = {}
+        return self._data.setdefault(name, {})
+
+    def request_flush(self):
+        self._ensure_task()
+        self._wakeup.set()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                # 不在事件循环中（如命令行迁移），直接同步写入
+                self._flush_sync()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _take_dirty(self) -> tuple[dict, dict, dict]:
+        dirty = self._dirty_sessions, self._dirty_entities, self._dirty_states
+        self._dirty_sessions, self._dirty_entities, self._dirty_states = {}, {}, {}
+        return dirty
+
+    async def flush(self):
+        if not (self._dirty_sessions or self._dirty_entities or self._dirty_states):
+            return
+        async with self._lock:
+            sessions, entities, states = self._take_dirty()
+            try:
+                await asyncio.to_thread(self._write, sessions, entities, states)
+            except Exception as e:
+                logger.error(f"Session store flush failed: {e}")
+                # 放回缓冲，下次重试（期间更新过的以新值为准）
+                for name, row in sessions.items():
+                    self._dirty_sessions.setdefault(name, row)
+                for name, rows in entities.items():
+                    for eid, row in rows.items():
+                        self._dirty_entities.setdefault(name, {}).setdefault(eid, row)
+                for name, rows in states.items():
+                    for eid, row in rows.items():
+                        self._dirty_states.setdefault(name, {}).setdefault(eid, row)
+
+    def _flush_sync(self):
+        if self._dirty_sessions or self._dirty_entities or self._dirty_states:
+            self._write(*self._take_dirty())
+
+    def _write(self, sessions: dict, entities: dict, states: dict):
+        """一个事务内批量 upsert"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        session_rows = [
+            {"session_name": name, "dc_id": r[0] or 0, "server_address": r[1], "port": r[2],
+             "auth_key": r[3], "takeout_id": r[4], "updated_at": now}
+            for name, r in sessions.items()
+        ]
+        entity_rows = [
+            {"session_name": name, "entity_id": r[0], "hash": r[1], "username": r[2],
+             "phone": r[3], "name": r[4], "date": int(now.timestamp())}
+            for name, rows in entities.items() for r in rows.values()
+        ]
+        state_rows = [
+            {"session_name": name, "entity_id": eid, "pts": r[0], "qts": r[1], "date": r[2], "seq": r[3]}
+            for name, rows in states.items() for eid, r in rows.items()
+        ]
+        with engine.begin() as conn:
+            for table, rows, keys in (
+                (_sessions, session_rows, ["session_name"]),
+                (_entities, entity_rows, ["session_name", "entity_id"]),
+                (_states, state_rows, ["session_name", "entity_id"]),
+            ):
+                if not rows:
+                    continue
+                stmt = sqlite_insert(table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=keys,
+                    set_={c: stmt.excluded[c] for c in rows[0] if c not in keys},
+                )
+                conn.execute(stmt, rows)
+        self.counters["flushes"] += 1
+        self.counters["rows_written"] += len(session_rows) + len(entity_rows) + len(state_rows)
+
+    def _drop(self, name: str):
+        """丢弃会话的内存数据和待写入记录"""
+        if self._data is not None:
+            self._data.pop(name, None)
+        self._dirty_sessions.pop(name, None)
+        self._dirty_entities.pop(name, None)
+        self._dirty_states.pop(name, None)
+
+    async def delete(self, name: str):
+        """删除会话（登出 / 删除账号）"""
+        self._drop(name)
+        async with self._lock:
+            # 等进行中的写入结束后再丢弃一次（写入失败时记录会被放回缓冲）
+            self._drop(name)
+            await asyncio.to_thread(self._delete_rows, name)
+
+    def delete_soon(self, name: str):
+        """同步上下文中的删除：立即丢弃待写入记录，数据库删除在后台执行"""
+        self._drop(name)
+        try:
+            asyncio.get_running_loop().create_task(self.delete(name))
+        except RuntimeError:
+            self._delete_rows(name)
+
+    @staticmethod
+    def _delete_rows(name: str):
+        with engine.begin() as conn:
+            for table in (_sessions, _entities, _states):
+                conn.execute(delete(table).where(table.c.session_name == name))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._data or {}),
+            "dirty_entities": sum(len(r) for r in self._dirty_entities.values()),
+            **self.counters,
+        }
+
+
+async def remove_session(session_name: str):
+    """删除一个账号的会话数据（数据库记录及 .session 文件）"""
+    await session_store.delete(session_name)
+    session_file = SESSION_DIR / f"{session_name}{SESSION_EXTENSION}"
+    for path in (session_file, session_file.with_name(session_file.name + "-journal")):
+        if path.exists():
+            path.unlink()
+
+
+# 全局单例
+session_store = SessionStore(SESSION_FLUSH_MS / 1000)
@@ -0,0 +1,282 @@
+"""多进程账号分片
+
+SHARD_COUNT > 1 时，API 进程不再直接持有 TelegramClient，而是启动 SHARD_COUNT 个子进程
+（shard_worker.py），账号按 account_id % SHARD_COUNT 分配到各分片，每个分片在自己的
+事件循环中运行一个完整的 ClientManager，MTProto 解密和更新解析分散到多个 CPU 核心。
+
+ShardCoordinator 实现与 ClientManager 相同的调用接口，按账号把请求路由到对应分片，
+需要全局信息的调用（规则刷新、统计等）则广播到所有分片后合并结果。
+进程间通信使用子进程的 stdin/stdout，每行一个 JSON 消息：
+- 请求：{"id": 1, "method": "start_client", "args": [...]}
+- 响应：{"id": 1, "result": ...} 或 {"id": 1, "error": "..."}
+- 状态推送：{"event": "status", "connected": [...], "clients": [...]}，用于同步的 is_connected 查询
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    from .latency import latency_report, merge_exports
+except ImportError:
+    from latency import latency_report, merge_exports
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).resolve().with_name("shard_worker.py")
+# 单行消息上限（统计信息可能较大）
+STREAM_LIMIT = 16 * 1024 * 1024
+# 子进程异常退出后重启前的等待（秒）
+RESTART_DELAY = 5
+
+
+def shard_of(account_id: int, count: int) -> int:
+    """账号所属分片"""
+    return account_id % count
+
+
+# call() 未指定 timeout 时使用 rpc_timeout
+DEFAULT_TIMEOUT = object()
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False, default=str).encode() + b"\n"
+
+
+class ShardProcess:
+    """一个分片子进程及其 RPC 通道"""
+
+    def __init__(self, index: int, count: int, rpc_timeout: float):
+        self.index = index
+        self.count = count
+        self.rpc_timeout = rpc_timeout
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.connected: set[int] = set()
+        self.clients: set[int] = set()
+        self.restarts = 0
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._reader: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._stopping = False
+
+    async def start(self):
+        env = {**os.environ, "SHARD_INDEX": str(self.index), "SHARD_COUNT": str(self.count)}
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, str(WORKER_SCRIPT),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            env=env, limit=STREAM_LIMIT,
+        )
+        self._reader = asyncio.create_task(self._read())
+        self._ready.set()
+        logger.info(f"Shard {self.index} started (pid {self.proc.pid})")
+
+    async def call(self, method: str, *args, timeout: Any = DEFAULT_TIMEOUT) -> Any:
+        """调用分片上的 ClientManager 方法并等待结果
+
+        timeout=None 表示不设超时：prepare、reconnect_all 这类方法耗时随账号数增长，
+        超时只会让调用方误判失败，而分片仍在继续执行。
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.rpc_timeout
+        await self._ready.wait()
+        msg_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = fut
+        try:
+            self.proc.stdin.write(encode({"id": msg_id, "method": method, "args": list(args)}))
+            await self.proc.stdin.drain()
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def _read(self):
+        stdout = self.proc.stdout
+        while True:
+            line = await stdout.readline()
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Shard {self.index}: invalid message ignored")
+                continue
+            if msg.get("event") == "status":
+                self.connected = set(msg["connected"])
+                self.clients = set(msg["clients"])
+                continue
+            fut = self._pending.get(msg.get("id"))
+            if fut is None or fut.done():
+                continue
+            if "error" in msg:
+                fut.set_exception(RuntimeError(msg["error"]))
+            else:
+                fut.set_result(msg.get("result"))
+
+        # 子进程退出：未完成的调用全部失败
+        self._ready.clear()
+        self.connected.clear()
+        self.clients.clear()
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"Shard {self.index} exited"))
+        code = await self.proc.wait()
+        if self._stopping:
+            return
+        logger.error(f"Shard {self.index} exited with code {code}, restarting in {RESTART_DELAY}s")
+        await asyncio.sleep(RESTART_DELAY)
+        self.restarts += 1
+        await self.start()
+        # 重启后的分片重新加载规则并恢复自己名下的账号
+        try:
+            await self.call("prepare", timeout=None)
+            await self.call("reconnect_all", None, timeout=None)
+        except Exception as e:
+            logger.error(f"Shard {self.index} recovery failed: {e}")
+
+    async def stop(self):
+        if not self.proc or self.proc.returncode is not None:
+            return
+        self._stopping = True
+        try:
+            await self.call("stop_all")
+        except Exception as e:
+            logger.warning(f"Shard {self.index} stop failed: {e}")
+        self.proc.stdin.close()
+        try:
+            await asyncio.wait_for(self.proc.wait(), 10)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+        if self._reader:
+            self._reader.cancel()
+
+
+class ShardCoordinator:
+    """在 API 进程中代替 ClientManager，把调用路由到各分片子进程"""
+
+    def __init__(self, count: int, rpc_timeout: float = 120):
+        self.count = count
+        self.shards = [ShardProcess(i, count, rpc_timeout) for i in range(count)]
+        self._started = False
+
+    def _shard(self, account_id: int) -> ShardProcess:
+        return self.shards[shard_of(account_id, self.count)]
+
+    async def _broadcast(self, method: str, *args, timeout: Any = DEFAULT_TIMEOUT) -> list:
+        return await asyncio.gather(*(s.call(method, *args, timeout=timeout) for s in self.shards))
+
+    # ==================== 生命周期 ====================
+
+    async def prepare(self):
+        """启动所有分片子进程，各自加载实体缓存和转发规则"""
+        if not self._started:
+            self._started = True
+            await asyncio.gather(*(s.start() for s in self.shards))
+        await self._broadcast("prepare", timeout=None)
+
+    async def reconnect_all(self, upcoming: Optional[dict[int, float]] = None):
+        await self._broadcast("reconnect_all", upcoming, timeout=None)
+
+    async def refresh_forward_handlers(self):
+        await self._broadcast("refresh_forward_handlers")
+
+    async def stop_all(self):
+        await asyncio.gather(*(s.stop() for s in self.shards))
+        logger.info("All shards stopped")
+
+    # ==================== 按账号路由 ====================
+
+    def has_client(self, account_id: int) -> bool:
+        return account_id in self._shard(account_id).clients
+
+    def is_connected(self, account_id: int) -> bool:
+        return account_id in self._shard(account_id).connected
+
+    async def start_client(self, account) -> bool:
+        return await self._shard(account.id).call("start_client", account.id)
+
+    async def stop_client(self, account_id: int):
+        await self._shard(account_id).call("stop_client", account_id)
+
+    async def send_message(self, account_id: int, target: str, message: str):
+        return await self._shard(account_id).call("send_message", account_id, target, message)
+
+    async def send_login_code(self, account_id: int, phone: str) -> dict:
+        return await self._shard(account_id).call("send_login_code", account_id, phone)
+
+    async def verify_login_code(self, account_id: int, phone: str, code: str, password: str = "") -> dict:
+        return await self._shard(account_id).call("verify_login_code", account_id, phone, code, password)
+
+    async def start_qr_login(self, account_id: int) -> dict:
+        return await self._shard(account_id).call("start_qr_login", account_id)
+
+    async def check_qr_login(self, account_id: int) -> dict:
+        return await self._shard(account_id).call("check_qr_login", account_id)
+
+    async def cancel_qr_login(self, account_id: int):
+        await self._shard(account_id).call("cancel_qr_login", account_id)
+
+    async def prewarm(self, account_id: int, targets: list[str]) -> bool:
+        return await self._shard(account_id).call("prewarm", account_id, targets)
+
+    async def logout_account(self, account_id: int):
+        await self._shard(account_id).call("logout_account", account_id)
+
+    async def forget_account(self, account_id: int):
+        await self._shard(account_id).call("forget_account", account_id)
+
+    # ==================== 统计汇总 ====================
+
+    async def reconnect_summary(self) -> dict:
+        counts: dict[str, int] = {}
+        accounts: dict = {}
+        for part in await self._broadcast("reconnect_summary"):
+            for status, n in part["counts"].items():
+                counts[status] = counts.get(status, 0) + n
+            accounts.update(part["accounts"])
+        return {"total": len(accounts), "counts": counts, "accounts": accounts}
+
+    async def connection_stats(self) -> dict:
+        merged: dict = {"states": {}, "accounts": {}}
+        for part in await self._broadcast("connection_stats"):
+            for state, n in part.pop("states").items():
+                merged["states"][state] = merged["states"].get(state, 0) + n
+            merged["accounts"].update(part.pop("accounts"))
+            # 其余为计数器
+            for key, value in part.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    async def entity_cache_stats(self) -> dict:
+        return {"shards": await self._broadcast("entity_cache_stats")}
+
+    async def forward_stats(self) -> dict:
+        return {"shards": await self._broadcast("forward_stats")}
+
+    async def latency_stats(self) -> dict:
+        return latency_report(merge_exports(await self._broadcast("latency_export")))
+
+    async def metric_groups(self) -> list[tuple[dict, list]]:
+        """各分片的指标族，附带 shard 标签"""
+        parts = await self._broadcast("metric_families")
+        return [({"shard": str(i)}, families) for i, families in enumerate(parts)]
+
+    async def loop_stats(self) -> list[dict]:
+        return await self._broadcast("loop_stats")
+
+    def shard_stats(self) -> list[dict]:
+        return [
+            {
+                "index": s.index,
+                "pid": s.proc.pid if s.proc else None,
+                "alive": bool(s.proc and s.proc.returncode is None),
+                "connected": len(s.connected),
+                "restarts": s.restarts,
+            }
+            for s in self.shards
+        ]
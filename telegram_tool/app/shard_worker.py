@@ -0,0 +1,179 @@
+"""分片子进程入口
+
+由 ShardCoordinator 以 `python shard_worker.py` 启动，环境变量 SHARD_INDEX / SHARD_COUNT
+指定本分片负责的账号。从 stdin 逐行读取 JSON 请求，调用本进程内的 ClientManager，
+结果写回 stdout；每次调用后推送一次连接状态。日志输出到 stderr。
+stdout 以异步管道写入并等待 drain，协调进程读取缓慢时只挂起写回的协程，不阻塞事件循环上的转发。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client_manager import client_manager  # noqa: E402
+from config import EVENT_LOOP  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from loop_monitor import loop_monitor, run  # noqa: E402
+from models import Account  # noqa: E402
+from shard import STREAM_LIMIT, encode  # noqa: E402
+
+logger = logging.getLogger("tg_forward.shard")
+
+# 状态推送间隔（秒），账号被连接监管者重连后也能及时同步
+STATUS_INTERVAL = 5
+
+
+def _load_account(account_id: int):
+    db = SessionLocal()
+    try:
+        return db.query(Account).get(account_id)
+    finally:
+        db.close()
+
+
+async def _start_client(account_id: int) -> bool:
+    acc = _load_account(account_id)
+    if not acc:
+        return False
+    return await client_manager.start_client(acc)
+
+
+async def _reconnect_all(upcoming):
+    # JSON 对象的键是字符串
+    upcoming = {int(k): v for k, v in upcoming.items()} if upcoming else None
+    await client_manager.reconnect_all(upcoming)
+
+
+async def _send_message(account_id: int, target: str, message: str):
+    sent = await client_manager.send_message(account_id, target, message)
+    return getattr(sent, "id", None)
+
+
+async def _loop_stats() -> dict:
+    return loop_monitor.stats()
+
+
+METHODS = {
+    "prepare": client_manager.prepare,
+    "reconnect_all": _reconnect_all,
+    "refresh_forward_handlers": client_manager.refresh_forward_handlers,
+    "stop_all": client_manager.stop_all,
+    "start_client": _start_client,
+    "stop_client": client_manager.stop_client,
+    "send_message": _send_message,
+    "prewarm": client_manager.prewarm,
+    "send_login_code": client_manager.send_login_code,
+    "verify_login_code": client_manager.verify_login_code,
+    "start_qr_login": client_manager.start_qr_login,
+    "check_qr_login": client_manager.check_qr_login,
+    "cancel_qr_login": client_manager.cancel_qr_login,
+    "logout_account": client_manager.logout_account,
+    "forget_account": client_manager.forget_account,
+    "reconnect_summary": client_manager.reconnect_summary,
+    "connection_stats": client_manager.connection_stats,
+    "entity_cache_stats": client_manager.entity_cache_stats,
+    "forward_stats": client_manager.forward_stats,
+    "loop_stats": _loop_stats,
+    "metric_families": client_manager.metric_families,
+    "latency_export": client_manager.latency_export,
+}
+
+
+class Channel:
+    """到协调进程的输出通道"""
+
+    def __init__(self, out):
+        self.out = out
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, self.out)
+        self.writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    async def send(self, message: dict):
+        self.writer.write(encode(message))
+        await self.writer.drain()
+
+    async def push_status(self):
+        await self.send({
+            "event": "status",
+            "connected": [aid for aid in client_manager.clients if client_manager.is_connected(aid)],
+            "clients": client_manager.client_ids(),
+        })
+
+
+async def _handle(channel: Channel, request: dict):
+    msg_id = request.get("id")
+    method = METHODS.get(request.get("method"))
+    try:
+        if method is None:
+            raise ValueError(f"Unknown method: {request.get('method')}")
+        result = await method(*request.get("args", []))
+        reply = {"id": msg_id, "result": result}
+    except Exception as e:
+        reply = {"id": msg_id, "error": str(e) or type(e).__name__}
+    # 先推送状态再回复，协调进程收到结果时 is_connected 已是最新
+    await channel.push_status()
+    await channel.send(reply)
+
+
+async def _status_loop(channel: Channel):
+    while True:
+        await asyncio.sleep(STATUS_INTERVAL)
+        await channel.push_status()
+
+
+async def serve(channel: Channel):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    await channel.open()
+
+    loop_monitor.start()
+    status_task = asyncio.create_task(_status_loop(channel))
+    tasks: set[asyncio.Task] = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning("Invalid request ignored")
+            continue
+        # 每个请求独立执行，慢调用（登录、连接）不阻塞其他请求
+        task = asyncio.create_task(_handle(channel, request))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    # 协调进程关闭了 stdin：清理后退出
+    status_task.cancel()
+    await client_manager.stop_all()
+    await loop_monitor.stop()
+    # 写完剩余回复后关闭管道
+    try:
+        await channel.writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    channel.writer.close()
+
+
+def main():
+    # stdout 专用于 IPC，其余输出（包括第三方库的 print）重定向到 stderr
+    channel = Channel(os.fdopen(os.dup(sys.stdout.fileno()), "wb"))
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [%(levelname)s] shard-{os.getenv('SHARD_INDEX')} %(name)s: %(message)s",
+    )
+    run(serve(channel), EVENT_LOOP)
+
+
+if __name__ == "__main__":
+    main()
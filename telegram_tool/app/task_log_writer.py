@@ -0,0 +1,143 @@
+"""任务日志批量写入
+
+定时发送的每条结果都要记一条 task_logs。逐条 add + commit 会在事件循环里同步等待一次 SQLite 提交，
+大项目一次运行几百条发送就是几百次 fsync。
+这里与转发发件箱相同采用组提交：日志先进入内存队列，后台协程每隔 flush_interval
+或攒够 batch_size 条后在线程中用一次 executemany 写入，发送协程不等待落盘。
+写入失败时整批放回队列头部，下一次提交重试，连续失败 MAX_FLUSH_ATTEMPTS 次后放弃该批。
+停止时把剩余日志全部写完。
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    from .database import engine
+    from .models import TaskLog
+    from .config import TASK_LOG_FLUSH_MS, TASK_LOG_BATCH_SIZE
+    from .metrics import registry, gauge, counter_family
+except ImportError:
+    from database import engine
+    from models import TaskLog
+    from config import TASK_LOG_FLUSH_MS, TASK_LOG_BATCH_SIZE
+    from metrics import registry, gauge, counter_family
+
+logger = logging.getLogger(__name__)
+
+_table = TaskLog.__table__
+
+# 同一批日志最多尝试写入的次数
+MAX_FLUSH_ATTEMPTS = 3
+
+
+class TaskLogWriter:
+    """组提交的任务日志写入器"""
+
+    def __init__(self, flush_interval: float = 0.5, batch_size: int = 200):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: list[dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._attempts = 0
+        self.counters: dict[str, int] = {"written": 0, "dropped": 0, "flushes": 0, "flush_errors": 0}
+
+    def write(self, project_id: int, account_id: Optional[int], project_name: str, account_name: str,
+              status: str, detail: str = "", created_at: Optional[datetime] = None):
+        """登记一条日志，不等待落盘"""
+        self._queue.append({
+            "project_id": project_id,
+            "account_id": account_id,
+            "project_name": project_name,
+            "account_name": account_name,
+            "status": status,
+            "detail": detail,
+            "created_at": created_at or datetime.now(timezone.utc),
+        })
+        self._ensure_task()
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """将队列中的日志写入数据库（一个事务）；写入失败且还可重试时返回 False"""
+        async with self._lock:
+            if not self._queue:
+                return True
+            rows, self._queue = self._queue, []
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception as e:
+                self._attempts += 1
+                self.counters["flush_errors"] += 1
+                if self._attempts < MAX_FLUSH_ATTEMPTS:
+                    # 整批放回队列头部，下一次提交重试
+                    logger.warning(
+                        f"Task log flush failed ({len(rows)} logs), "
+                        f"retrying (attempt {self._attempts}/{MAX_FLUSH_ATTEMPTS}): {e}"
+                    )
+                    self._queue[:0] = rows
+                    return False
+                # 日志只是记录，放弃写入不影响发送
+                self._attempts = 0
+                self.counters["dropped"] += len(rows)
+                logger.error(f"Task log flush failed {MAX_FLUSH_ATTEMPTS} times, {len(rows)} log(s) dropped: {e}")
+                return True
+            self._attempts = 0
+            self.counters["written"] += len(rows)
+            self.counters["flushes"] += 1
+            return True
+
+    @staticmethod
+    def _write(rows: list[dict]):
+        with engine.begin() as conn:
+            conn.execute(_table.insert(), rows)
+
+    async def stop(self):
+        """停止后台写入并落盘剩余日志"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 写入失败时按重试次数继续提交，直到成功或放弃
+        while not await self.flush():
+            await asyncio.sleep(self.flush_interval)
+
+    def collect_metrics(self) -> list:
+        return [
+            gauge("tgf_task_log_queue_depth", "Task logs waiting for group commit", [({}, len(self._queue))]),
+            counter_family("tgf_task_log_rows", "Task logs handled by the batched writer",
+                           [({"result": "written"}, self.counters["written"]),
+                            ({"result": "dropped"}, self.counters["dropped"])]),
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._queue),
+            "flush_interval_ms": self.flush_interval * 1000,
+            "batch_size": self.batch_size,
+            **self.counters,
+        }
+
+
+# 全局单例
+task_log_writer = TaskLogWriter(TASK_LOG_FLUSH_MS / 1000, TASK_LOG_BATCH_SIZE)
+registry.register_collector(task_log_writer.collect_metrics)